@@ -4,6 +4,8 @@ import asyncio
 import hashlib
 from datetime import datetime
 from telethon import TelegramClient
+import listings_store
+from keyword_matcher import KeywordMatcher
 
 API_ID = int(os.environ.get('TELETHON_API_ID', 0))
 API_HASH = os.environ.get('TELETHON_API_HASH', '')
@@ -38,24 +40,24 @@ def is_english_only(text):
             non_english_chars += 1
     return non_english_chars == 0
 
+SPAM_KEYWORDS = [
+    'deriv.com', 'synthetic indices', 'trading account',
+    'round-the-clock trading', 'forex', 'crypto trading',
+    'kumpulan video viral', 'full video', 'join grup', 'klik link',
+    'video-info-viral', 'join sekarang',
+    'rent account', 'rent linkedin', 'rent facebook', 'make money',
+    'passive income', 'rent out', 'advertising account',
+    'grow your business', 'promote message', 'promotion packages',
+    'reach more customers', 'boost visibility', 'drive engagement',
+    'anda ingin sukses', 'ubah cara berfikir', 'positive thinking',
+    'salam sukses', 'mulai sebelum orang',
+    'notif sms', 'hak cipta hack', 'bootloader', 'fingerprint'
+]
+SPAM_MATCHER = KeywordMatcher(SPAM_KEYWORDS)
+
 def is_spam(text):
     """Check if text is spam/promo"""
-    if not text:
-        return False
-    spam_keywords = [
-        'deriv.com', 'synthetic indices', 'trading account',
-        'round-the-clock trading', 'forex', 'crypto trading',
-        'kumpulan video viral', 'full video', 'join grup', 'klik link',
-        'video-info-viral', 'join sekarang',
-        'rent account', 'rent linkedin', 'rent facebook', 'make money',
-        'passive income', 'rent out', 'advertising account',
-        'grow your business', 'promote message', 'promotion packages',
-        'reach more customers', 'boost visibility', 'drive engagement',
-        'anda ingin sukses', 'ubah cara berfikir', 'positive thinking',
-        'salam sukses', 'mulai sebelum orang',
-        'notif sms', 'hak cipta hack', 'bootloader', 'fingerprint'
-    ]
-    return any(keyword in text.lower() for keyword in spam_keywords)
+    return SPAM_MATCHER.search(text)
 
 def get_image_hash(image_data):
     """Get hash of image"""
@@ -82,19 +84,14 @@ async def parse_additional_channels():
         
         # Парсим каждую страну
         for country, channels in ADDITIONAL_CHANNELS.items():
-            listings_file = f'listings_{country}.json'
-            
             # Load existing
-            existing = []
-            if os.path.exists(listings_file):
-                try:
-                    with open(listings_file, 'r', encoding='utf-8') as f:
-                        existing = json.load(f)
-                except:
-                    pass
+            try:
+                existing_ids = listings_store.get_listing_ids(country)
+            except Exception as e:
+                print(f"⚠️ {country}: база недоступна: {str(e)[:100]}")
+                continue
             
-            existing_ids = {item['id'] for item in existing}
-            existing_hashes = {item.get('image_hash') for item in existing if item.get('image_hash')}
+            new_items = []
             new_count = 0
             skipped_english = 0
             
@@ -148,7 +145,7 @@ async def parse_additional_channels():
                             'has_media': has_media,
                             'price': None
                         }
-                        existing.append(item)
+                        new_items.append(item)
                         existing_ids.add(item_id)
                         new_count += 1
                     
@@ -165,9 +162,8 @@ async def parse_additional_channels():
             
             # Save updated listings
             if new_count > 0:
-                with open(listings_file, 'w', encoding='utf-8') as f:
-                    json.dump(existing, f, ensure_ascii=False, indent=2)
-                print(f"✅ {country}: +{new_count} объявлений (всего {len(existing)})")
+                listings_store.insert_listings(country, new_items, front=False)
+                print(f"✅ {country}: +{new_count} объявлений (всего {len(existing_ids)})")
                 if skipped_english > 0:
                     print(f"   🚫 Отклонено англ.: {skipped_english}")
             
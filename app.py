@@ -1,5 +1,8 @@
-from flask import Flask, render_template, jsonify, request, Response
+from flask import Flask, render_template, jsonify, request, Response, make_response
 from datetime import datetime, timedelta
+import base64
+import bisect
+import functools
 import json
 import os
 import time
@@ -8,18 +11,36 @@ import re
 import hashlib
 from pathlib import Path
 import threading
-
-# Lock for file operations to prevent race conditions
-file_lock = threading.Lock()
-
-# Data cache to prevent heavy disk I/O
-data_cache = {}
-DATA_CACHE_TTL = 30 # Cache data for 30 seconds
+from flask.json.provider import DefaultJSONProvider
+import image_pipeline
+import listings_store
+import photo_jobs
+import search_index
+from listings_store import create_empty_data
+from listing_cities import CITY_NAMES
+from listing_facets import FACETS, facets_for
+from listing_filters import filter_listings
+from listing_indexes import SORT_ORDERS
+from query_cache import QueryCache
+import telegram_files
+from telegram_files import PhotoDiskCache, TelegramFileCache
+from blob_store import BlobStore
+from listing_model import Listing, json_default
 
 GOOGLE_AI_API_KEY = os.environ.get('GOOGLE_AI_API_KEY', '')
 translation_cache = {}
 
+class ListingJSONProvider(DefaultJSONProvider):
+    """jsonify умеет отдавать Listing из кэша объявлений"""
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, Listing):
+            return obj.to_dict()
+        return DefaultJSONProvider.default(obj)
+
 app = Flask(__name__, static_folder='static', static_url_path='/static')
+app.json = ListingJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET")
 
 online_users = {}
@@ -86,131 +107,74 @@ WELCOME_MESSAGE = """🌏 Крупнейший русскоязычный гид
 В нашем мини приложении вы можете добавить объявление или услугу!
 """
 
-# Данные хранятся в JSON файле по странам
+# Объявления хранятся в SQLite (listings_store.py), DATA_FILE - фоновый снимок всех стран
 DATA_FILE = "listings_data.json"
 
-def create_empty_data():
-    return {
-        "restaurants": [],
-        "tours": [],
-        "transport": [],
-        "real_estate": [],
-        "money_exchange": [],
-        "entertainment": [],
-        "marketplace": [],
-        "visas": [],
-        "news": [],
-        "medicine": [],
-        "kids": [],
-        "chat": []
-    }
-
 def load_data(country='vietnam'):
-    now = time.time()
-    if country in data_cache and now - data_cache[country]['time'] < DATA_CACHE_TTL:
-        return data_cache[country]['data']
-    
-    country_file = f"listings_{country}.json"
-    result = create_empty_data()
-    
-    if os.path.exists(country_file):
-        try:
-            with open(country_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, dict):
-                    result = data
-                else:
-                    # Если данные в файле - список, распределяем по категориям
-                    category_map = {
-                        'bikes': 'transport',
-                        'real_estate': 'real_estate',
-                        'exchange': 'money_exchange',
-                        'money_exchange': 'money_exchange',
-                        'food': 'restaurants',
-                        'restaurants': 'restaurants'
-                    }
-                    for item in data:
-                        if not isinstance(item, dict): continue
-                        cat = item.get('category', 'chat')
-                        mapped_cat = category_map.get(cat, cat)
-                        if mapped_cat in result:
-                            result[mapped_cat].append(item)
-        except Exception as e:
-            print(f"Error loading country file {country_file}: {e}")
-    
-    elif os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                all_data = json.load(f)
-                if country in all_data:
-                    result = all_data[country]
-        except Exception as e:
-            print(f"Error loading DATA_FILE for {country}: {e}")
-            
-    data_cache[country] = {'data': result, 'time': now}
-    return result
+    # Кэш страны и карта id живут в listings_store
+    try:
+        return listings_store.get_country(country)
+    except Exception as e:
+        print(f"Error loading listings for {country}: {e}")
+        return create_empty_data()
 
 def load_all_data():
-    now = time.time()
-    if 'all' in data_cache and now - data_cache['all']['time'] < DATA_CACHE_TTL:
-        return data_cache['all']['data']
-        
-    result = {
-        'vietnam': create_empty_data(),
-        'thailand': create_empty_data(),
-        'india': create_empty_data(),
-        'indonesia': create_empty_data()
-    }
-    
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                result = json.load(f)
-        except Exception as e:
-            print(f"Error loading DATA_FILE: {e}")
-            # Try to recover from country files if DATA_FILE is corrupted
-            for country in result.keys():
-                result[country] = load_data(country)
-            
-    data_cache['all'] = {'data': result, 'time': now}
-    return result
+    # Собирается по запросу из кэша стран; listings_data.json - только фоновый снимок
+    return {country: load_data(country) for country in listings_store.COUNTRIES}
 
 def save_data(country='vietnam', data=None):
     if not data or not isinstance(data, dict):
         return
     
-    with file_lock:
-        # Инвалидируем кэш
-        if country in data_cache:
-            del data_cache[country]
-        if 'all' in data_cache:
-            del data_cache['all']
-            
-        # Сохраняем в файл страны
-        country_file = f"listings_{country}.json"
-        try:
-            with open(country_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Error saving country file {country_file}: {e}")
-        
-        # Синхронизируем с общим файлом listings_data.json
-        try:
-            # Load current all_data without using load_all_data to avoid recursion or stale cache
-            all_data = {}
-            if os.path.exists(DATA_FILE):
-                with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                    all_data = json.load(f)
-            
-            all_data[country] = data
-            with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(all_data, f, ensure_ascii=False, indent=2)
-            
-            # Update cache
-            data_cache['all'] = {'data': all_data, 'time': time.time()}
-            data_cache[country] = {'data': data, 'time': time.time()}
-        except Exception as e:
-            print(f"Error syncing with listings_data.json: {e}")
+    # Сохраняем в базу - пишутся только изменившиеся объявления,
+    # listings_data.json пересобирается в фоне (listings_store.export_snapshot)
+    try:
+        listings_store.save_country(country, data)
+    except Exception as e:
+        print(f"Error saving listings for {country}: {e}")
+
+# Параметры-антикэш в URL не меняют ответ
+CACHE_BUSTER_PARAMS = frozenset(['_', '_t'])
+
+def file_tag(path):
+    """Метка файла: mtime и размер ('-' если файла нет)"""
+    try:
+        st = os.stat(path)
+        return f"{st.st_mtime_ns}:{st.st_size}"
+    except OSError:
+        return '-'
+
+def listings_tag():
+    """Версия объявлений страны из ?country= (одинакова во всех воркерах)"""
+    return listings_store.get_version_tag(request.args.get('country', 'vietnam'))
+
+def conditional_get(tag_func, cache_control='no-cache'):
+    """
+    ETag для GET-эндпоинта: метка данных tag_func() + путь и параметры запроса.
+    Совпал If-None-Match - 304 без вычисления ответа. cache_control -
+    заголовок Cache-Control успешного ответа.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                tag = tag_func()
+            except Exception as e:
+                print(f"ETag error {request.path}: {e}")
+                return view(*args, **kwargs)
+            params = sorted((k, v) for k, v in request.args.items(multi=True) if k not in CACHE_BUSTER_PARAMS)
+            etag = hashlib.md5(f"{tag}|{request.path}|{params}".encode('utf-8')).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
 
 @app.errorhandler(500)
 def handle_500(e):
@@ -409,7 +373,13 @@ def set_telegram_webhook():
     except Exception as e:
         return jsonify({'error': str(e)})
 
+def groups_stats_tag():
+    """Версия объявлений + файл статистики групп страны"""
+    country = request.args.get('country', 'thailand')
+    return f"{listings_store.get_version_tag(country)}:{file_tag(f'groups_stats_{country}.json')}"
+
 @app.route('/api/groups-stats')
+@conditional_get(groups_stats_tag)
 def groups_stats():
     """Статистика по группам: охват, онлайн, объявления"""
     country = request.args.get('country', 'thailand')
@@ -660,6 +630,7 @@ def edit_ads_channel():
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/status')
+@conditional_get(listings_tag)
 def status():
     country = request.args.get('country', 'vietnam')
     data = load_data(country)
@@ -686,7 +657,17 @@ def status():
         'online_count': online_counts.get(country, 100)
     })
 
+@app.route('/api/cache-stats')
+def cache_stats():
+    """Счётчики кэша объявлений этого воркера (перечитывания из базы и т.д.)"""
+    return jsonify({'pid': os.getpid(), 'listings': listings_store.get_stats(),
+                    'queries': listings_query_cache.stats(),
+                    'telegram_files': telegram_file_cache.stats(),
+                    'telegram_photos': telegram_photo_cache.stats(),
+                    'photo_jobs': photo_job_queue.stats()})
+
 @app.route('/api/city-counts/<category>')
+@conditional_get(listings_tag, 'public, max-age=15, must-revalidate')
 def get_city_counts(category):
     country = request.args.get('country', 'vietnam')
     data = load_data(country)
@@ -703,63 +684,13 @@ def get_city_counts(category):
     if category not in data:
         return jsonify({})
     
-    listings = data[category]
-    listings = [x for x in listings if not x.get('hidden', False)]
-    
-    # Расширенный маппинг всех вариантов названий городов
-    city_name_mapping = {
-        # Нячанг
-        'Nha Trang': 'Нячанг', 'nha trang': 'Нячанг', 'nhatrang': 'Нячанг', 'nha_trang': 'Нячанг', 'Нячанг': 'Нячанг', 'нячанг': 'Нячанг',
-        # Хошимин
-        'Saigon': 'Хошимин', 'Ho Chi Minh': 'Хошимин', 'saigon': 'Хошимин', 'hcm': 'Хошимин', 'ho_chi_minh': 'Хошимин', 'Хошимин': 'Хошимин', 'хошимин': 'Хошимин', 'Сайгон': 'Хошимин', 'сайгон': 'Хошимин', 'HCM': 'Хошимин', 'Ho chi minh': 'Хошимин',
-        # Дананг
-        'Da Nang': 'Дананг', 'danang': 'Дананг', 'da_nang': 'Дананг', 'Danang': 'Дананг', 'Дананг': 'Дананг', 'дананг': 'Дананг', 'Da nang': 'Дананг',
-        # Ханой
-        'Hanoi': 'Ханой', 'hanoi': 'Ханой', 'Ha Noi': 'Ханой', 'ha_noi': 'Ханой', 'Ханой': 'Ханой', 'ханой': 'Ханой',
-        # Фукуок
-        'Phu Quoc': 'Фукуок', 'phuquoc': 'Фукуок', 'phu_quoc': 'Фукуок', 'Phuquoc': 'Фукуок', 'Фукуок': 'Фукуок', 'фукуок': 'Фукуок', 'Phu quoc': 'Фукуок',
-        # Фантьет
-        'Phan Thiet': 'Фантьет', 'phanthiet': 'Фантьет', 'phan_thiet': 'Фантьет', 'Phanthiet': 'Фантьет', 'Фантьет': 'Фантьет', 'фантьет': 'Фантьет',
-        # Муйне
-        'Mui Ne': 'Муйне', 'muine': 'Муйне', 'mui_ne': 'Муйне', 'Muine': 'Муйне', 'Муйне': 'Муйне', 'муйне': 'Муйне',
-        # Камрань
-        'Cam Ranh': 'Камрань', 'camranh': 'Камрань', 'cam_ranh': 'Камрань', 'Camranh': 'Камрань', 'Камрань': 'Камрань', 'камрань': 'Камрань',
-        # Далат
-        'Da Lat': 'Далат', 'dalat': 'Далат', 'da_lat': 'Далат', 'Dalat': 'Далат', 'Далат': 'Далат', 'далат': 'Далат',
-        # Хойан
-        'Hoi An': 'Хойан', 'hoian': 'Хойан', 'hoi_an': 'Хойан', 'Hoian': 'Хойан', 'Хойан': 'Хойан', 'хойан': 'Хойан'
-    }
-    
-    # Ключевые слова для поиска в тексте
-    city_keywords = {
-        'Нячанг': ['нячанг', 'nha trang', 'nhatrang', 'nha_trang'],
-        'Хошимин': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh'],
-        'Дананг': ['дананг', 'da nang', 'danang', 'da_nang'],
-        'Ханой': ['ханой', 'hanoi', 'ha_noi'],
-        'Фукуок': ['фукуок', 'phu quoc', 'phuquoc', 'phu_quoc'],
-        'Фантьет': ['фантьет', 'phan thiet', 'phanthiet', 'phan_thiet'],
-        'Муйне': ['муйне', 'mui ne', 'muine', 'mui_ne'],
-        'Камрань': ['камрань', 'cam ranh', 'camranh', 'cam_ranh'],
-        'Далат': ['далат', 'da lat', 'dalat', 'da_lat'],
-        'Хойан': ['хойан', 'hoi an', 'hoian', 'hoi_an']
-    }
-    
-    cities = ['Нячанг', 'Хошимин', 'Ханой', 'Фукуок', 'Фантьет', 'Муйне', 'Дананг', 'Камрань', 'Далат', 'Хойан']
-    counts = {city: 0 for city in cities}
-    
-    for item in listings:
-        item_city = str(item.get('city', '') or item.get('location', '')).lower()
-        search_text = f"{item.get('title', '')} {item.get('description', '')} {item_city}".lower()
-        
-        # Ищем совпадение в тексте для ВСЕХ городов (объявление может относиться к нескольким городам)
-        for city_name, keywords in city_keywords.items():
-            if any(kw in search_text or kw in item_city for kw in keywords):
-                counts[city_name] += 1
-                # НЕ используем break - считаем для всех упомянутых городов
-    
+    # Счётчики кэшируются в индексе категории и сбрасываются вместе со снимком при любой записи
+    histogram = listings_store.category_index(data, category).facet_counts('city')
+    counts = {name: histogram.get(city_id, 0) for city_id, name in CITY_NAMES.items()}
     return jsonify(counts)
 
 @app.route('/api/medicine-type-counts')
+@conditional_get(listings_tag, 'public, max-age=15, must-revalidate')
 def get_medicine_type_counts():
     country = request.args.get('country', 'vietnam')
     data = load_data(country)
@@ -767,40 +698,11 @@ def get_medicine_type_counts():
     if 'medicine' not in data:
         return jsonify({})
     
-    listings = data['medicine']
-    listings = [x for x in listings if not x.get('hidden', False)]
-    
-    type_mapping = {
-        'pharmacy': 'questions',
-        'doctor': 'doctors', 
-        'massage': 'clinics',
-        'insurance': 'insurance',
-        'directions': 'directions',
-        'clinic': 'clinics',
-        'hospital': 'clinics',
-        'questions': 'questions',
-        'clinics': 'clinics',
-        'doctors': 'doctors',
-        'dentist': 'directions',
-        'lab': 'directions',
-        'therapy': 'directions',
-        'вопросы': 'questions',
-        'клиники': 'clinics',
-        'врачи': 'doctors',
-        'страховка': 'insurance',
-        'направления': 'directions'
-    }
-    
-    counts = {'questions': 0, 'clinics': 0, 'doctors': 0, 'insurance': 0, 'directions': 0}
-    
-    for item in listings:
-        med_type = str(item.get('medicine_type', '')).lower()
-        mapped_type = type_mapping.get(med_type, 'questions')
-        counts[mapped_type] = counts.get(mapped_type, 0) + 1
-    
+    counts = listings_store.category_index(data, 'medicine').facet_counts('medicine_type')
     return jsonify(counts)
 
 @app.route('/api/kids-type-counts')
+@conditional_get(listings_tag, 'public, max-age=15, must-revalidate')
 def get_kids_type_counts():
     country = request.args.get('country', 'vietnam')
     data = load_data(country)
@@ -808,35 +710,149 @@ def get_kids_type_counts():
     if 'kids' not in data:
         return jsonify({})
     
-    listings = data['kids']
-    listings = [x for x in listings if not x.get('hidden', False)]
+    counts = listings_store.category_index(data, 'kids').facet_counts('kids_type')
+    return jsonify(counts)
+
+@app.route('/api/facets')
+@conditional_get(listings_tag, 'public, max-age=15, must-revalidate')
+def get_facets():
+    """
+    Счётчики фасетов видимых объявлений: ?country=&category=&facet=a,b.
+    Без category - сумма по всем категориям, без facet - все фасеты категории.
+    """
+    country = request.args.get('country', 'vietnam')
+    category = request.args.get('category', '')
+    data = load_data(country)
+    
+    if category and category not in data:
+        return jsonify({'error': 'Unknown category'}), 404
+    categories = [category] if category else [cat for cat in data if cat != 'chat']
     
-    counts = {'events': 0, 'nannies': 0, 'schools': 0, 'products': 0}
+    requested = [name for name in request.args.get('facet', '').split(',') if name]
+    unknown = [name for name in requested if name not in FACETS]
+    if unknown:
+        return jsonify({'error': f"Unknown facet: {', '.join(unknown)}"}), 400
     
+    facets = {}
+    for cat in categories:
+        names = facets_for(cat)
+        if requested:
+            names = [name for name in requested if name in names]
+        index = listings_store.category_index(data, cat)
+        for name in names:
+            total = facets.setdefault(name, {})
+            for value, count in index.facet_counts(name).items():
+                total[value] = total.get(value, 0) + count
+    
+    return jsonify({'country': country, 'category': category or None, 'facets': facets})
+
+def with_photo_proxy_urls(listings):
+    """
+    Список для ответа с постоянными адресами /img/tg/<file_id> вместо
+    сохранённых ссылок Telegram (объявления в кэше не меняются)
+    """
+    result = []
     for item in listings:
-        kids_type = str(item.get('kids_type', '') or item.get('kids_category', '')).lower().strip()
-        if kids_type in counts:
-            counts[kids_type] += 1
-        else:
-            # Маппинг русских названий
-            type_map = {
-                'школы': 'schools',
-                'школа': 'schools',
-                'детские сады': 'products',
-                'детский сад': 'products',
-                'садик': 'products',
-                'мероприятия': 'events',
-                'мероприятие': 'events',
-                'няни': 'nannies',
-                'няня': 'nannies',
-                'товары': 'products'
-            }
-            mapped = type_map.get(kids_type, 'schools')
-            counts[mapped] = counts.get(mapped, 0) + 1
-    
-    return jsonify(counts)
+        file_id = item.get('telegram_file_id')
+        if file_id:
+            url = telegram_files.photo_url(file_id)
+            if item.get('image_url') != url:
+                item = dict(item, image_url=url)
+        result.append(item)
+    return result
+
+def encode_listing(item):
+    """JSON объявления: готовый фрагмент Listing.encoded() или dict, закодированный на месте"""
+    if isinstance(item, Listing):
+        return item.encoded()
+    return json.dumps(item, ensure_ascii=False, separators=(',', ':'), default=json_default).encode('utf-8')
+
+def listings_json_response(listings):
+    """
+    JSON массив объявлений, склеенный из готовых фрагментов Listing.encoded();
+    обычные dict (копии со свежими ссылками на фото) кодируются на месте
+    """
+    parts = [encode_listing(item) for item in listings]
+    return Response(b'[' + b','.join(parts) + b']', mimetype='application/json')
+
+LISTINGS_PAGE_MAX = 500
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key), ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii'))))
+
+def project_listing(item, fields, truncate):
+    """Только нужные поля (fields) и/или обрезанное описание (truncate символов)"""
+    if fields:
+        result = {key: item[key] for key in fields if key in item}
+        result['id'] = item.get('id')
+    else:
+        result = dict(item)
+    description = result.get('description')
+    if truncate and isinstance(description, str) and len(description) > truncate:
+        result['description'] = description[:truncate].rstrip() + '…'
+    return result
+
+def listings_page_response(listings, sort_key, reverse=False):
+    """
+    Страница отсортированного списка: limit, cursor (ключ сортировки последнего
+    объявления предыдущей страницы), fields=title,price,... и truncate=200.
+    Без limit отдаётся весь список, как раньше. Всего объявлений - в X-Total-Count,
+    курсор следующей страницы - в X-Next-Cursor.
+    """
+    total = len(listings)
+    start = 0
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+            # Список отсортирован по sort_key: "уже после курсора" - False...False, True...True,
+            # первое True ищется двоичным поиском (O(log n) вместо прохода по категории)
+            if reverse:
+                start = bisect.bisect_left(listings, True, key=lambda item: sort_key(item) < after)
+            else:
+                start = bisect.bisect_left(listings, True, key=lambda item: sort_key(item) > after)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(0, min(limit, LISTINGS_PAGE_MAX))
+        page = listings[start:start + limit]
+    else:
+        page = listings[start:]
+
+    headers = {'X-Total-Count': str(total)}
+    if limit and start + limit < total:
+        headers['X-Next-Cursor'] = encode_cursor(sort_key(page[-1]))
+
+    # Обновляем URL для фото из Telegram (только для отдаваемой страницы)
+    page = with_photo_proxy_urls(page)
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    truncate = request.args.get('truncate', type=int)
+    if fields or truncate:
+        page = [project_listing(item, fields, truncate) for item in page]
+
+    response = listings_json_response(page)
+    response.headers.update(headers)
+    return response
+
+# Параметры, которые не влияют на набор объявлений (страница, проекция, анти-кэш)
+LISTINGS_PAGE_PARAMS = frozenset(['country', 'limit', 'cursor', 'fields', 'truncate']) | CACHE_BUSTER_PARAMS
+
+listings_query_cache = QueryCache(int(os.environ.get('LISTINGS_QUERY_CACHE_SIZE', 256)))
+
+def listings_query_key(category, filters):
+    """Нормализованный ключ запроса: категория + непустые фильтры по алфавиту"""
+    return (category,) + tuple(sorted(
+        (name, value) for name, value in filters.items()
+        if value and name not in LISTINGS_PAGE_PARAMS
+    ))
 
 @app.route('/api/listings/<category>')
+@conditional_get(listings_tag)
 def get_listings(category):
     country = request.args.get('country', 'vietnam')
     data = load_data(country)
@@ -862,436 +878,62 @@ def get_listings(category):
     if category == 'admin':
         all_listings = []
         for cat_name, cat_data in data.items():
-            if isinstance(cat_data, list):
+            if isinstance(cat_data, (list, tuple)):
                 for item in cat_data:
-                    item_copy = item.copy()
-                    item_copy['_category'] = cat_name
-                    all_listings.append(item_copy)
+                    all_listings.append(dict(item, _category=cat_name))
         show_hidden = request.args.get('show_hidden', '0') == '1'
         if not show_hidden:
             all_listings = [x for x in all_listings if not x.get('hidden', False)]
-        return jsonify(all_listings)
+        return listings_json_response(with_photo_proxy_urls(all_listings))
     
     category = category_aliases.get(category, category)
     
     if category not in data:
         return jsonify([])
     
-    listings = data[category]
-    
-    # Фильтры
-    filters = request.args
-    
-    # Фильтруем скрытые объявления (если не запрошено show_hidden=1)
-    # Для Нячанга показываем все объявления включая скрытые
-    show_hidden = request.args.get('show_hidden', '0') == '1'
-    realestate_city = request.args.get('realestate_city', '')
-    if show_hidden or (category == 'real_estate' and realestate_city == 'nhatrang'):
-        filtered = listings  # Показываем все включая скрытые
-    else:
-        filtered = [x for x in listings if not x.get('hidden', False)]
-    
-    subcategory = request.args.get('subcategory')
-    if subcategory:
-        # Для marketplace используем поле marketplace_category
-        if category == 'marketplace':
-            filtered = [x for x in filtered if x.get('marketplace_category') == subcategory]
-        else:
-            filtered = [x for x in filtered if x.get('subcategory') == subcategory]
-    
-    # Маппинг русских названий городов на английские
-    city_name_mapping = {
-        'Нячанг': 'Nha Trang',
-        'Хошимин': 'Saigon',
-        'Сайгон': 'Saigon',
-        'Saigon': 'Saigon',
-        'Ho Chi Minh': 'Saigon',
-        'Дананг': 'Da Nang',
-        'Ханой': 'Hanoi',
-        'Фукуок': 'Phu Quoc',
-        'Фантьет': 'Phan Thiet',
-        'Муйне': 'Mui Ne',
-        'Камрань': 'Cam Ranh',
-        'Далат': 'Da Lat',
-        'Хойан': 'Hoi An'
-    }
-    
-    # Универсальный фильтр по городу для категорий, где он есть (restaurants, tours, entertainment, marketplace, visas)
-    if category in ['restaurants', 'tours', 'entertainment', 'marketplace', 'visas']:
-        if 'city' in filters and filters['city']:
-            city_filter = filters['city']
-            
-            # Расширенный маппинг с подчёркиваниями и всеми вариантами
-            city_keywords_map = {
-                'Нячанг': ['нячанг', 'nha trang', 'nhatrang', 'nha_trang'],
-                'Хошимин': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh', 'hochiminh'],
-                'Дананг': ['дананг', 'da nang', 'danang', 'da_nang'],
-                'Ханой': ['ханой', 'hanoi', 'ha_noi'],
-                'Фукуок': ['фукуок', 'phu quoc', 'phuquoc', 'phu_quoc'],
-                'Фантьет': ['фантьет', 'phan thiet', 'phanthiet', 'phan_thiet'],
-                'Муйне': ['муйне', 'mui ne', 'muine', 'mui_ne'],
-                'Камрань': ['камрань', 'cam ranh', 'camranh', 'cam_ranh'],
-                'Далат': ['далат', 'da lat', 'dalat', 'da_lat'],
-                'Хойан': ['хойан', 'hoi an', 'hoian', 'hoi_an']
-            }
-            
-            targets = city_keywords_map.get(city_filter, [city_filter.lower()])
-            
-            def matches_city(item):
-                item_city = str(item.get('city', '')).lower()
-                item_location = str(item.get('location', '')).lower()
-                search_text = f"{item.get('title', '')} {item.get('description', '')}".lower()
-                
-                # Если город не указан, считаем что подходит для всех городов (показываем всё)
-                if not item_city and not item_location:
-                    return True
-
-                # Проверяем поля city и location
-                for t in targets:
-                    if t in item_city or t in item_location:
-                        return True
-                # Проверяем в тексте
-                for t in targets:
-                    if t in search_text:
-                        return True
-                return False
-            
-            filtered = [x for x in filtered if matches_city(x)]
-            print(f"DEBUG: Category {category}, City Filter {city_filter}, Targets {targets}, Found {len(filtered)} items")
-    
-    # Фильтр по типу для категории "kids" (Для детей)
-    if category == 'kids':
-        if 'kids_type' in filters and filters['kids_type']:
-            kids_type = filters['kids_type']
-            # Маппинг категорий: products = Детский сад
-            type_mapping = {
-                'products': 'Детский сад',
-                'schools': 'schools',
-                'events': 'events',
-                'nannies': 'nannies'
-            }
-            mapped_type = type_mapping.get(kids_type, kids_type)
-            
-            # Фильтруем только по точному совпадению kids_type
-            filtered = [x for x in filtered if x.get('kids_type') == mapped_type or x.get('kids_type') == kids_type]
-        
-        # Фильтр по городу для kids
-        if 'city' in filters and filters['city']:
-            city_filter = filters['city'].lower()
-            city_mapping = {
-                'nha trang': ['nha trang', 'nhatrang', 'нячанг'],
-                'da nang': ['da nang', 'danang', 'дананг'],
-                'phu quoc': ['phu quoc', 'phuquoc', 'фукуок'],
-                'ho chi minh': ['ho chi minh', 'hochiminh', 'hcm', 'хошимин', 'сайгон']
-            }
-            targets = city_mapping.get(city_filter, [city_filter])
-            filtered = [x for x in filtered if any(t in str(x.get('city', '')).lower() for t in targets)]
-        
-        # Фильтр по возрасту для kids
-        if 'max_age' in filters and filters['max_age']:
-            try:
-                max_age = int(filters['max_age'])
-                def check_age(item):
-                    age_str = str(item.get('age', ''))
-                    # Извлекаем числа из строки возраста
-                    numbers = re.findall(r'\d+', age_str)
-                    if numbers:
-                        # Берём минимальный возраст из диапазона
-                        min_item_age = min(int(n) for n in numbers)
-                        return min_item_age <= max_age
-                    return True  # Если возраст не указан, показываем
-                filtered = [x for x in filtered if check_age(x)]
-            except ValueError:
-                pass
-    
-    # Фильтры для визарана
-    if category == 'visas':
-        # Фильтр по направлению (Камбоджа/Лаос) - используем параметр destination
-        if 'destination' in filters and filters['destination']:
-            dest_filter = filters['destination'].lower()
-            # Маппинг русских названий на английские
-            dest_mapping = {
-                'камбоджа': ['cambodia', 'камбодж', 'кампучия'],
-                'лаос': ['laos', 'лаос'],
-                'малайзия': ['malaysia', 'малайзия'],
-                'непал': ['nepal', 'непал'],
-                'шри-ланка': ['sri lanka', 'srilanka', 'шри-ланка', 'шриланка'],
-                'сингапур': ['singapore', 'сингапур']
-            }
-            targets = dest_mapping.get(dest_filter, [dest_filter])
-            filtered = [x for x in filtered if 
-                any(t in str(x.get('destination', '')).lower() for t in targets) or
-                any(t in str(x.get('title', '')).lower() for t in targets) or
-                any(t in str(x.get('description', '')).lower() for t in targets)]
-        
-        # Фильтр по гражданству (россия/казахстан)
-        if 'nationality' in filters and filters['nationality']:
-            nationality = filters['nationality'].lower()
-            citizenship_mapping = {
-                'russia': ['российское', 'россия', 'рф', 'russia', 'russian'],
-                'kazakhstan': ['казахское', 'казахстан', 'kz', 'kazakhstan'],
-                'belarus': ['белорусское', 'беларусь', 'беларуси', 'belarus', 'belarusian'],
-                'ukraine': ['украинское', 'украина', 'украины', 'ukraine', 'ukrainian']
-            }
-            nationality_keywords = {
-                'russia': ['росси', 'россиян', 'рф', 'russia', 'russian', 'для русских', 'для рф', 'российск'],
-                'kazakhstan': ['казах', 'казакстан', 'kz', 'kazakhstan', 'для казахов', 'кз', 'казахск'],
-                'belarus': ['белорус', 'беларус', 'belarus', 'belarusian', 'для белорусов', 'рб'],
-                'ukraine': ['украин', 'ukraine', 'ukrainian', 'для украинцев', 'ua']
-            }
-            citizenship_values = citizenship_mapping.get(nationality, [])
-            keywords = nationality_keywords.get(nationality, [])
-            
-            def matches_nationality(item):
-                citizen = item.get('citizenship', '').lower()
-                if citizen and citizen in citizenship_values:
-                    return True
-                text = (item.get('description', '') + ' ' + item.get('title', '')).lower()
-                return any(kw in text for kw in keywords)
-            
-            filtered = [x for x in filtered if matches_nationality(x)]
-        
-        # Фильтр по сроку (45 / 90 дней)
-        if 'days' in filters and filters['days']:
-            days = filters['days']
-            filtered = [x for x in filtered if days in (x.get('description', '') + ' ' + x.get('title', ''))]
-
-    # Фильтры для фотосессии (news)
-    if category == 'news':
-        if 'city' in filters and filters['city']:
-            city_filter = filters['city'].lower()
-            filtered = [x for x in filtered if city_filter in str(x.get('city', '')).lower() or city_filter in str(x.get('title', '')).lower() or city_filter in str(x.get('description', '')).lower()]
-
-    # Фильтры для обмена денег
-    if category == 'money_exchange':
-        if 'city' in filters and filters['city']:
-            city_filter = filters['city']
-            city_keywords_map = {
-                'Нячанг': ['нячанг', 'nha trang', 'nhatrang', 'nha_trang'],
-                'Хошимин': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh'],
-                'Дананг': ['дананг', 'da nang', 'danang', 'da_nang'],
-                'Фукуок': ['фукуок', 'phu quoc', 'phuquoc', 'phu_quoc'],
-            }
-            targets = city_keywords_map.get(city_filter, [city_filter.lower()])
-            
-            def matches_city(item):
-                search_text = f"{item.get('city', '')} {item.get('title', '')} {item.get('description', '')} {item.get('address', '')}".lower()
-                return any(t in search_text for t in targets)
-            
-            filtered = [x for x in filtered if matches_city(x)]
-
-    # Фильтры для медицины
-    if category == 'medicine':
-        if 'city' in filters and filters['city']:
-            city_filter = filters['city'].lower()
-            filtered = [x for x in filtered if city_filter in str(x.get('city', '')).lower() or city_filter in str(x.get('title', '')).lower() or city_filter in str(x.get('description', '')).lower()]
-        
-        # Фильтр по типу медицины (questions, clinics, doctors, insurance, directions)
-        if 'medicine_type' in filters and filters['medicine_type']:
-            medicine_type = filters['medicine_type']
-            # Маппинг типов кнопок на реальные значения в данных
-            type_values_map = {
-                'questions': ['questions', 'pharmacy'],
-                'clinics': ['clinics', 'clinic', 'hospital', 'massage'],
-                'doctors': ['doctors', 'doctor'],
-                'insurance': ['insurance'],
-                'directions': ['directions', 'dentist', 'lab', 'therapy']
-            }
-            type_keywords = {
-                'questions': ['вопрос', 'помоги', 'подскаж', 'где найти', 'посоветуй', 'кто знает', '?'],
-                'clinics': ['клиник', 'госпиталь', 'больниц', 'hospital', 'clinic', 'медцентр'],
-                'doctors': ['врач', 'доктор', 'doctor', 'терапевт', 'стоматолог', 'специалист', 'медик'],
-                'insurance': ['страхов', 'insurance', 'полис', 'policy'],
-                'directions': ['направлен', 'специализац', 'услуг', 'обследован', 'анализ', 'аптек', 'массаж', 'pharmacy', 'massage']
-            }
-            allowed_values = type_values_map.get(medicine_type, [medicine_type])
-            keywords = type_keywords.get(medicine_type, [])
-            
-            def matches_medicine_type(item):
-                item_type = item.get('medicine_type', '').lower()
-                if item_type in allowed_values:
-                    return True
-                if keywords:
-                    text = (item.get('description', '') + ' ' + item.get('title', '')).lower()
-                    return any(kw in text for kw in keywords)
-                return False
-            
-            filtered = [x for x in filtered if matches_medicine_type(x)]
-
-    if category == 'transport':
-        # Фильтр по типу транспорта (bikes, cars, yachts, bicycles)
-        if 'transport_type' in filters and filters['transport_type']:
-            transport_type = filters['transport_type']
-            filtered = [x for x in filtered if x.get('transport_type') == transport_type]
-        
-        # Фильтр по городу для transport
-        if 'city' in filters and filters['city']:
-            city_filter = filters['city']
-            
-            # Расширенный маппинг с русскими ключами
-            city_keywords_map = {
-                'Нячанг': ['нячанг', 'nha trang', 'nhatrang', 'nha_trang'],
-                'Хошимин': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh', 'hochiminh'],
-                'Дананг': ['дананг', 'da nang', 'danang', 'da_nang'],
-                'Ханой': ['ханой', 'hanoi', 'ha_noi'],
-                'Фукуок': ['фукуок', 'phu quoc', 'phuquoc', 'phu_quoc'],
-                'Фантьет': ['фантьет', 'phan thiet', 'phanthiet', 'phan_thiet'],
-                'Муйне': ['муйне', 'mui ne', 'muine', 'mui_ne'],
-                'Камрань': ['камрань', 'cam ranh', 'camranh', 'cam_ranh'],
-                'Далат': ['далат', 'da lat', 'dalat', 'da_lat'],
-                'Хойан': ['хойан', 'hoi an', 'hoian', 'hoi_an']
-            }
-            
-            targets = city_keywords_map.get(city_filter, [city_filter.lower()])
-            
-            def matches_city(item):
-                item_city = str(item.get('city', '')).lower()
-                item_location = str(item.get('location', '')).lower()
-                search_text = f"{item.get('title', '')} {item.get('description', '')}".lower()
-                
-                for t in targets:
-                    if t in item_city or t in item_location or t in search_text:
-                        return True
-                return False
-            
-            filtered = [x for x in filtered if matches_city(x)]
-        
-        # Фильтр по типу (sale, rent)
-        if 'type' in filters and filters['type']:
-            type_filter = filters['type'].lower()
-            if type_filter == 'sale':
-                keywords = ['продаж', 'куплю', 'продам', 'цена', '$', '₫', 'доллар']
-                filtered = [x for x in filtered if any(kw in x.get('description', '').lower() for kw in keywords)]
-            elif type_filter == 'rent':
-                keywords = ['аренд', 'сдам', 'сдаю', 'наём', 'прокат', 'почасово']
-                filtered = [x for x in filtered if any(kw in x.get('description', '').lower() for kw in keywords)]
-        
-        if 'model' in filters and filters['model']:
-            filtered = [x for x in filtered if filters['model'].lower() in (x.get('model') or '').lower()]
-        if 'year' in filters and filters['year']:
-            filtered = [x for x in filtered if str(x.get('year', '')) == filters['year']]
-        if 'price_min' in filters and 'price_max' in filters and filters['price_min'] and filters['price_max']:
-            try:
-                min_p, max_p = float(filters['price_min']), float(filters['price_max'])
-                filtered = [x for x in filtered if min_p <= x.get('price', 0) <= max_p]
-            except:
-                pass
-    
-    elif category == 'real_estate':
-        if 'realestate_city' in filters and filters['realestate_city']:
-            city_filter = filters['realestate_city'].lower()
-            city_mapping = {
-                'nhatrang': ['nhatrang', 'nha trang', 'нячанг'],
-                'danang': ['danang', 'da nang', 'дананг'],
-                'hochiminh': ['hochiminh', 'ho chi minh', 'hcm', 'хошимин', 'сайгон'],
-                'hanoi': ['hanoi', 'ha noi', 'ханой'],
-                'phuquoc': ['phuquoc', 'phu quoc', 'фукуок'],
-                'dalat': ['dalat', 'da lat', 'далат']
-            }
-            targets = city_mapping.get(city_filter, [city_filter])
-            filtered = [x for x in filtered if any(t in str(x.get('city', '')).lower() or t in str(x.get('city_ru', '')).lower() for t in targets)]
-        
-        if 'listing_type' in filters and filters['listing_type']:
-            type_filter = filters['listing_type']
-            filtered = [x for x in filtered if type_filter in (x.get('listing_type') or '')]
-        
-        if 'source_group' in filters and filters['source_group']:
-            group_filter = filters['source_group']
-            filtered = [x for x in filtered if x.get('source_group') == group_filter or x.get('contact_name') == group_filter or group_filter in ' '.join(x.get('photos', [])) or group_filter in (x.get('photo_url') or '')]
-        
-        def get_price_int(item):
-            # Сначала пробуем поле price
-            price = item.get('price')
-            if price is not None:
-                if isinstance(price, (int, float)) and price > 0:
-                    return int(price)
-                try:
-                    price_str = str(price).lower()
-                    multiplier = 1
-                    if 'млн' in price_str or 'mln' in price_str or 'миллион' in price_str:
-                        multiplier = 1000000
-                    price_str = price_str.replace(',', '.')
-                    cleaned = re.sub(r'[^\d.]', '', price_str)
-                    parts = cleaned.split('.')
-                    if len(parts) > 2:
-                        cleaned = parts[0] + '.' + ''.join(parts[1:])
-                    if cleaned:
-                        val = int(float(cleaned) * multiplier)
-                        if val > 0:
-                            return val
-                except:
-                    pass
-            
-            # Если поле price пустое или 0, извлекаем из описания
-            desc = (item.get('description') or '').lower()
-            
-            # Ищем паттерны: "7,5 миллион", "7.5 млн", "Цена: 7 500 000"
-            patterns = [
-                r'(\d+[,.]?\d*)\s*(?:миллион|млн|mln)',  # 7,5 миллион
-                r'цена[:\s]*(\d[\d\s]*)\s*(?:vnd|донг|₫)?',  # Цена: 7 500 000
-                r'(\d[\d\s]{2,})\s*(?:vnd|донг|₫)',  # 7 500 000 VND
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, desc)
-                if match:
-                    price_str = match.group(1).replace(' ', '').replace(',', '.')
-                    try:
-                        val = float(price_str)
-                        # Если число маленькое и паттерн с млн/миллион
-                        if val < 1000 and 'млн' in pattern or 'миллион' in pattern:
-                            val = val * 1000000
-                        elif val < 100:
-                            val = val * 1000000
-                        return int(val)
-                    except:
-                        pass
-            
-            return 0
-
-        # Price filtering
-        if 'price_max' in filters and filters['price_max']:
-            try:
-                max_p = int(filters['price_max'])
-                filtered = [x for x in filtered if 0 < get_price_int(x) <= max_p]
-            except:
-                pass
-        
-        if 'price_min' in filters and filters['price_min']:
-            try:
-                min_p = int(filters['price_min'])
-                filtered = [x for x in filtered if get_price_int(x) >= min_p]
-            except:
-                pass
-        
-        sort_type = filters.get('sort')
-        if sort_type == 'price_desc':
-            filtered.sort(key=get_price_int, reverse=True)
-        elif sort_type == 'price_asc':
-            # Sort items with price > 0 first, then by price
-            filtered.sort(key=lambda x: (get_price_int(x) == 0, get_price_int(x)))
-        else:
-            filtered.sort(key=lambda x: x.get('date', x.get('added_at', '1970-01-01')) or '1970-01-01', reverse=True)
-        
-        # Обновляем URL для фото из Telegram
-        for item in filtered:
-            if item.get('telegram_file_id'):
-                fresh_url = get_telegram_photo_url(item['telegram_file_id'])
-                if fresh_url:
-                    item['image_url'] = fresh_url
-        return jsonify(filtered)
-    
-    # Сортировка по дате - новые сверху
-    filtered.sort(key=lambda x: x.get('date', x.get('added_at', '1970-01-01')) or '1970-01-01', reverse=True)
-    
-    # Обновляем URL для фото из Telegram (генерируем свежие ссылки)
-    for item in filtered:
-        if item.get('telegram_file_id'):
-            fresh_url = get_telegram_photo_url(item['telegram_file_id'])
-            if fresh_url:
-                item['image_url'] = fresh_url
+    # Одинаковые запросы (страна, категория, фильтры) по одному снимку считаются один раз
+    query = listings_query_key(category, request.args)
+    result = listings_query_cache.get(country, data, query)
+    if result is None:
+        result = filter_listings(listings_store.category_index(data, category), category, request.args)
+        listings_query_cache.put(country, data, query, result)
+    listings, order = result
+    sort_key, reverse = SORT_ORDERS[order]
+    return listings_page_response(listings, sort_key, reverse)
+
+SEARCH_PAGE_MAX = 100
+
+@app.route('/api/search')
+@conditional_get(listings_tag)
+def search_listings():
+    """
+    Полнотекстовый поиск по заголовкам и описаниям: ?country=&q=&category=&limit=20&offset=0.
+    Без category - по всем категориям страны, результаты ранжированы.
+    """
+    country = request.args.get('country', 'vietnam')
+    query = request.args.get('q', '').strip()
+    category = request.args.get('category', '')
+    data = load_data(country)
     
-    return jsonify(filtered)
+    if category and category not in data:
+        return jsonify({'error': 'Unknown category'}), 404
+    categories = [category] if category else [cat for cat in data if cat != 'chat']
+    
+    limit = max(0, min(request.args.get('limit', 20, type=int), SEARCH_PAGE_MAX))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    hits = search_index.search([(cat, listings_store.category_index(data, cat)) for cat in categories], query) if query else []
+    page = hits[offset:offset + limit]
+    
+    items = with_photo_proxy_urls([item for _, _, item in page])
+    parts = [
+        b'{"category":' + json.dumps(cat).encode('utf-8') + b',"score":' + json.dumps(round(score, 4)).encode('utf-8') +
+        b',"listing":' + encode_listing(item) + b'}'
+        for (score, cat, _), item in zip(page, items)
+    ]
+    body = b'{"total":' + str(len(hits)).encode('ascii') + b',"hits":[' + b','.join(parts) + b']}'
+    response = Response(body, mimetype='application/json')
+    response.headers['X-Total-Count'] = str(len(hits))
+    return response
 
 @app.route('/api/add-listing', methods=['POST'])
 def add_listing():
@@ -1303,8 +945,7 @@ def add_listing():
     category = listing.get('category')
     if category and category in data:
         listing['added_at'] = datetime.now().isoformat()
-        data[category].append(listing)
-        save_data(country, data)
+        listings_store.add_listing(country, category, listing, front=False)
         return jsonify({'success': True, 'message': 'Объявление добавлено'})
     
     return jsonify({'error': 'Invalid category'}), 400
@@ -1364,9 +1005,16 @@ def save_banner_config(config):
         json.dump(config, f, ensure_ascii=False, indent=2)
 
 @app.route('/api/banners')
+@conditional_get(lambda: file_tag(BANNER_CONFIG_FILE))
 def get_banners():
     return jsonify(load_banner_config())
 
+@app.route('/api/image-manifest')
+@conditional_get(lambda: file_tag(image_pipeline.MANIFEST_FILE), 'public, max-age=300')
+def get_image_manifest():
+    """Уменьшенные копии картинок из static/ для srcset (image_pipeline.py)"""
+    return jsonify(image_pipeline.load_manifest())
+
 @app.route('/api/admin/upload-banner', methods=['POST'])
 def admin_upload_banner():
     password = request.form.get('password', '')
@@ -1388,6 +1036,8 @@ def admin_upload_banner():
         filename = secure_filename(f"{country}_{banner_type}_{int(time.time())}_{file.filename}")
         file_path = os.path.join(UPLOAD_FOLDER, filename)
         file.save(file_path)
+        # Уменьшенные копии для srcset - в фоне
+        image_pipeline.process_in_background(file_path)
         
         # Загружаем в BunnyCDN
         upload_to_bunny(file_path, filename)
@@ -1499,8 +1149,7 @@ def admin_delete():
 
     
     if category in data:
-        data[category] = [x for x in data[category] if x.get('id') != listing_id]
-        save_data(country, data)
+        listings_store.delete_listing(country, category, listing_id)
         return jsonify({'success': True, 'message': f'Объявление {listing_id} удалено'})
     
     return jsonify({'error': 'Category not found'}), 404
@@ -1525,24 +1174,11 @@ def admin_move():
     if from_category not in data or to_category not in data:
         return jsonify({'error': 'Invalid category'}), 404
     
-    # Найти объявление
-    listing = None
-    if from_category in data:
-        for i, item in enumerate(data[from_category]):
-            if item.get('id') == listing_id:
-                listing = data[from_category].pop(i)
-                break
-    
+    # Обновить категорию и переместить в начало
+    listing = listings_store.move_listing(country, listing_id, from_category, to_category)
     if not listing:
         return jsonify({'success': False, 'error': 'Listing not found'}), 404
     
-    # Обновить категорию и переместить
-    listing['category'] = to_category
-    if to_category not in data:
-        data[to_category] = []
-    data[to_category].insert(0, listing)
-    save_data(country, data)
-    
     return jsonify({'success': True, 'message': f'Объявление перемещено в {to_category}'})
 
 @app.route('/api/admin/toggle-visibility', methods=['POST'])
@@ -1569,13 +1205,12 @@ def admin_toggle_visibility():
     if category not in data:
         return jsonify({'error': 'Category not found'}), 404
     
-    for item in data[category]:
-        if item.get('id') == listing_id:
-            current = item.get('hidden', False)
-            item['hidden'] = not current
-            save_data(country, data)
-            status = 'скрыто' if item['hidden'] else 'видимо'
-            return jsonify({'success': True, 'hidden': item['hidden'], 'message': f'Объявление {status}'})
+    item = listings_store.get_listing(country, category, listing_id)
+    if item:
+        item = listings_store.update_listing(country, category, listing_id,
+                                             {'hidden': not item.get('hidden', False)})
+        status = 'скрыто' if item['hidden'] else 'видимо'
+        return jsonify({'success': True, 'hidden': item['hidden'], 'message': f'Объявление {status}'})
     
     return jsonify({'error': 'Listing not found'}), 404
 
@@ -1601,17 +1236,20 @@ def admin_bulk_hide():
     if category and category in data:
         categories = [category]
     else:
-        categories = data.keys()
+        categories = list(data.keys())
     
+    # Каждое объявление - отдельный update_listing: правки других объявлений
+    # (парсеры, модерация, фото) за время обхода не затираются
     for cat in categories:
         if cat in data:
             for item in data[cat]:
                 cn = (item.get('contact_name') or item.get('contact') or '').lower()
-                if contact_name.lower() in cn:
-                    item['hidden'] = hide
+                listing_id = item.get('id')
+                if contact_name.lower() in cn and listing_id is not None:
+                    if bool(item.get('hidden', False)) != bool(hide):
+                        listings_store.update_listing(country, cat, listing_id, {'hidden': hide})
                     count += 1
     
-    save_data(country, data)
     action = 'скрыто' if hide else 'показано'
     return jsonify({'success': True, 'count': count, 'message': f'{count} объявлений {action}'})
 
@@ -1639,78 +1277,76 @@ def admin_edit():
     if category not in data:
         return jsonify({'error': 'Category not found'}), 404
     
-    for item in data[category]:
-        if item.get('id') == listing_id:
-            if 'title' in updates:
-                item['title'] = updates['title']
-            if 'description' in updates:
-                item['description'] = updates['description']
-            if 'price' in updates:
-                try:
-                    item['price'] = int(updates['price']) if updates['price'] else 0
-                except:
-                    item['price'] = 0
-            if 'rooms' in updates:
-                item['rooms'] = updates['rooms'] if updates['rooms'] else None
-            if 'area' in updates:
+    listing = listings_store.get_listing(country, category, listing_id)
+    if listing:
+        # Только изменённые формой поля: фото, загруженное в фоне (apply_photo_job)
+        # между чтением и записью, не затирается старыми image_url/photos_pending
+        item = {}
+        uploads = []
+        if 'title' in updates:
+            item['title'] = updates['title']
+        if 'description' in updates:
+            item['description'] = updates['description']
+        if 'price' in updates:
+            try:
+                item['price'] = int(updates['price']) if updates['price'] else 0
+            except:
+                item['price'] = 0
+        if 'rooms' in updates:
+            item['rooms'] = updates['rooms'] if updates['rooms'] else None
+        if 'area' in updates:
+            try:
+                item['area'] = float(updates['area']) if updates['area'] else None
+            except:
+                item['area'] = None
+        if 'date' in updates:
+            item['date'] = updates['date'] if updates['date'] else None
+        if 'whatsapp' in updates:
+            item['whatsapp'] = updates['whatsapp'] if updates['whatsapp'] else None
+        if 'telegram' in updates:
+            item['telegram'] = updates['telegram'] if updates['telegram'] else None
+        if 'contact_name' in updates:
+            item['contact_name'] = updates['contact_name'] if updates['contact_name'] else None
+        if 'listing_type' in updates:
+            item['listing_type'] = updates['listing_type'] if updates['listing_type'] else None
+        if 'city' in updates:
+            item['city'] = updates['city'] if updates['city'] else None
+        if 'google_maps' in updates:
+            item['google_maps'] = updates['google_maps'] if updates['google_maps'] else None
+        if 'google_rating' in updates:
+            item['google_rating'] = updates['google_rating'] if updates['google_rating'] else None
+        if 'kitchen' in updates:
+            item['kitchen'] = updates['kitchen'] if updates['kitchen'] else None
+        if 'restaurant_type' in updates:
+            item['restaurant_type'] = updates['restaurant_type'] if updates['restaurant_type'] else None
+        if 'price_category' in updates:
+            item['price_category'] = updates['price_category'] if updates['price_category'] else None
+        if 'kids_age' in updates:
+            item['kids_age'] = updates['kids_age'] if updates['kids_age'] else None
+            item['age'] = updates['kids_age'] if updates['kids_age'] else None
+        if 'kids_category' in updates:
+            item['kids_category'] = updates['kids_category'] if updates['kids_category'] else None
+        if 'kids_type' in updates:
+            item['kids_type'] = updates['kids_type'] if updates['kids_type'] else None
+        if 'currency_pairs' in updates:
+            item['currency_pairs'] = updates['currency_pairs'] if updates['currency_pairs'] else None
+        if 'image_url' in updates and updates['image_url']:
+            image_url = updates['image_url']
+            if image_url.startswith('data:'):
                 try:
-                    item['area'] = float(updates['area']) if updates['area'] else None
-                except:
-                    item['area'] = None
-            if 'date' in updates:
-                item['date'] = updates['date'] if updates['date'] else None
-            if 'whatsapp' in updates:
-                item['whatsapp'] = updates['whatsapp'] if updates['whatsapp'] else None
-            if 'telegram' in updates:
-                item['telegram'] = updates['telegram'] if updates['telegram'] else None
-            if 'contact_name' in updates:
-                item['contact_name'] = updates['contact_name'] if updates['contact_name'] else None
-            if 'listing_type' in updates:
-                item['listing_type'] = updates['listing_type'] if updates['listing_type'] else None
-            if 'city' in updates:
-                item['city'] = updates['city'] if updates['city'] else None
-            if 'google_maps' in updates:
-                item['google_maps'] = updates['google_maps'] if updates['google_maps'] else None
-            if 'google_rating' in updates:
-                item['google_rating'] = updates['google_rating'] if updates['google_rating'] else None
-            if 'kitchen' in updates:
-                item['kitchen'] = updates['kitchen'] if updates['kitchen'] else None
-            if 'restaurant_type' in updates:
-                item['restaurant_type'] = updates['restaurant_type'] if updates['restaurant_type'] else None
-            if 'price_category' in updates:
-                item['price_category'] = updates['price_category'] if updates['price_category'] else None
-            if 'kids_age' in updates:
-                item['kids_age'] = updates['kids_age'] if updates['kids_age'] else None
-                item['age'] = updates['kids_age'] if updates['kids_age'] else None
-            if 'kids_category' in updates:
-                item['kids_category'] = updates['kids_category'] if updates['kids_category'] else None
-            if 'kids_type' in updates:
-                item['kids_type'] = updates['kids_type'] if updates['kids_type'] else None
-            if 'currency_pairs' in updates:
-                item['currency_pairs'] = updates['currency_pairs'] if updates['currency_pairs'] else None
-            if 'image_url' in updates and updates['image_url']:
-                image_url = updates['image_url']
-                if image_url.startswith('data:'):
-                    try:
-                        import base64
-                        header, b64_data = image_url.split(',', 1)
-                        image_data = base64.b64decode(b64_data)
-                        caption = f"📷 {item.get('title', 'Объявление')}"
-                        file_id = send_photo_to_channel(image_data, caption)
-                        if file_id:
-                            item['telegram_file_id'] = file_id
-                            item['telegram_photo'] = True
-                            fresh_url = get_telegram_photo_url(file_id)
-                            if fresh_url:
-                                item['image_url'] = fresh_url
-                    except Exception as e:
-                        print(f"Error uploading new photo: {e}")
-                        item['image_url'] = image_url
-                else:
+                    header, b64_data = image_url.split(',', 1)
+                    caption = f"📷 {item.get('title', listing.get('title', 'Объявление'))}"
+                    uploads.append(('image_url', caption, base64.b64decode(b64_data), None))
+                except Exception as e:
+                    print(f"Error decoding new photo: {e}")
                     item['image_url'] = image_url
-            
-            save_data(country, data)
-            return jsonify({'success': True, 'message': 'Объявление обновлено'})
+            else:
+                item['image_url'] = image_url
+        
+        add_pending_photos(item, uploads, listings_store.get_listing(country, category, listing_id) or listing)
+        listings_store.update_listing(country, category, listing_id, item)
+        enqueue_photo_uploads(country, category, listing_id, uploads)
+        return jsonify({'success': True, 'message': 'Объявление обновлено', 'photos_pending': len(uploads)})
     
     return jsonify({'error': 'Listing not found'}), 404
 
@@ -1735,109 +1371,87 @@ def admin_update_listing_with_photo():
     if category not in data:
         return jsonify({'error': 'Category not found'}), 404
     
-    for item in data[category]:
-        if item.get('id') == listing_id:
-            if request.form.get('title'):
-                item['title'] = request.form.get('title')
-            if request.form.get('description'):
-                item['description'] = request.form.get('description')
-            if request.form.get('city'):
-                item['city'] = request.form.get('city')
-            if request.form.get('currency_pairs'):
-                item['currency_pairs'] = request.form.get('currency_pairs')
-            if request.form.get('marketplace_category'):
-                item['marketplace_category'] = request.form.get('marketplace_category')
-            if request.form.get('destination'):
-                item['destination'] = request.form.get('destination')
-            if request.form.get('photo_type'):
-                item['photo_type'] = request.form.get('photo_type')
-            if request.form.get('medicine_type'):
-                item['medicine_type'] = request.form.get('medicine_type')
-            if request.form.get('kids_age'):
-                item['kids_age'] = request.form.get('kids_age')
-            if request.form.get('kids_category'):
-                item['kids_category'] = request.form.get('kids_category')
-            if request.form.get('contact_name'):
-                item['contact_name'] = request.form.get('contact_name')
-            if request.form.get('whatsapp'):
-                item['whatsapp'] = request.form.get('whatsapp')
-            if request.form.get('telegram'):
-                item['telegram'] = request.form.get('telegram')
-            
-            # Additional category-specific fields
-            if request.form.get('price'):
-                item['price'] = request.form.get('price')
-            if request.form.get('location'):
-                item['location'] = request.form.get('location')
-            if request.form.get('days'):
-                item['days'] = request.form.get('days')
-            if request.form.get('engine'):
-                item['engine'] = request.form.get('engine')
-            if request.form.get('year'):
-                item['year'] = request.form.get('year')
-            if request.form.get('transport_type'):
-                item['transport_type'] = request.form.get('transport_type')
-            if request.form.get('kitchen'):
-                item['kitchen'] = request.form.get('kitchen')
-            if request.form.get('google_maps'):
-                item['google_maps'] = request.form.get('google_maps')
-            if request.form.get('google_rating'):
-                item['google_rating'] = request.form.get('google_rating')
-            if request.form.get('restaurant_type'):
-                item['restaurant_type'] = request.form.get('restaurant_type')
-            if request.form.get('property_type'):
-                item['property_type'] = request.form.get('property_type')
-            if request.form.get('rooms'):
-                item['rooms'] = request.form.get('rooms')
-            if request.form.get('area'):
-                item['area'] = request.form.get('area')
-            if request.form.get('listing_type'):
-                item['listing_type'] = request.form.get('listing_type')
-            
-            # Handle single photo (backwards compatibility)
-            photo = request.files.get('photo')
-            if photo and photo.filename:
-                try:
-                    image_data = photo.read()
-                    caption = f"📷 {item.get('title', 'Объявление')}"
-                    file_id = send_photo_to_channel(image_data, caption)
-                    if file_id:
-                        item['telegram_file_id'] = file_id
-                        item['telegram_photo'] = True
-                        fresh_url = get_telegram_photo_url(file_id)
-                        if fresh_url:
-                            item['image_url'] = fresh_url
-                except Exception as e:
-                    print(f"Error uploading photo: {e}")
-            
-            # Handle 4 photos (photo_0, photo_1, photo_2, photo_3)
-            photo_fields = ['image_url', 'image_url_2', 'image_url_3', 'image_url_4']
-            for i in range(4):
-                photo_file = request.files.get(f'photo_{i}')
-                if photo_file and photo_file.filename:
-                    try:
-                        image_data = photo_file.read()
-                        print(f"DEBUG: Processing photo_{i}, size={len(image_data)} bytes")
-                        caption = f"📷 {item.get('title', 'Объявление')} - фото {i+1}"
-                        file_id = send_photo_to_channel(image_data, caption)
-                        print(f"DEBUG: photo_{i} uploaded, file_id={file_id[:50] if file_id else 'None'}...")
-                        if file_id:
-                            fresh_url = get_telegram_photo_url(file_id)
-                            print(f"DEBUG: photo_{i} fresh_url={fresh_url}")
-                            if fresh_url:
-                                old_url = item.get(photo_fields[i])
-                                item[photo_fields[i]] = fresh_url
-                                print(f"DEBUG: Updated {photo_fields[i]}: {old_url} -> {fresh_url}")
-                                if i == 0:
-                                    item['telegram_file_id'] = file_id
-                                    item['telegram_photo'] = True
-                            else:
-                                print(f"DEBUG: fresh_url is empty/None for photo_{i}")
-                    except Exception as e:
-                        print(f"Error uploading photo_{i}: {e}")
-            
-            save_data(country, data)
-            return jsonify({'success': True, 'message': 'Объявление обновлено'})
+    listing = listings_store.get_listing(country, category, listing_id)
+    if listing:
+        # Только изменённые формой поля: фото, загруженное в фоне (apply_photo_job)
+        # между чтением и записью, не затирается старыми image_url/photos_pending
+        item = {}
+        if request.form.get('title'):
+            item['title'] = request.form.get('title')
+        if request.form.get('description'):
+            item['description'] = request.form.get('description')
+        if request.form.get('city'):
+            item['city'] = request.form.get('city')
+        if request.form.get('currency_pairs'):
+            item['currency_pairs'] = request.form.get('currency_pairs')
+        if request.form.get('marketplace_category'):
+            item['marketplace_category'] = request.form.get('marketplace_category')
+        if request.form.get('destination'):
+            item['destination'] = request.form.get('destination')
+        if request.form.get('photo_type'):
+            item['photo_type'] = request.form.get('photo_type')
+        if request.form.get('medicine_type'):
+            item['medicine_type'] = request.form.get('medicine_type')
+        if request.form.get('kids_age'):
+            item['kids_age'] = request.form.get('kids_age')
+        if request.form.get('kids_category'):
+            item['kids_category'] = request.form.get('kids_category')
+        if request.form.get('contact_name'):
+            item['contact_name'] = request.form.get('contact_name')
+        if request.form.get('whatsapp'):
+            item['whatsapp'] = request.form.get('whatsapp')
+        if request.form.get('telegram'):
+            item['telegram'] = request.form.get('telegram')
+        
+        # Additional category-specific fields
+        if request.form.get('price'):
+            item['price'] = request.form.get('price')
+        if request.form.get('location'):
+            item['location'] = request.form.get('location')
+        if request.form.get('days'):
+            item['days'] = request.form.get('days')
+        if request.form.get('engine'):
+            item['engine'] = request.form.get('engine')
+        if request.form.get('year'):
+            item['year'] = request.form.get('year')
+        if request.form.get('transport_type'):
+            item['transport_type'] = request.form.get('transport_type')
+        if request.form.get('kitchen'):
+            item['kitchen'] = request.form.get('kitchen')
+        if request.form.get('google_maps'):
+            item['google_maps'] = request.form.get('google_maps')
+        if request.form.get('google_rating'):
+            item['google_rating'] = request.form.get('google_rating')
+        if request.form.get('restaurant_type'):
+            item['restaurant_type'] = request.form.get('restaurant_type')
+        if request.form.get('property_type'):
+            item['property_type'] = request.form.get('property_type')
+        if request.form.get('rooms'):
+            item['rooms'] = request.form.get('rooms')
+        if request.form.get('area'):
+            item['area'] = request.form.get('area')
+        if request.form.get('listing_type'):
+            item['listing_type'] = request.form.get('listing_type')
+        
+        # Фото загружаются в Telegram канал в фоне (photo_jobs), ответ - сразу
+        uploads = []
+        # Handle single photo (backwards compatibility)
+        photo = request.files.get('photo')
+        if photo and photo.filename:
+            uploads.append(('image_url', f"📷 {item.get('title', listing.get('title', 'Объявление'))}", photo.read(), None))
+        
+        # Handle 4 photos (photo_0, photo_1, photo_2, photo_3)
+        photo_fields = ['image_url', 'image_url_2', 'image_url_3', 'image_url_4']
+        for i in range(4):
+            photo_file = request.files.get(f'photo_{i}')
+            if photo_file and photo_file.filename:
+                caption = f"📷 {item.get('title', listing.get('title', 'Объявление'))} - фото {i+1}"
+                uploads.append((photo_fields[i], caption, photo_file.read(), None))
+        
+        add_pending_photos(item, uploads, listings_store.get_listing(country, category, listing_id) or listing)
+        listings_store.update_listing(country, category, listing_id, item)
+        enqueue_photo_uploads(country, category, listing_id, uploads)
+        return jsonify({'success': True, 'message': 'Объявление обновлено', 'photos_pending': len(uploads)})
     
     return jsonify({'error': 'Listing not found'}), 404
 
@@ -1864,12 +1478,16 @@ def admin_get_listing():
     if category not in data:
         return jsonify({'error': 'Category not found'}), 404
     
-    for item in data[category]:
-        if item.get('id') == listing_id:
-            return jsonify(item)
+    item = listings_store.get_listing(country, category, listing_id)
+    if item:
+        return jsonify(item)
     
     return jsonify({'error': 'Listing not found'}), 404
 
+# Фото объявлений на модерации: байты в pending_blobs, в записи - только хеши (photo_hashes)
+pending_blobs = BlobStore(os.environ.get('PENDING_BLOBS_DIR', 'pending_blobs'))
+PENDING_PHOTO_MAX = 1024 * 1024
+
 def load_pending_listings(country='vietnam'):
     pending_file = f"pending_{country}.json"
     if os.path.exists(pending_file):
@@ -1878,10 +1496,83 @@ def load_pending_listings(country='vietnam'):
     return []
 
 def save_pending_listings(country, listings):
+    for item in listings:
+        move_pending_data_urls(item)
     pending_file = f"pending_{country}.json"
     with open(pending_file, 'w', encoding='utf-8') as f:
         json.dump(listings, f, ensure_ascii=False, indent=2)
 
+def save_pending_photos(files):
+    """
+    Фото из формы подачи в pending_blobs: (хеши, None) или (None, ответ
+    с ошибкой), если фото больше 1 МБ
+    """
+    hashes = []
+    for i, file in enumerate(files):
+        if file and file.filename:
+            file_data = file.read()
+            if len(file_data) > PENDING_PHOTO_MAX:
+                return None, (jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400)
+            hashes.append(pending_blobs.put(file_data))
+    return hashes, None
+
+def move_pending_data_urls(item):
+    """Старые записи с base64 data URL: байты в pending_blobs, в записи - хеши"""
+    images = item.get('all_images') or ([item['image_url']] if item.get('image_url') else [])
+    if not any(isinstance(url, str) and url.startswith('data:') for url in images):
+        return
+    hashes = list(item.get('photo_hashes') or [])
+    for url in images:
+        if isinstance(url, str) and url.startswith('data:'):
+            try:
+                hashes.append(pending_blobs.put(base64.b64decode(url.split(',', 1)[1])))
+            except Exception as e:
+                print(f"Error moving pending photo to blob store: {e}")
+    item['photo_hashes'] = hashes
+    item.pop('all_images', None)
+    if str(item.get('image_url', '')).startswith('data:'):
+        item.pop('image_url')
+
+def pending_photo_url(digest, thumb=False):
+    return f"/api/pending-photo/{digest}" + ('?thumb=1' if thumb else '')
+
+def pending_photo_hashes():
+    """Хеши фото всех записей на модерации (во всех странах)"""
+    hashes = set()
+    for country in listings_store.COUNTRIES:
+        for item in load_pending_listings(country):
+            hashes.update(item.get('photo_hashes') or [])
+    return hashes
+
+# Фото, сохранённое (или переиспользованное) недавно, может принадлежать подаче,
+# запись которой ещё не попала в pending_{country}.json - его не удаляем сразу
+PENDING_BLOB_GRACE = 600
+
+def release_pending_photos(hashes):
+    """Удалить фото снятой с модерации записи, если на них больше никто не ссылается"""
+    referenced = pending_photo_hashes()
+    for digest in hashes or []:
+        if digest not in referenced:
+            pending_blobs.delete(digest, min_age=PENDING_BLOB_GRACE)
+    # Фото подач, оборванных ошибкой (второе фото больше 1 МБ и т.п.)
+    pending_blobs.collect(referenced)
+
+@app.route('/api/pending-photo/<digest>')
+def pending_photo(digest):
+    """Фото объявления на модерации по хешу (?thumb=1 - превью для списка)"""
+    thumb = request.args.get('thumb') == '1'
+    etag = f"{digest}-thumb" if thumb else digest
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        data = pending_blobs.thumbnail(digest) if thumb else pending_blobs.get(digest)
+        if data is None:
+            return jsonify({'error': 'Not Found'}), 404
+        response = Response(data, mimetype=telegram_files.content_type(data))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=86400, immutable'
+    return response
+
 @app.route('/api/submit-listing', methods=['POST'])
 def submit_listing():
     try:
@@ -1916,30 +1607,14 @@ def submit_listing():
         if not telegram:
             return jsonify({'error': 'Заполните Telegram контакт'}), 400
         
-        images = []
-        photos = request.files.getlist('photos')
-        if photos:
-            for i, file in enumerate(photos):
-                if file and file.filename:
-                    import base64
-                    file_data = file.read()
-                    if len(file_data) > 1024 * 1024:
-                        return jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400
-                    ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                    data_url = f"data:image/{ext};base64,{base64.b64encode(file_data).decode()}"
-                    images.append(data_url)
-        
-        if not images:
-            for i in range(4):
-                file = request.files.get(f'photo_{i}')
-                if file and file.filename:
-                    import base64
-                    file_data = file.read()
-                    if len(file_data) > 1024 * 1024:
-                        return jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400
-                    ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                    data_url = f"data:image/{ext};base64,{base64.b64encode(file_data).decode()}"
-                    images.append(data_url)
+        photo_hashes, error = save_pending_photos(request.files.getlist('photos'))
+        if error:
+            return error
+        
+        if not photo_hashes:
+            photo_hashes, error = save_pending_photos([request.files.get(f'photo_{i}') for i in range(4)])
+            if error:
+                return error
         
         listing_id = f"pending_{category}_{country}_{int(time.time())}_{len(load_pending_listings(country))}"
         
@@ -1952,8 +1627,7 @@ def submit_listing():
             'whatsapp': whatsapp,
             'telegram': telegram,
             'category': category,
-            'image_url': images[0] if images else None,
-            'all_images': images if len(images) > 1 else None,
+            'photo_hashes': photo_hashes,
             'date': datetime.now().isoformat(),
             'status': 'pending'
         }
@@ -2034,18 +1708,9 @@ def submit_restaurant():
         if not title or not description:
             return jsonify({'error': 'Заполните название и описание'}), 400
         
-        images = []
-        for i in range(4):
-            file = request.files.get(f'photo_{i}')
-            if file and file.filename:
-                import base64
-                file_data = file.read()
-                if len(file_data) > 1024 * 1024:
-                    return jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400
-                
-                ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                data_url = f"data:image/{ext};base64,{base64.b64encode(file_data).decode()}"
-                images.append(data_url)
+        photo_hashes, error = save_pending_photos([request.files.get(f'photo_{i}') for i in range(4)])
+        if error:
+            return error
         
         listing_id = f"pending_restaurant_{country}_{int(time.time())}_{len(load_pending_listings(country))}"
         
@@ -2063,8 +1728,7 @@ def submit_restaurant():
             'telegram': telegram,
             'price_category': price_category,
             'category': 'restaurants',
-            'image_url': images[0] if images else None,
-            'all_images': images if len(images) > 1 else None,
+            'photo_hashes': photo_hashes,
             'date': datetime.now().isoformat(),
             'status': 'pending'
         }
@@ -2106,18 +1770,9 @@ def submit_entertainment():
         if not title or not description:
             return jsonify({'error': 'Заполните название и описание'}), 400
         
-        images = []
-        for i in range(4):
-            file = request.files.get(f'photo_{i}')
-            if file and file.filename:
-                import base64
-                file_data = file.read()
-                if len(file_data) > 1024 * 1024:
-                    return jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400
-                
-                ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                data_url = f"data:image/{ext};base64,{base64.b64encode(file_data).decode()}"
-                images.append(data_url)
+        photo_hashes, error = save_pending_photos([request.files.get(f'photo_{i}') for i in range(4)])
+        if error:
+            return error
         
         listing_id = f"pending_entertainment_{country}_{int(time.time())}_{len(load_pending_listings(country))}"
         
@@ -2133,8 +1788,7 @@ def submit_entertainment():
             'telegram': telegram,
             'capacity': capacity,
             'category': 'entertainment',
-            'image_url': images[0] if images else None,
-            'all_images': images if len(images) > 1 else None,
+            'photo_hashes': photo_hashes,
             'date': datetime.now().isoformat(),
             'status': 'pending'
         }
@@ -2177,18 +1831,9 @@ def submit_tour():
         if not title or not description:
             return jsonify({'error': 'Заполните название и описание'}), 400
         
-        images = []
-        for i in range(4):
-            file = request.files.get(f'photo_{i}')
-            if file and file.filename:
-                import base64
-                file_data = file.read()
-                if len(file_data) > 1024 * 1024:
-                    return jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400
-                
-                ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                data_url = f"data:image/{ext};base64,{base64.b64encode(file_data).decode()}"
-                images.append(data_url)
+        photo_hashes, error = save_pending_photos([request.files.get(f'photo_{i}') for i in range(4)])
+        if error:
+            return error
         
         listing_id = f"pending_tour_{country}_{int(time.time())}_{len(load_pending_listings(country))}"
         
@@ -2205,8 +1850,7 @@ def submit_tour():
             'telegram': telegram,
             'group_size': group_size,
             'category': 'tours',
-            'image_url': images[0] if images else None,
-            'all_images': images if len(images) > 1 else None,
+            'photo_hashes': photo_hashes,
             'date': datetime.now().isoformat(),
             'status': 'pending'
         }
@@ -2250,18 +1894,9 @@ def submit_transport():
         if not title or not description:
             return jsonify({'error': 'Заполните название и описание'}), 400
         
-        images = []
-        for i in range(4):
-            file = request.files.get(f'photo_{i}')
-            if file and file.filename:
-                import base64
-                file_data = file.read()
-                if len(file_data) > 1024 * 1024:
-                    return jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400
-                
-                ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                data_url = f"data:image/{ext};base64,{base64.b64encode(file_data).decode()}"
-                images.append(data_url)
+        photo_hashes, error = save_pending_photos([request.files.get(f'photo_{i}') for i in range(4)])
+        if error:
+            return error
         
         listing_id = f"pending_transport_{country}_{int(time.time())}_{len(load_pending_listings(country))}"
         
@@ -2279,8 +1914,7 @@ def submit_transport():
             'whatsapp': whatsapp,
             'telegram': telegram,
             'category': 'transport',
-            'image_url': images[0] if images else None,
-            'all_images': images if len(images) > 1 else None,
+            'photo_hashes': photo_hashes,
             'date': datetime.now().isoformat(),
             'status': 'pending'
         }
@@ -2325,18 +1959,9 @@ def submit_realestate():
         if not title or not description:
             return jsonify({'error': 'Заполните название и описание'}), 400
         
-        images = []
-        for i in range(4):
-            file = request.files.get(f'photo_{i}')
-            if file and file.filename:
-                import base64
-                file_data = file.read()
-                if len(file_data) > 1024 * 1024:
-                    return jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400
-                
-                ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                data_url = f"data:image/{ext};base64,{base64.b64encode(file_data).decode()}"
-                images.append(data_url)
+        photo_hashes, error = save_pending_photos([request.files.get(f'photo_{i}') for i in range(4)])
+        if error:
+            return error
         
         listing_id = f"pending_realestate_{country}_{int(time.time())}_{len(load_pending_listings(country))}"
         
@@ -2355,8 +1980,7 @@ def submit_realestate():
             'whatsapp': whatsapp,
             'telegram': telegram,
             'category': 'real_estate',
-            'image_url': images[0] if images else None,
-            'all_images': images if len(images) > 1 else None,
+            'photo_hashes': photo_hashes,
             'date': datetime.now().isoformat(),
             'status': 'pending'
         }
@@ -2402,18 +2026,9 @@ def submit_kids():
         if not city or not age:
             return jsonify({'error': 'Заполните город и возраст'}), 400
         
-        images = []
-        for i in range(4):
-            file = request.files.get(f'photo_{i}')
-            if file and file.filename:
-                import base64
-                file_data = file.read()
-                if len(file_data) > 1024 * 1024:
-                    return jsonify({'error': f'Фото {i+1} превышает 1 МБ'}), 400
-                
-                ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                data_url = f"data:image/{ext};base64,{base64.b64encode(file_data).decode()}"
-                images.append(data_url)
+        photo_hashes, error = save_pending_photos([request.files.get(f'photo_{i}') for i in range(4)])
+        if error:
+            return error
         
         listing_id = f"pending_kids_{country}_{int(time.time())}_{len(load_pending_listings(country))}"
         
@@ -2430,8 +2045,7 @@ def submit_kids():
             'whatsapp': whatsapp,
             'telegram': telegram,
             'category': 'kids',
-            'image_url': images[0] if images else None,
-            'all_images': images if len(images) > 1 else None,
+            'photo_hashes': photo_hashes,
             'date': datetime.now().isoformat(),
             'status': 'pending'
         }
@@ -2458,7 +2072,14 @@ def admin_get_pending():
     if admin_country != 'all' and admin_country != country:
         return jsonify({'error': 'No access to this country'}), 403
     
-    pending = load_pending_listings(country)
+    # Фото - ссылками на /api/pending-photo, в самом файле только хеши
+    pending = []
+    for item in load_pending_listings(country):
+        hashes = item.get('photo_hashes')
+        if hashes:
+            item = dict(item, image_url=pending_photo_url(hashes[0], thumb=True),
+                        all_images=[pending_photo_url(digest) for digest in hashes])
+        pending.append(item)
     return jsonify(pending)
 
 @app.route('/api/admin/moderate', methods=['POST'])
@@ -2486,6 +2107,8 @@ def admin_moderate():
         return jsonify({'error': 'Listing not found'}), 404
     
     save_pending_listings(country, pending)
+    move_pending_data_urls(listing)
+    photo_hashes = listing.pop('photo_hashes', None) or []
     
     if action == 'approve':
         # Определяем категорию из объявления
@@ -2493,60 +2116,53 @@ def admin_moderate():
         listing['id'] = f"{country}_{category}_{int(time.time())}"
         listing['status'] = 'approved'
         
-        # Отправляем фото в Telegram канал и получаем URL
-        print(f"MODERATION: Checking image_url for listing {listing.get('id')}")
-        print(f"MODERATION: image_url exists: {bool(listing.get('image_url'))}")
-        if listing.get('image_url'):
+        # Фото отправляется в Telegram канал в фоне (photo_jobs), ответ - сразу
+        uploads = []
+        photo_fields = ['image_url', 'image_url_2', 'image_url_3', 'image_url_4']
+        for i, (field, digest) in enumerate(zip(photo_fields, photo_hashes)):
+            image_data = pending_blobs.get(digest)
+            if image_data:
+                if i == 0:
+                    caption = f"📋 {listing.get('title', 'Объявление')}\n\n{listing.get('description', '')[:500]}"
+                else:
+                    caption = f"📷 {listing.get('title', 'Объявление')} - фото {i+1}"
+                uploads.append((field, caption, image_data, None))
+        if not uploads and listing.get('image_url'):
             try:
-                import base64
                 image_url = listing['image_url']
                 image_data = None
-                print(f"MODERATION: image_url type: {image_url[:50] if image_url else 'None'}...")
+                source_url = None
                 
-                # Если это base64 data URL
+                # Если это base64 data URL - байты уходят в очередь, в объявлении не храним
                 if image_url.startswith('data:'):
-                    print("MODERATION: Decoding base64 image...")
                     header, b64_data = image_url.split(',', 1)
                     image_data = base64.b64decode(b64_data)
-                    print(f"MODERATION: Decoded {len(image_data)} bytes")
+                    listing.pop('image_url')
                 # Если это локальный файл
                 elif image_url.startswith('/static/') or image_url.startswith('static/'):
                     file_path = image_url.lstrip('/')
                     if os.path.exists(file_path):
                         with open(file_path, 'rb') as f:
                             image_data = f.read()
-                # Если это внешний URL
+                # Если это внешний URL - скачает фоновый поток
                 elif image_url.startswith('http'):
-                    try:
-                        resp = requests.get(image_url, timeout=30)
-                        if resp.status_code == 200:
-                            image_data = resp.content
-                    except:
-                        pass
+                    source_url = image_url
                 
-                if image_data:
-                    # Отправляем в Telegram канал и получаем file_id
+                if image_data or source_url:
                     caption = f"📋 {listing.get('title', 'Объявление')}\n\n{listing.get('description', '')[:500]}"
-                    file_id = send_photo_to_channel(image_data, caption)
-                    
-                    if file_id:
-                        listing['telegram_file_id'] = file_id
-                        listing['telegram_photo'] = True
-                        # Получаем актуальный URL для первоначального отображения
-                        fresh_url = get_telegram_photo_url(file_id)
-                        if fresh_url:
-                            listing['image_url'] = fresh_url
+                    uploads.append(('image_url', caption, image_data, source_url))
             except Exception as e:
-                print(f"Error uploading photo to Telegram: {e}")
-        
-        data = load_data(country)
-
-        if category not in data:
-            data[category] = []
-        data[category].insert(0, listing)
-        save_data(country, data)
-        return jsonify({'success': True, 'message': f'Объявление одобрено и добавлено в {category}'})
+                print(f"Error preparing photo for Telegram: {e}")
+        
+        add_pending_photos(listing, uploads)
+        listings_store.add_listing(country, category, listing, front=True)
+        # Байты фото уже в очереди загрузки - файлы модерации больше не нужны
+        enqueue_photo_uploads(country, category, listing['id'], uploads)
+        release_pending_photos(photo_hashes)
+        return jsonify({'success': True, 'message': f'Объявление одобрено и добавлено в {category}',
+                        'photos_pending': len(uploads)})
     else:
+        release_pending_photos(photo_hashes)
         return jsonify({'success': True, 'message': 'Объявление отклонено'})
 
 captcha_storage = {}
@@ -2829,6 +2445,7 @@ def add_city():
         filepath = f"static/icons/cities/{filename}"
         with open(filepath, 'wb') as f:
             f.write(file_data)
+        image_pipeline.process_in_background(filepath)
         image_path = f"/static/icons/cities/{filename}"
     
     new_city = {
@@ -2897,6 +2514,7 @@ def update_city_photo():
             filepath = f"static/icons/cities/{filename}"
             with open(filepath, 'wb') as f:
                 f.write(file_data)
+            image_pipeline.process_in_background(filepath)
             
             city['image'] = f"/static/icons/cities/{filename}"
             save_cities_config(country, category, cities)
@@ -3120,6 +2738,7 @@ def manual_parse():
         
         count = 0
         log_messages = []
+        uploads = []
         
         with client:
             entity = client.get_entity(channel)
@@ -3130,12 +2749,8 @@ def manual_parse():
             else:
                 messages = client.iter_messages(entity, limit=limit)
             
-            data = load_data(country)
-
-            if category not in data:
-                data[category] = []
-            
-            existing_ids = set(item.get('telegram_link', '') for item in data[category])
+            existing_ids = set(item.get('telegram_link', '') for item in load_data(country).get(category, ()))
+            new_listings = []
             
             for msg in messages:
                 if msg.text:
@@ -3168,34 +2783,34 @@ def manual_parse():
                             image_data = photo_buffer.read()
                             
                             if image_data:
-                                # Отправляем в Telegram канал с полным текстом
+                                # В наш Telegram канал с полным текстом - в фоне, после сохранения
                                 caption = f"📋 {new_listing['title']}\n\n{msg.text[:900] if msg.text else ''}"
-                                file_id = send_photo_to_channel(image_data, caption)
-                                
-                                if file_id:
-                                    new_listing['telegram_file_id'] = file_id
-                                    new_listing['telegram_photo'] = True
-                                    # Получаем актуальный URL
-                                    fresh_url = get_telegram_photo_url(file_id)
-                                    if fresh_url:
-                                        new_listing['image_url'] = fresh_url
-                                    log_messages.append(f"[✓] Фото #{count+1} загружено в Telegram канал")
+                                photo_upload = [('image_url', caption, image_data, None)]
+                                add_pending_photos(new_listing, photo_upload)
+                                uploads.append((listing_id, photo_upload))
+                                log_messages.append(f"[✓] Фото #{count+1} поставлено в очередь загрузки")
                         except Exception as photo_err:
                             log_messages.append(f"[!] Ошибка фото: {photo_err}")
                     
-                    data[category].insert(0, new_listing)
+                    new_listings.insert(0, new_listing)
                     existing_ids.add(telegram_link)
                     count += 1
                     
                     if count % 50 == 0:
                         log_messages.append(f"[{count}] Обработано {count} сообщений...")
             
-            save_data(country, data)
+            # Новые объявления - в начало категории отдельной вставкой (не перезапись страны
+            # копией, снятой до долгого обхода канала)
+            if new_listings:
+                listings_store.insert_listings(country, new_listings)
+            for listing_id, photo_upload in uploads:
+                enqueue_photo_uploads(country, category, listing_id, photo_upload)
         
         return jsonify({
             'success': True, 
             'message': f'Парсинг завершён. Добавлено {count} объявлений из канала @{channel}.',
             'count': count,
+            'photos_pending': len(uploads),
             'log': '\n'.join(log_messages[-30:])
         })
         
@@ -3245,21 +2860,96 @@ def send_photo_to_channel(image_data, caption=''):
         return None
 
 def get_telegram_photo_url(file_id):
-    """Получить актуальный URL фото по file_id"""
-    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    if not bot_token or not file_id:
+    """Постоянный URL фото по file_id (/img/tg/<file_id>, без токена бота)"""
+    if not file_id:
         return None
-    
+    return telegram_files.photo_url(file_id)
+
+# Поля с фото, которые ещё загружаются в Telegram канал
+PHOTOS_PENDING_FIELD = 'photos_pending'
+
+def add_pending_photos(item, uploads, listing=None):
+    """
+    Отметить в объявлении поля, фото для которых ставятся в очередь. item -
+    объявление или изменяемые поля; уже ожидающие поля берутся из listing
+    (текущее объявление), если он передан
+    """
+    if uploads:
+        current = (listing if listing is not None else item).get(PHOTOS_PENDING_FIELD)
+        item[PHOTOS_PENDING_FIELD] = list(current or []) + [field for field, *_ in uploads]
+
+def enqueue_photo_uploads(country, category, listing_id, uploads):
+    """uploads - [(поле, подпись, байты или None, source_url или None)]"""
+    for field, caption, image_data, source_url in uploads:
+        photo_job_queue.enqueue(country, category, listing_id, field, caption, image=image_data, source_url=source_url)
+
+def _photo_job_listing(job):
+    listing = listings_store.get_listing(job['country'], job['category'], job['listing_id'])
+    if listing is None:
+        # Объявление ещё не сохранено (ручной парсинг) или перенесено/удалено
+        raise photo_jobs.RetryLater('объявление не найдено')
+    pending = list(listing.get(PHOTOS_PENDING_FIELD) or [])
+    if job['field'] in pending:
+        pending.remove(job['field'])
+    return {PHOTOS_PENDING_FIELD: pending or None}
+
+def apply_photo_job(job, file_id):
+    """Фото загружено: постоянная ссылка в поле объявления"""
+    fields = _photo_job_listing(job)
+    fields[job['field']] = get_telegram_photo_url(file_id)
+    if job['field'] == 'image_url':
+        fields['telegram_file_id'] = file_id
+        fields['telegram_photo'] = True
+    listings_store.update_listing(job['country'], job['category'], job['listing_id'], fields)
+
+def fail_photo_job(job):
+    """Фото так и не загрузилось: снять отметку, объявление остаётся без него"""
     try:
-        file_url = f"https://api.telegram.org/bot{bot_token}/getFile?file_id={file_id}"
-        file_response = requests.get(file_url, timeout=10).json()
-        
-        if file_response.get('ok'):
-            file_path = file_response['result'].get('file_path')
-            return f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
-    except:
-        pass
-    return None
+        fields = _photo_job_listing(job)
+    except photo_jobs.RetryLater:
+        return
+    listings_store.update_listing(job['country'], job['category'], job['listing_id'], fields)
+
+photo_job_queue = photo_jobs.PhotoJobQueue(photo_jobs.DB_FILE, upload=send_photo_to_channel,
+                                           on_done=apply_photo_job, on_failed=fail_photo_job)
+
+@app.before_request
+def start_photo_jobs():
+    # Задания, оставшиеся с прошлого запуска, подхватываются первым запросом воркера
+    photo_job_queue.start()
+
+@app.before_request
+def start_image_backfill():
+    # Копии картинок static/ для srcset (под gunicorn __main__ не выполняется)
+    image_pipeline.start_backfill()
+
+# file_id -> file_path (getFile) и байты фото на диске для /img/tg/<file_id>
+telegram_file_cache = TelegramFileCache(int(os.environ.get('TELEGRAM_FILE_CACHE_SIZE', 10000)))
+telegram_photo_cache = PhotoDiskCache(os.environ.get('TELEGRAM_PHOTO_CACHE_DIR', 'tg_photo_cache'),
+                                      int(os.environ.get('TELEGRAM_PHOTO_CACHE_MB', 500)) * 1024 * 1024)
+
+@app.route('/img/tg/<file_id>')
+def telegram_photo(file_id):
+    """Фото из Telegram по file_id: содержимое не меняется, кэшируется надолго"""
+    if not telegram_files.is_file_id(file_id):
+        return jsonify({'error': 'Not Found'}), 404
+    etag = hashlib.md5(file_id.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        data = telegram_photo_cache.get(file_id)
+        if data is None:
+            data = telegram_file_cache.download(file_id)
+            if data is None:
+                response = jsonify({'error': 'Photo not available'})
+                response.status_code = 404
+                response.headers['Cache-Control'] = 'public, max-age=60'
+                return response
+            telegram_photo_cache.put(file_id, data)
+        response = Response(data, mimetype=telegram_files.content_type(data))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 # ============ ВНУТРЕННИЙ ЧАТ С TELEGRAM АВТОРИЗАЦИЕЙ ============
 
@@ -3414,7 +3104,15 @@ def verify_chat_code():
     
     return jsonify({'success': True, 'token': session_token, 'username': telegram_id})
 
+# Сообщения старше 3 дней отсекаются при чтении - метка меняется и со временем
+CHAT_ETAG_PERIOD = 600
+
+def chat_messages_tag():
+    chat_file = get_chat_file(request.args.get('country', 'vietnam'))
+    return f"{file_tag(chat_file)}:{int(time.time() // CHAT_ETAG_PERIOD)}"
+
 @app.route('/api/chat/messages', methods=['GET'])
+@conditional_get(chat_messages_tag)
 def get_chat_messages():
     country = request.args.get('country', 'vietnam')
     chat_data = load_chat_data(country)
@@ -0,0 +1,145 @@
+"""
+Хранилище файлов по содержимому (content-addressed) на диске.
+
+Фото из форм подачи объявлений раньше лежали в pending_{country}.json как
+base64 data URL (до 4 фото по 1 МБ на объявление), и файл в несколько
+мегабайт перезаписывался при каждой подаче и модерации. Теперь байты
+лежат здесь под своим sha256, а в записи на модерацию остаются только
+хеши. Одинаковые фото хранятся один раз.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+THUMBNAIL_SIZE = 400
+THUMBNAIL_QUALITY = 80
+
+
+def is_hash(value):
+    return isinstance(value, str) and bool(HASH_PATTERN.match(value))
+
+
+class BlobStore:
+    """Файлы directory/ab/<sha256>; запись атомарная (временный файл + rename)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, data):
+        """
+        Сохранить байты, вернуть их sha256. Если такой файл уже есть, его
+        mtime обновляется: новая ссылка на него не должна попасть под
+        collect/delete как давно брошенный файл
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            self._write(path, data)
+        return digest
+
+    def get(self, digest):
+        if not is_hash(digest):
+            return None
+        try:
+            with open(self.path(digest), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def exists(self, digest):
+        return is_hash(digest) and os.path.exists(self.path(digest))
+
+    def thumbnail(self, digest, size=THUMBNAIL_SIZE):
+        """
+        JPEG не больше size x size (кэшируется рядом с оригиналом). Если Pillow
+        не смог открыть файл - возвращается оригинал.
+        """
+        data = self.get(digest)
+        if data is None:
+            return None
+        thumb_path = f"{self.path(digest)}.thumb{size}.jpg"
+        try:
+            with open(thumb_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            pass
+        try:
+            import io
+            from PIL import Image
+            with Image.open(io.BytesIO(data)) as image:
+                image.thumbnail((size, size))
+                output = io.BytesIO()
+                image.convert('RGB').save(output, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            thumb = output.getvalue()
+        except Exception as e:
+            print(f"BLOBS: не удалось сделать превью {digest[:12]}: {e}")
+            return data
+        try:
+            self._write(thumb_path, thumb)
+        except OSError as e:
+            print(f"BLOBS: не удалось сохранить превью {digest[:12]}: {e}")
+        return thumb
+
+    def delete(self, digest, min_age=0):
+        """
+        Удалить файл и его превью. min_age - не трогать файл, записанный или
+        переиспользованный (put) за последние min_age секунд
+        """
+        if not is_hash(digest):
+            return
+        base = self.path(digest)
+        if min_age:
+            try:
+                if os.stat(base).st_mtime > time.time() - min_age:
+                    return
+            except OSError:
+                pass
+        directory = os.path.dirname(base)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        # Оригинал и его превью
+        for name in names:
+            if name.startswith(digest):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def collect(self, keep, min_age=3600):
+        """
+        Удалить файлы, хешей которых нет в keep и которые старше min_age секунд
+        (свежие могут принадлежать подаче, которая ещё не записана)
+        """
+        removed = 0
+        cutoff = time.time() - min_age
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                digest = name[:64]
+                if not is_hash(digest) or digest in keep:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
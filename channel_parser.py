@@ -7,6 +7,8 @@ import hashlib
 from datetime import datetime, timedelta
 from telethon import TelegramClient
 from telethon.tl.functions.channels import GetFullChannelRequest
+import listings_store
+from keyword_matcher import KeywordMatcher
 
 API_ID = int(os.environ.get('TELETHON_API_ID', 0))
 API_HASH = os.environ.get('TELETHON_API_HASH', '')
@@ -102,18 +104,12 @@ async def parse_vietnam():
     me = await client.get_me()
     print(f"✅ Авторизован как: {me.first_name}")
     
-    # Загрузить существующие данные
-    existing_data = {}
+    # Загрузить id существующих объявлений
     existing_ids = set()
     try:
-        with open('listings_vietnam.json', 'r', encoding='utf-8') as f:
-            existing_data = json.load(f)
-            for cat, items in existing_data.items():
-                if isinstance(items, list):
-                    for item in items:
-                        existing_ids.add(item.get('id'))
-    except:
-        pass
+        existing_ids = listings_store.get_listing_ids('vietnam')
+    except Exception as e:
+        print(f"⚠️ Не удалось прочитать базу: {e}")
     
     channels_to_parse = []
     for cat_key, channel_list in channels_config.get('channels', {}).items():
@@ -126,6 +122,7 @@ async def parse_vietnam():
     
     new_count = 0
     total_parsed = 0
+    new_items = []
     
     for i, (channel, category) in enumerate(channels_to_parse):
         try:
@@ -135,10 +132,7 @@ async def parse_vietnam():
             # Добавить только новые
             for item in listings:
                 if item['id'] not in existing_ids:
-                    cat = item['category']
-                    if cat not in existing_data:
-                        existing_data[cat] = []
-                    existing_data[cat].insert(0, item)
+                    new_items.append(item)
                     existing_ids.add(item['id'])
                     new_count += 1
             
@@ -149,10 +143,11 @@ async def parse_vietnam():
         
         await asyncio.sleep(1.5)
     
-    with open('listings_vietnam.json', 'w', encoding='utf-8') as f:
-        json.dump(existing_data, f, ensure_ascii=False, indent=2)
+    # Новые объявления вставляются в начало категорий (последние найденные - первыми)
+    if new_items:
+        listings_store.insert_listings('vietnam', list(reversed(new_items)), front=True)
     
-    total_now = sum(len(v) for v in existing_data.values() if isinstance(v, list))
+    total_now = len(listings_store.get_listing_ids('vietnam'))
     print(f"")
     print(f"📊 ИТОГО:")
     print(f"   Пропарсено: {total_parsed}")
@@ -164,39 +159,33 @@ async def parse_vietnam():
     except:
         pass
 
-if __name__ == '__main__':
-    print(f"🔄 Auto Parser: {datetime.now().strftime('%H:%M:%S')}")
-    print("🔥 РЕЖИМ: Агрессивный (50 сообщений, 1.5 сек)")
-    asyncio.run(parse_vietnam())
-    print("✅ Завершено!\n")
+SPAM_KEYWORDS = [
+    'deriv.com', 'synthetic indices', 'trading account',
+    'round-the-clock trading', 'forex', 'crypto trading',
+    'click here', 'open account', 'sign up', 'register now',
+    'жми сюда', 'заработок', 'быстрый доход', 'гарантированный',
+    'скам', 'опасно',
+    'kumpulan video viral', 'full video', 'join grup', 'klik link',
+    'video-info-viral', 'join sekarang',
+    'rent account', 'rent linkedin', 'rent facebook', 'make money',
+    'passive income', 'rent out', 'advertising account', 'payment proof',
+    'binance usdt', 'grow your business', 'promote message', 'promotion packages',
+    'reach more customers', 'boost visibility', 'active groups', 'drive engagement',
+    'anda ingin sukses', 'ubah cara berfikir', 'positive thinking', 'pilihan itu selalu ada',
+    'salam sukses', 'mulai sebelum orang',
+    'notif sms', 'hak cipta hack', 'bootloader', 'fingerprint', 'manufacturer',
+    'chat id of this chat'
+]
+SPAM_MATCHER = KeywordMatcher(SPAM_KEYWORDS)
 
 
 def is_spam(text):
     """Проверяет, не является ли объявление спамом/промо"""
-    if not text:
-        return False
-    
-    spam_keywords = [
-        'deriv.com', 'synthetic indices', 'trading account',
-        'round-the-clock trading', 'forex', 'crypto trading',
-        'click here', 'open account', 'sign up', 'register now',
-        'жми сюда', 'заработок', 'быстрый доход', 'гарантированный',
-        'скам', 'опасно',
-        'kumpulan video viral', 'full video', 'join grup', 'klik link',
-        'video-info-viral', 'join sekarang',
-        'rent account', 'rent linkedin', 'rent facebook', 'make money',
-        'passive income', 'rent out', 'advertising account', 'payment proof',
-        'binance usdt', 'grow your business', 'promote message', 'promotion packages',
-        'reach more customers', 'boost visibility', 'active groups', 'drive engagement',
-        'anda ingin sukses', 'ubah cara berfikir', 'positive thinking', 'pilihan itu selalu ada',
-        'salam sukses', 'mulai sebelum orang',
-        'notif sms', 'hak cipta hack', 'bootloader', 'fingerprint', 'manufacturer',
-        'chat id of this chat'
-    ]
-    
-    text_lower = text.lower()
-    for keyword in spam_keywords:
-        if keyword in text_lower:
-            return True
-    return False
+    return SPAM_MATCHER.search(text)
 
+
+if __name__ == '__main__':
+    print(f"🔄 Auto Parser: {datetime.now().strftime('%H:%M:%S')}")
+    print("🔥 РЕЖИМ: Агрессивный (50 сообщений, 1.5 сек)")
+    asyncio.run(parse_vietnam())
+    print("✅ Завершено!\n")
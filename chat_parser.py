@@ -5,6 +5,8 @@ import hashlib
 import requests
 from datetime import datetime
 from telethon import TelegramClient
+import listings_store
+from keyword_matcher import KeywordMatcher
 
 API_ID = int(os.environ.get('TELETHON_API_ID', 0))
 API_HASH = os.environ.get('TELETHON_API_HASH', '')
@@ -28,25 +30,24 @@ def is_english_only(text):
             return False
     return True
 
+SPAM_KEYWORDS = [
+    'deriv.com', 'synthetic indices', 'trading account',
+    'round-the-clock trading', 'forex', 'crypto trading',
+    'kumpulan video viral', 'full video', 'join grup', 'klik link',
+    'video-info-viral', 'join sekarang',
+    'rent account', 'rent linkedin', 'rent facebook', 'make money',
+    'passive income', 'rent out', 'advertising account',
+    'grow your business', 'promote message', 'promotion packages',
+    'reach more customers', 'boost visibility', 'drive engagement',
+    'anda ingin sukses', 'ubah cara berfikir', 'positive thinking',
+    'salam sukses', 'mulai sebelum orang',
+    'notif sms', 'hak cipta hack', 'bootloader', 'fingerprint'
+]
+SPAM_MATCHER = KeywordMatcher(SPAM_KEYWORDS)
+
 def is_spam(text):
     """Проверяет, не является ли объявление спамом/промо"""
-    if not text:
-        return False
-    spam_keywords = [
-        'deriv.com', 'synthetic indices', 'trading account',
-        'round-the-clock trading', 'forex', 'crypto trading',
-        'kumpulan video viral', 'full video', 'join grup', 'klik link',
-        'video-info-viral', 'join sekarang',
-        'rent account', 'rent linkedin', 'rent facebook', 'make money',
-        'passive income', 'rent out', 'advertising account',
-        'grow your business', 'promote message', 'promotion packages',
-        'reach more customers', 'boost visibility', 'drive engagement',
-        'anda ingin sukses', 'ubah cara berfikir', 'positive thinking',
-        'salam sukses', 'mulai sebelum orang',
-        'notif sms', 'hak cipta hack', 'bootloader', 'fingerprint'
-    ]
-    text_lower = text.lower()
-    return any(keyword in text_lower for keyword in spam_keywords)
+    return SPAM_MATCHER.search(text)
 
 def upload_to_bunny(file_bytes, filename):
     if not BUNNY_STORAGE_ZONE or not BUNNY_ACCESS_KEY:
@@ -88,11 +89,9 @@ async def parse_chats():
         print(f"❌ Не удалось подключиться: {str(e)[:100]}")
         return
     
-    listings_file = "listings_thailand.json"
     existing = []
-    if os.path.exists(listings_file):
-        with open(listings_file, 'r', encoding='utf-8') as f:
-            existing = json.load(f)
+    for items in listings_store.load_country('thailand').values():
+        existing.extend(items)
     
     existing_ids = {item['id'] for item in existing}
     existing_texts = {item.get('description', '')[:150] for item in existing}
@@ -171,9 +170,7 @@ async def parse_chats():
         await asyncio.sleep(120)  # 2 минуты задержка между каналами (менее агрессивно)
     
     if new_items:
-        all_items = existing + new_items
-        with open(listings_file, 'w', encoding='utf-8') as f:
-            json.dump(all_items, f, ensure_ascii=False, indent=2)
+        listings_store.insert_listings('thailand', new_items, front=False)
         print(f"💬 Добавлено {len(new_items)} новых сообщений")
         if total_skipped > 0:
             print(f"🚫 Отклонено англоязычных: {total_skipped}")
@@ -0,0 +1,287 @@
+"""
+Уменьшенные копии картинок из static/ для srcset.
+
+Баннеры, фото городов и категорий лежат в static/ в исходном размере
+(десятки файлов больше 1 МБ) и раньше отдавались как есть. Для каждой
+картинки делаются копии по ширинам WIDTHS в WebP (и AVIF, если Pillow
+собран с ним) плюс запасной формат (JPEG, PNG для картинок с прозрачностью)
+- в static/variants/ с тем же относительным путём. Копии описаны в
+static/variants/manifest.json ({url: {width, height, webp: [{w, url}], ...}}),
+по нему дашборд выставляет <img srcset>; картинки без записи в манифесте
+показываются как раньше. Копия, которая вышла не меньше исходного файла,
+не сохраняется - в srcset остаётся исходник.
+
+Загрузки через админку (баннеры, фото городов) обрабатываются в фоне
+(process_in_background), существующие файлы - фоновым backfill при первом
+запросе воркера (start_backfill) или командой:
+
+    python image_pipeline.py [--force] [пути...]
+"""
+import argparse
+import io
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка манифеста только внутри процесса
+    fcntl = None
+
+STATIC_DIR = 'static'
+VARIANTS_DIR = os.path.join(STATIC_DIR, 'variants')
+MANIFEST_FILE = os.path.join(VARIANTS_DIR, 'manifest.json')
+
+WIDTHS = (320, 640, 1280)
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+QUALITY = {'webp': 80, 'avif': 55, 'jpeg': 82}
+# Скорость кодировщика AVIF (0-10): 8 втрое быстрее умолчания при почти том же размере
+AVIF_SPEED = 8
+
+_manifest_lock = threading.Lock()
+
+
+def _formats():
+    """Форматы копий, которые умеет этот Pillow (запасной - всегда)"""
+    from PIL import features
+    return [name for name in ('avif', 'webp') if features.check(name)]
+
+
+def static_url(path):
+    """static/images/a.png -> /static/images/a.png"""
+    return '/' + os.path.relpath(path).replace(os.sep, '/')
+
+
+def _variant_path(path, width, ext):
+    relative = os.path.splitext(os.path.relpath(path, STATIC_DIR))[0]
+    return os.path.join(VARIANTS_DIR, f"{relative}.{width}.{ext}")
+
+
+def variant_widths(width):
+    """Ширины копий: корзины WIDTHS меньше исходной + исходная, если она не больше последней корзины"""
+    widths = [w for w in WIDTHS if w < width]
+    if width <= WIDTHS[-1]:
+        widths.append(width)
+    return widths
+
+
+def load_manifest():
+    """Манифест копий ({'widths': [...], 'images': {url: запись}})"""
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'widths': list(WIDTHS), 'images': {}}
+
+
+def _update_manifest(changes):
+    """changes - {url: запись или None (удалить)}; запись под блокировкой файла"""
+    os.makedirs(VARIANTS_DIR, exist_ok=True)
+    with _manifest_lock, open(f"{MANIFEST_FILE}.lock", 'w') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = load_manifest()
+        manifest['widths'] = list(WIDTHS)
+        images = manifest.setdefault('images', {})
+        for url, entry in changes.items():
+            if entry is None:
+                images.pop(url, None)
+            else:
+                images[url] = entry
+        tmp_path = f"{MANIFEST_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+        os.replace(tmp_path, MANIFEST_FILE)
+
+
+def _is_current(entry, path):
+    if not entry or entry.get('mtime') != os.stat(path).st_mtime_ns:
+        return False
+    urls = [item['url'] for key in ('avif', 'webp', 'fallback') for item in entry.get(key, [])]
+    return all(os.path.exists(url.lstrip('/')) for url in urls)
+
+
+def _encode(image, fmt):
+    output = io.BytesIO()
+    if fmt == 'jpeg':
+        image.convert('RGB').save(output, 'JPEG', quality=QUALITY['jpeg'], optimize=True, progressive=True)
+    elif fmt == 'png':
+        image.save(output, 'PNG', optimize=True)
+    elif fmt == 'avif':
+        image.save(output, 'AVIF', quality=QUALITY['avif'], speed=AVIF_SPEED)
+    else:
+        image.save(output, 'WEBP', quality=QUALITY['webp'])
+    return output.getvalue()
+
+
+def _save(image, path, fmt, limit):
+    """
+    Записать копию, если она меньше limit байт (исходника); иначе копия не
+    нужна - браузер получит исходник. Возвращает размер или None.
+    """
+    data = _encode(image, fmt)
+    if len(data) >= limit:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def make_variants(path):
+    """
+    Сделать копии одной картинки; возвращает запись манифеста. Копии не
+    меньше исходного файла отбрасываются: в srcset вместо них исходник.
+    """
+    from PIL import Image, ImageOps
+    with Image.open(path) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        width, height = image.size
+        fallback = 'png' if image.mode == 'RGBA' else 'jpeg'
+        source_size = os.path.getsize(path)
+        entry = {'width': width, 'height': height, 'mtime': os.stat(path).st_mtime_ns,
+                 'size': source_size, 'fallback': []}
+        formats = _formats()
+        for fmt in formats:
+            entry[fmt] = []
+        for w in variant_widths(width):
+            resized = image if w == width else image.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+            for fmt in formats:
+                variant = _variant_path(path, w, fmt)
+                size = _save(resized, variant, fmt, source_size)
+                if size is not None:
+                    entry[fmt].append({'w': w, 'url': static_url(variant), 'size': size})
+            # Исходный размер в запасном формате - сам исходный файл
+            if w < width:
+                variant = _variant_path(path, w, 'jpg' if fallback == 'jpeg' else 'png')
+                size = _save(resized, variant, fallback, source_size)
+                if size is not None:
+                    entry['fallback'].append({'w': w, 'url': static_url(variant), 'size': size})
+    return entry
+
+
+def process_image(path, force=False):
+    """Копии картинки из static/ (если исходник не менялся - ничего не делает)"""
+    if not path.lower().endswith(SOURCE_EXTENSIONS):
+        return None
+    url = static_url(path)
+    if not force and _is_current(load_manifest()['images'].get(url), path):
+        return None
+    entry = make_variants(path)
+    _update_manifest({url: entry})
+    return entry
+
+
+def process_in_background(path):
+    """Обработать загруженную картинку в фоновом потоке (не задерживая ответ)"""
+    def run():
+        try:
+            process_image(path)
+        except Exception as e:
+            print(f"IMAGES: ошибка обработки {path}: {e}")
+    threading.Thread(target=run, daemon=True).start()
+
+
+_backfill_started = False
+_backfill_lock = threading.Lock()
+
+
+def start_backfill():
+    """
+    Запустить backfill в фоновом потоке один раз на процесс. Из воркеров
+    gunicorn обрабатывает один - тот, что первым взял блокировку файла;
+    остальные пропускают.
+    """
+    global _backfill_started
+    if _backfill_started:
+        return
+    with _backfill_lock:
+        if _backfill_started:
+            return
+        _backfill_started = True
+
+    def run():
+        try:
+            os.makedirs(VARIANTS_DIR, exist_ok=True)
+            with open(os.path.join(VARIANTS_DIR, 'backfill.lock'), 'w') as lock:
+                if fcntl:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return
+                backfill()
+        except Exception as e:
+            print(f"IMAGES: ошибка backfill: {e}")
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _source_files(paths):
+    for root_path in paths:
+        if os.path.isfile(root_path):
+            yield root_path
+            continue
+        for root, dirs, names in os.walk(root_path):
+            dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != VARIANTS_DIR)
+            for name in sorted(names):
+                if name.lower().endswith(SOURCE_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def prune():
+    """Убрать из манифеста (и с диска) копии картинок, которых больше нет"""
+    manifest = load_manifest()
+    removed = {url: None for url in manifest['images'] if not os.path.exists(url.lstrip('/'))}
+    for url in removed:
+        entry = manifest['images'][url]
+        for key in ('avif', 'webp', 'fallback'):
+            for item in entry.get(key, []):
+                try:
+                    os.remove(item['url'].lstrip('/'))
+                except OSError:
+                    pass
+    if removed:
+        _update_manifest(removed)
+    return len(removed)
+
+
+def backfill(paths=(STATIC_DIR,), force=False):
+    """Копии для всех картинок в paths; возвращает (обработано, пропущено, ошибок)"""
+    processed = skipped = failed = 0
+    source_bytes = variant_bytes = 0
+    for path in _source_files(paths):
+        try:
+            entry = process_image(path, force=force)
+        except Exception as e:
+            print(f"IMAGES: {path}: {e}")
+            failed += 1
+            continue
+        if entry is None:
+            skipped += 1
+            continue
+        processed += 1
+        best = entry.get('webp') or entry['fallback']
+        if best:
+            source_bytes += entry['size']
+            variant_bytes += best[-1]['size']
+        print(f"IMAGES: {path} {entry['width']}x{entry['height']} {entry['size'] // 1024} КБ -> "
+              + ', '.join(f"{item['w']}w {item['size'] // 1024} КБ" for item in best))
+    removed = prune()
+    print(f"IMAGES: обработано {processed}, без изменений {skipped}, ошибок {failed}, удалено записей {removed}")
+    if source_bytes:
+        print(f"IMAGES: самая крупная копия WebP {variant_bytes // 1024} КБ против {source_bytes // 1024} КБ исходников")
+    return processed, skipped, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Уменьшенные копии картинок из static/ для srcset')
+    parser.add_argument('paths', nargs='*', default=[STATIC_DIR], help='файлы или каталоги (по умолчанию static/)')
+    parser.add_argument('--force', action='store_true', help='пересоздать копии даже для неизменённых файлов')
+    args = parser.parse_args()
+    backfill(args.paths, force=args.force)
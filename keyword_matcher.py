@@ -0,0 +1,62 @@
+"""
+Поиск многих ключевых слов за один проход по тексту.
+
+Фильтры и парсеры проверяли `any(kw in text.lower() for kw in keywords)` -
+отдельный проход по тексту на каждое слово. KeywordMatcher компилирует
+таблицу слов (группа -> слова) в одно регулярное выражение-альтернативу и
+находит все совпавшие группы за один проход.
+
+Выражение - просмотр вперёд `(?=(слово1|слово2|...))` со словами от длинных
+к коротким, поэтому в каждой позиции текста находится самое длинное слово.
+Более короткие слова, совпавшие в той же позиции, - это его префиксы; их
+группы заранее добавлены к группам длинного слова, так что результат тот же,
+что у проверки каждого слова подстрокой.
+"""
+import re
+
+
+class KeywordMatcher:
+    """Скомпилированная таблица ключевых слов {группа: [слова]} или список слов"""
+
+    def __init__(self, groups):
+        if not isinstance(groups, dict):
+            groups = {True: groups}
+        keyword_groups = {}
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if keyword:
+                    keyword_groups.setdefault(keyword, set()).add(group)
+
+        keywords = sorted(keyword_groups, key=len, reverse=True)
+        # Группы слова = его группы + группы всех слов-префиксов (они совпадают в той же позиции)
+        self._groups = {
+            keyword: frozenset().union(*(keyword_groups[other] for other in keywords
+                                         if keyword.startswith(other)))
+            for keyword in keywords
+        }
+        self.all_groups = frozenset(groups)
+        if keywords:
+            alternation = '|'.join(re.escape(keyword) for keyword in keywords)
+            self._search = re.compile(alternation).search
+            self._finditer = re.compile(f"(?=({alternation}))").finditer
+        else:
+            self._search = self._finditer = None
+
+    def search(self, text):
+        """Есть ли в тексте хотя бы одно слово"""
+        if not text or self._search is None:
+            return False
+        return self._search(text.lower()) is not None
+
+    def groups(self, text):
+        """Множество групп, чьи слова встречаются в тексте"""
+        if not text or self._finditer is None:
+            return frozenset()
+        found = set()
+        lookup = self._groups
+        for match in self._finditer(text.lower()):
+            found |= lookup[match.group(1)]
+            if len(found) == len(self.all_groups):
+                break
+        return found
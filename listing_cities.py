@@ -0,0 +1,88 @@
+"""
+Города объявлений.
+
+Раньше каждый фильтр в get_listings держал свой словарь вариантов написания
+города и на каждом запросе искал их подстрокой в title/description. Таблицы
+остались своими у каждой категории (дашборд шлёт разные значения, и набор
+вариантов у категорий исторически разный), но поиск идёт по индексу
+ключевых слов снимка категории (listing_indexes.CategoryIndex.keyword_listings),
+а не по тексту на каждом запросе. Города для счётчиков (/api/city-counts,
+фасет city) извлекаются один раз при загрузке объявления (Listing.city_ids).
+"""
+from keyword_matcher import KeywordMatcher
+
+# Канонический id -> варианты написания для счётчиков городов (ищутся подстрокой)
+CITY_KEYWORDS = {
+    'nhatrang': ['нячанг', 'nha trang', 'nhatrang', 'nha_trang'],
+    'hochiminh': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh'],
+    'danang': ['дананг', 'da nang', 'danang', 'da_nang'],
+    'hanoi': ['ханой', 'hanoi', 'ha_noi'],
+    'phuquoc': ['фукуок', 'phu quoc', 'phuquoc', 'phu_quoc'],
+    'phanthiet': ['фантьет', 'phan thiet', 'phanthiet', 'phan_thiet'],
+    'muine': ['муйне', 'mui ne', 'muine', 'mui_ne'],
+    'camranh': ['камрань', 'cam ranh', 'camranh', 'cam_ranh'],
+    'dalat': ['далат', 'da lat', 'dalat', 'da_lat'],
+    'hoian': ['хойан', 'hoi an', 'hoian', 'hoi_an'],
+}
+
+# Названия для ответов API (порядок - как в счётчиках дашборда)
+CITY_NAMES = {
+    'nhatrang': 'Нячанг',
+    'hochiminh': 'Хошимин',
+    'hanoi': 'Ханой',
+    'phuquoc': 'Фукуок',
+    'phanthiet': 'Фантьет',
+    'muine': 'Муйне',
+    'danang': 'Дананг',
+    'camranh': 'Камрань',
+    'dalat': 'Далат',
+    'hoian': 'Хойан',
+}
+
+# Таблицы фильтров по городу: значение параметра -> варианты написания.
+# Ключ ищется как есть (русское название из дашборда) или в нижнем регистре
+# (KIDS_CITY_KEYWORDS, REAL_ESTATE_CITY_KEYWORDS); неизвестное значение -
+# подстрокой. restaurants, tours, entertainment, marketplace, visas, transport:
+CITY_FILTER_KEYWORDS = {
+    'Нячанг': ['нячанг', 'nha trang', 'nhatrang', 'nha_trang'],
+    'Хошимин': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh', 'hochiminh'],
+    'Дананг': ['дананг', 'da nang', 'danang', 'da_nang'],
+    'Ханой': ['ханой', 'hanoi', 'ha_noi'],
+    'Фукуок': ['фукуок', 'phu quoc', 'phuquoc', 'phu_quoc'],
+    'Фантьет': ['фантьет', 'phan thiet', 'phanthiet', 'phan_thiet'],
+    'Муйне': ['муйне', 'mui ne', 'muine', 'mui_ne'],
+    'Камрань': ['камрань', 'cam ranh', 'camranh', 'cam_ranh'],
+    'Далат': ['далат', 'da lat', 'dalat', 'da_lat'],
+    'Хойан': ['хойан', 'hoi an', 'hoian', 'hoi_an'],
+}
+MONEY_EXCHANGE_CITY_KEYWORDS = {
+    'Нячанг': ['нячанг', 'nha trang', 'nhatrang', 'nha_trang'],
+    'Хошимин': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh'],
+    'Дананг': ['дананг', 'da nang', 'danang', 'da_nang'],
+    'Фукуок': ['фукуок', 'phu quoc', 'phuquoc', 'phu_quoc'],
+}
+KIDS_CITY_KEYWORDS = {
+    'nha trang': ['nha trang', 'nhatrang', 'нячанг'],
+    'da nang': ['da nang', 'danang', 'дананг'],
+    'phu quoc': ['phu quoc', 'phuquoc', 'фукуок'],
+    'ho chi minh': ['ho chi minh', 'hochiminh', 'hcm', 'хошимин', 'сайгон'],
+}
+REAL_ESTATE_CITY_KEYWORDS = {
+    'nhatrang': ['nhatrang', 'nha trang', 'нячанг'],
+    'danang': ['danang', 'da nang', 'дананг'],
+    'hochiminh': ['hochiminh', 'ho chi minh', 'hcm', 'хошимин', 'сайгон'],
+    'hanoi': ['hanoi', 'ha noi', 'ханой'],
+    'phuquoc': ['phuquoc', 'phu quoc', 'фукуок'],
+    'dalat': ['dalat', 'da lat', 'далат'],
+}
+
+_CITY_MATCHER = KeywordMatcher(CITY_KEYWORDS)
+
+
+def extract_city_ids(data):
+    """
+    Канонические id городов объявления для счётчиков: по заголовку, описанию
+    и полю city (или location, если city пуст) - как считала /api/city-counts
+    """
+    place = str(data.get('city', '') or data.get('location', ''))
+    return frozenset(_CITY_MATCHER.groups(f"{data.get('title', '')} {data.get('description', '')} {place}"))
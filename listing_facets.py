@@ -0,0 +1,116 @@
+"""
+Фасеты объявлений: сколько видимых объявлений категории приходится на
+каждое значение фильтра (тип медицины, тип для детей, город и т.д.).
+
+Значения фасета для объявления считаются функцией из FACETS, счётчики
+категории - один раз на снимок в listing_indexes.CategoryIndex.facet_counts.
+Запись в категорию публикует новый снимок только этой категории; после
+вставки, скрытия, переноса или удаления одного объявления уже посчитанные
+счётчики затронутых категорий поправляются только на снятые и добавленные
+объявления (CategoryIndex.updated), остальные категории отдаются готовыми.
+Целиком пересчитываются только категории после save_country и после
+записи другим процессом.
+"""
+from keyword_matcher import KeywordMatcher
+
+# Значение medicine_type в данных -> кнопка фильтра медицины
+MEDICINE_TYPE_MAP = {
+    'pharmacy': 'questions',
+    'doctor': 'doctors',
+    'massage': 'clinics',
+    'insurance': 'insurance',
+    'directions': 'directions',
+    'clinic': 'clinics',
+    'hospital': 'clinics',
+    'questions': 'questions',
+    'clinics': 'clinics',
+    'doctors': 'doctors',
+    'dentist': 'directions',
+    'lab': 'directions',
+    'therapy': 'directions',
+    'вопросы': 'questions',
+    'клиники': 'clinics',
+    'врачи': 'doctors',
+    'страховка': 'insurance',
+    'направления': 'directions'
+}
+MEDICINE_TYPES = ('questions', 'clinics', 'doctors', 'insurance', 'directions')
+
+# Русские названия kids_type -> кнопка фильтра "Детям"
+KIDS_TYPE_MAP = {
+    'школы': 'schools',
+    'школа': 'schools',
+    'детские сады': 'products',
+    'детский сад': 'products',
+    'садик': 'products',
+    'мероприятия': 'events',
+    'мероприятие': 'events',
+    'няни': 'nannies',
+    'няня': 'nannies',
+    'товары': 'products'
+}
+KIDS_TYPES = ('events', 'nannies', 'schools', 'products')
+
+# Гражданство для визарана: точные значения поля citizenship и слова в тексте
+CITIZENSHIP_VALUES = {
+    'russia': ['российское', 'россия', 'рф', 'russia', 'russian'],
+    'kazakhstan': ['казахское', 'казахстан', 'kz', 'kazakhstan'],
+    'belarus': ['белорусское', 'беларусь', 'беларуси', 'belarus', 'belarusian'],
+    'ukraine': ['украинское', 'украина', 'украины', 'ukraine', 'ukrainian']
+}
+NATIONALITY_KEYWORDS = {
+    'russia': ['росси', 'россиян', 'рф', 'russia', 'russian', 'для русских', 'для рф', 'российск'],
+    'kazakhstan': ['казах', 'казакстан', 'kz', 'kazakhstan', 'для казахов', 'кз', 'казахск'],
+    'belarus': ['белорус', 'беларус', 'belarus', 'belarusian', 'для белорусов', 'рб'],
+    'ukraine': ['украин', 'ukraine', 'ukrainian', 'для украинцев', 'ua']
+}
+NATIONALITY_MATCHER = KeywordMatcher(NATIONALITY_KEYWORDS)
+
+def medicine_type(item):
+    return (MEDICINE_TYPE_MAP.get(str(item.get('medicine_type', '')).lower(), 'questions'),)
+
+
+def kids_type(item):
+    value = str(item.get('kids_type', '') or item.get('kids_category', '')).lower().strip()
+    if value in KIDS_TYPES:
+        return (value,)
+    return (KIDS_TYPE_MAP.get(value, 'schools'),)
+
+
+def city(item):
+    """Города из заголовка, описания и поля city (или location), посчитанные при загрузке"""
+    return item.city_ids
+
+
+def nationality(item):
+    found = set(NATIONALITY_MATCHER.groups(f"{item.get('description', '')}\n{item.get('title', '')}"))
+    citizen = str(item.get('citizenship', '')).lower()
+    if citizen:
+        found.update(name for name, values in CITIZENSHIP_VALUES.items() if citizen in values)
+    return found
+
+
+def _field(name):
+    def values(item):
+        value = item.get(name)
+        return (str(value),) if value not in (None, '') else ()
+    return values
+
+
+# Фасет -> функция значений объявления, значения с нулём по умолчанию,
+# категории (None - любая категория)
+FACETS = {
+    'medicine_type': {'values': medicine_type, 'defaults': MEDICINE_TYPES, 'categories': ('medicine',)},
+    'kids_type': {'values': kids_type, 'defaults': KIDS_TYPES, 'categories': ('kids',)},
+    'transport_type': {'values': _field('transport_type'), 'defaults': (), 'categories': None},
+    'marketplace_category': {'values': _field('marketplace_category'), 'defaults': (), 'categories': None},
+    'listing_type': {'values': _field('listing_type'), 'defaults': (), 'categories': None},
+    'city': {'values': city, 'defaults': (), 'categories': None},
+    'nationality': {'values': nationality, 'defaults': tuple(NATIONALITY_KEYWORDS), 'categories': ('visas',)},
+}
+
+
+def facets_for(category):
+    """Фасеты, которые имеют смысл для категории"""
+    return [name for name, facet in FACETS.items()
+            if facet['categories'] is None or category in facet['categories']]
@@ -0,0 +1,352 @@
+"""
+Фильтры /api/listings: реестр по категориям и планировщик.
+
+Категория объявляет свои фильтры в CATEGORY_FILTERS: параметр запроса ->
+функция, которая по значению параметра строит Condition. Условие - это
+готовые множества из индекса категории (listing_indexes.CategoryIndex),
+предикат по полям, посчитанным при загрузке (Listing.price_value и т.д.),
+или и то и другое.
+
+filter_listings не копирует список на каждом фильтре: самое маленькое
+множество из индекса становится источником кандидатов, остальные условия
+проверяются за один проход, а порядок выдачи берётся из отсортированного
+индекса категории. Новый фильтр, построенный на индексе, сразу получает
+этот путь.
+"""
+import re
+
+from keyword_matcher import KeywordMatcher
+from listing_cities import (CITY_FILTER_KEYWORDS, KIDS_CITY_KEYWORDS, MONEY_EXCHANGE_CITY_KEYWORDS,
+                            REAL_ESTATE_CITY_KEYWORDS)
+from listing_facets import CITIZENSHIP_VALUES, NATIONALITY_MATCHER
+from listing_indexes import field_text
+
+# Таблицы ключевых слов текстовых фильтров: {значение фильтра: [слова]}
+VISA_DESTINATION_KEYWORDS = {
+    'камбоджа': ['cambodia', 'камбодж', 'кампучия'],
+    'лаос': ['laos', 'лаос'],
+    'малайзия': ['malaysia', 'малайзия'],
+    'непал': ['nepal', 'непал'],
+    'шри-ланка': ['sri lanka', 'srilanka', 'шри-ланка', 'шриланка'],
+    'сингапур': ['singapore', 'сингапур']
+}
+MEDICINE_TYPE_KEYWORDS = {
+    'questions': ['вопрос', 'помоги', 'подскаж', 'где найти', 'посоветуй', 'кто знает', '?'],
+    'clinics': ['клиник', 'госпиталь', 'больниц', 'hospital', 'clinic', 'медцентр'],
+    'doctors': ['врач', 'доктор', 'doctor', 'терапевт', 'стоматолог', 'специалист', 'медик'],
+    'insurance': ['страхов', 'insurance', 'полис', 'policy'],
+    'directions': ['направлен', 'специализац', 'услуг', 'обследован', 'анализ', 'аптек', 'массаж', 'pharmacy', 'massage']
+}
+TRANSPORT_DEAL_KEYWORDS = {
+    'sale': ['продаж', 'куплю', 'продам', 'цена', '$', '₫', 'доллар'],
+    'rent': ['аренд', 'сдам', 'сдаю', 'наём', 'прокат', 'почасово']
+}
+
+VISA_DESTINATION_MATCHER = KeywordMatcher(VISA_DESTINATION_KEYWORDS)
+MEDICINE_TYPE_MATCHER = KeywordMatcher(MEDICINE_TYPE_KEYWORDS)
+TRANSPORT_DEAL_MATCHER = KeywordMatcher(TRANSPORT_DEAL_KEYWORDS)
+
+# Кнопка фильтра медицины -> значения medicine_type в данных
+MEDICINE_TYPE_VALUES = {
+    'questions': ['questions', 'pharmacy'],
+    'clinics': ['clinics', 'clinic', 'hospital', 'massage'],
+    'doctors': ['doctors', 'doctor'],
+    'insurance': ['insurance'],
+    'directions': ['directions', 'dentist', 'lab', 'therapy']
+}
+
+# Кнопка фильтра "Детям" -> значение kids_type в данных (products = Детский сад)
+KIDS_TYPE_VALUES = {
+    'products': 'Детский сад',
+    'schools': 'schools',
+    'events': 'events',
+    'nannies': 'nannies'
+}
+
+# Кандидаты берутся из множества индекса, если оно во столько раз меньше
+# категории; иначе - один проход по отсортированному индексу
+DRIVER_RATIO = 4
+
+
+class Condition:
+    """
+    Условие фильтра: объявление подходит, если оно есть в одном из множеств
+    sets или predicate(item) истинно
+    """
+    __slots__ = ('sets', 'predicate')
+
+    def __init__(self, sets=(), predicate=None):
+        self.sets = tuple(sets)
+        self.predicate = predicate
+
+    @property
+    def indexed(self):
+        """Все подходящие объявления перечислены в sets (можно брать кандидатов)"""
+        return self.predicate is None
+
+    def size(self):
+        return sum(len(items) for items in self.sets)
+
+    def __call__(self, item):
+        for items in self.sets:
+            if item in items:
+                return True
+        return self.predicate is not None and self.predicate(item)
+
+
+def _is_visible(item):
+    return not item.is_hidden
+
+
+def _city(keywords, fields, lower_key=False, include_unspecified=None):
+    """
+    Город в полях fields (имя поля или кортеж полей, склеенных пробелом).
+    Значение из таблицы keywords - по индексу ключевых слов категории;
+    остальные значения ищутся подстрокой. lower_key - ключ таблицы в
+    нижнем регистре. include_unspecified - поля, пустота которых означает
+    "подходит для любого города".
+    """
+    matcher = KeywordMatcher(keywords) if keywords else None
+    fields = tuple(fields)
+
+    def build(index, value, filters):
+        key = value.lower() if lower_key else value
+        sets = []
+        predicate = None
+        if matcher is not None and key in keywords:
+            sets.append(index.keyword_listings(matcher, fields, key))
+        else:
+            needle = value.lower()
+            predicate = lambda item: any(needle in field_text(item, field).lower() for field in fields)
+        if include_unspecified:
+            sets.append(index.without_fields(include_unspecified))
+        return Condition(sets, predicate)
+    return build
+
+
+def _equals(field):
+    def build(index, value, filters):
+        return Condition([index.value_listings(field, value)])
+    return build
+
+
+def _kids_type(index, value, filters):
+    mapped = KIDS_TYPE_VALUES.get(value, value)
+    return Condition([index.value_listings('kids_type', mapped), index.value_listings('kids_type', value)])
+
+
+def _max_age(index, value, filters):
+    try:
+        max_age = int(value)
+    except ValueError:
+        return None
+
+    def check_age(item):
+        # Минимальный возраст из диапазона; возраст не указан - показываем
+        numbers = re.findall(r'\d+', str(item.get('age', '')))
+        return min(int(n) for n in numbers) <= max_age if numbers else True
+
+    return Condition(predicate=check_age)
+
+
+def _destination(index, value, filters):
+    destination = value.lower()
+    if destination in VISA_DESTINATION_KEYWORDS:
+        # Русское название -> все варианты написания, по индексу категории
+        return Condition([index.keyword_listings(VISA_DESTINATION_MATCHER,
+                                                 ('destination', 'title', 'description'), destination)])
+    return Condition(predicate=lambda item: (
+        destination in str(item.get('destination', '')).lower() or
+        destination in str(item.get('title', '')).lower() or
+        destination in str(item.get('description', '')).lower()))
+
+
+def _nationality(index, value, filters):
+    nationality = value.lower()
+    citizenship_values = CITIZENSHIP_VALUES.get(nationality, [])
+    mentioned = index.keyword_listings(NATIONALITY_MATCHER, ('description', 'title'), nationality)
+
+    def citizen_matches(item):
+        citizen = str(item.get('citizenship', '')).lower()
+        return bool(citizen) and citizen in citizenship_values
+
+    return Condition([mentioned], citizen_matches)
+
+
+def _days(index, value, filters):
+    # Срок визарана (45 / 90 дней) - подстрокой в тексте
+    return Condition(predicate=lambda item: value in f"{item.get('description', '')} {item.get('title', '')}")
+
+
+def _medicine_type(index, value, filters):
+    allowed_values = MEDICINE_TYPE_VALUES.get(value, [value])
+    mentioned = index.keyword_listings(MEDICINE_TYPE_MATCHER, ('description', 'title'), value)
+    return Condition([mentioned], lambda item: str(item.get('medicine_type', '')).lower() in allowed_values)
+
+
+def _transport_deal(index, value, filters):
+    deal = value.lower()
+    if deal not in TRANSPORT_DEAL_KEYWORDS:
+        return None
+    return Condition([index.keyword_listings(TRANSPORT_DEAL_MATCHER, ('description',), deal)])
+
+
+def _model(index, value, filters):
+    model = value.lower()
+    return Condition(predicate=lambda item: model in str(item.get('model') or '').lower())
+
+
+def _year(index, value, filters):
+    return Condition(predicate=lambda item: str(item.get('year', '')) == value)
+
+
+def _transport_price(index, value, filters):
+    # Диапазон цены транспорта - только когда заданы обе границы
+    if not filters.get('price_max'):
+        return None
+    try:
+        min_p, max_p = float(value), float(filters['price_max'])
+    except ValueError:
+        return None
+    return Condition(predicate=lambda item: min_p <= item.price_value <= max_p)
+
+
+def _listing_type(index, value, filters):
+    return Condition(predicate=lambda item: value in (item.get('listing_type') or ''))
+
+
+def _source_group(index, value, filters):
+    return Condition(predicate=lambda item: (
+        item.get('source_group') == value or item.get('contact_name') == value or
+        value in ' '.join(item.get('photos', [])) or value in (item.get('photo_url') or '')))
+
+
+def _price_max(index, value, filters):
+    # Цена разобрана при загрузке (Listing.price_value); без цены (0) - не подходит
+    try:
+        max_p = int(value)
+    except ValueError:
+        return None
+    return Condition(predicate=lambda item: 0 < item.price_value <= max_p)
+
+
+def _price_min(index, value, filters):
+    try:
+        min_p = int(value)
+    except ValueError:
+        return None
+    return Condition(predicate=lambda item: item.price_value >= min_p)
+
+
+# Фильтр по городу для категорий с городом в полях или тексте; без города - подходит для всех
+_CITY_OR_ANY = _city(CITY_FILTER_KEYWORDS, ('city', 'location', ('title', 'description')),
+                     include_unspecified=('city', 'location'))
+
+# Параметры всех категорий (категория может переопределить)
+COMMON_FILTERS = {
+    'subcategory': _equals('subcategory'),
+}
+
+# Категория -> {параметр запроса: построитель Condition}
+CATEGORY_FILTERS = {
+    'restaurants': {'city': _CITY_OR_ANY},
+    'tours': {'city': _CITY_OR_ANY},
+    'entertainment': {'city': _CITY_OR_ANY},
+    'marketplace': {
+        'city': _CITY_OR_ANY,
+        # Для marketplace подкатегория - поле marketplace_category
+        'subcategory': _equals('marketplace_category'),
+    },
+    'visas': {
+        'city': _CITY_OR_ANY,
+        'destination': _destination,
+        'nationality': _nationality,
+        'days': _days,
+    },
+    'kids': {
+        'kids_type': _kids_type,
+        'city': _city(KIDS_CITY_KEYWORDS, ('city',), lower_key=True),
+        'max_age': _max_age,
+    },
+    # Фотосессии и медицина - только подстрокой
+    'news': {'city': _city(None, ('city', 'title', 'description'))},
+    'money_exchange': {'city': _city(MONEY_EXCHANGE_CITY_KEYWORDS, (('city', 'title', 'description', 'address'),))},
+    'medicine': {
+        'city': _city(None, ('city', 'title', 'description')),
+        'medicine_type': _medicine_type,
+    },
+    'transport': {
+        'transport_type': _equals('transport_type'),
+        'city': _city(CITY_FILTER_KEYWORDS, ('city', 'location', ('title', 'description'))),
+        'type': _transport_deal,
+        'model': _model,
+        'year': _year,
+        'price_min': _transport_price,
+    },
+    'real_estate': {
+        'realestate_city': _city(REAL_ESTATE_CITY_KEYWORDS, ('city', 'city_ru'), lower_key=True),
+        'listing_type': _listing_type,
+        'source_group': _source_group,
+        'price_max': _price_max,
+        'price_min': _price_min,
+    },
+}
+
+# Сортировки по параметру sort (остальные категории - новые сверху)
+CATEGORY_ORDERS = {
+    'real_estate': ('price_desc', 'price_asc'),
+}
+
+
+def _shows_hidden(category, filters):
+    # Для Нячанга (real_estate) показываем все объявления, включая скрытые
+    return (filters.get('show_hidden', '0') == '1' or
+            (category == 'real_estate' and filters.get('realestate_city', '') == 'nhatrang'))
+
+
+def build_conditions(index, category, filters):
+    """Условия запроса по реестру фильтров категории (пустые параметры пропускаются)"""
+    conditions = []
+    if not _shows_hidden(category, filters):
+        conditions.append(Condition(predicate=_is_visible))
+    for param, build in dict(COMMON_FILTERS, **CATEGORY_FILTERS.get(category, {})).items():
+        value = filters.get(param)
+        if value:
+            condition = build(index, value, filters)
+            if condition is not None:
+                conditions.append(condition)
+    return conditions
+
+
+def plan(index, conditions, order):
+    """
+    Объявления, подходящие под все условия, в порядке order. Если самое
+    маленькое множество из индекса заметно меньше категории, кандидаты
+    берутся из него и упорядочиваются по позициям в отсортированном индексе;
+    иначе отсортированный индекс проходится один раз.
+    """
+    ordered = index.ordered(order)
+    indexed = [c for c in conditions if c.indexed]
+    driver = min(indexed, key=Condition.size) if indexed else None
+    if driver is not None and driver.size() * DRIVER_RATIO < len(ordered):
+        # Дешёвые проверки по множествам - раньше предикатов
+        rest = sorted((c for c in conditions if c is not driver), key=lambda c: not c.indexed)
+        candidates = set().union(*driver.sets) if len(driver.sets) > 1 else driver.sets[0]
+        result = [item for item in candidates if all(c(item) for c in rest)]
+        result.sort(key=index.ordered_rank(order).__getitem__)
+        return tuple(result)
+    if not conditions:
+        return ordered
+    conditions = sorted(conditions, key=lambda c: not c.indexed)
+    return tuple(item for item in ordered if all(c(item) for c in conditions))
+
+
+def filter_listings(index, category, filters):
+    """
+    Отфильтрованные объявления категории в порядке выдачи:
+    (кортеж Listing, порядок из listing_indexes.SORT_ORDERS)
+    """
+    order = filters.get('sort')
+    if order not in CATEGORY_ORDERS.get(category, ()):
+        order = 'date'
+    return plan(index, build_conditions(index, category, filters), order), order
@@ -0,0 +1,199 @@
+"""
+Индексы категории снимка объявлений.
+
+CategoryIndex строится лениво для кортежа объявлений одной категории и
+живёт вместе со снимком (SnapshotCategories), поэтому при правке заменяется
+только индекс изменённой категории. Множества содержат сами объявления
+Listing (хешируются по identity), так что фильтр - это проверка `x in set`.
+Индексы по ключевым словам (keyword_matcher) строятся тем же способом: текст
+каждого объявления просматривается один раз на весь снимок, а не на запрос.
+Отсортированные индексы (ordered) держат категорию в порядке выдачи, так что
+запрос выбирает из них отфильтрованные объявления вместо сортировки.
+"""
+import threading
+
+from listing_facets import FACETS
+from search_index import build_postings
+
+
+def field_text(item, field):
+    """
+    Текст поля объявления для поиска подстрокой; field - имя поля или кортеж
+    полей, склеенных через пробел (как склеивали старые фильтры)
+    """
+    if isinstance(field, tuple):
+        return ' '.join(str(item.get(name, '')) for name in field)
+    return str(item.get(field, ''))
+
+
+def date_order_key(item):
+    """Стабильный порядок (дата, id) для сортировки и курсора"""
+    return (item.sort_date, str(item.get('id') or ''))
+
+
+def price_desc_key(item):
+    return (item.price_value,) + date_order_key(item)
+
+
+def price_asc_key(item):
+    # Объявления с ценой - первыми, без цены (0) - в конце
+    return (item.price_value == 0, item.price_value, str(item.get('id') or ''))
+
+
+# Порядок выдачи -> (ключ сортировки, по убыванию)
+SORT_ORDERS = {
+    'date': (date_order_key, True),
+    'price_desc': (price_desc_key, True),
+    'price_asc': (price_asc_key, False),
+}
+
+
+class CategoryIndex:
+    """Обратные индексы одной категории: ключевые слова, значения полей, фасеты, порядки"""
+
+    def __init__(self, items):
+        self.items = items
+        self._lock = threading.Lock()
+        self._city_sets = {}
+        self._missing = {}
+        self._keyword_sets = {}
+        self._facet_counts = {}
+        self._ordered = {}
+        self._ranks = {}
+        self._value_sets = {}
+        self._postings = None
+        self._visible_count = None
+
+    def keyword_listings(self, matcher, fields, group):
+        """
+        Объявления, в полях fields которых встречается слово группы group
+        таблицы matcher (keyword_matcher.KeywordMatcher); поле - имя или
+        кортеж имён (см. field_text)
+        """
+        key = (matcher, tuple(fields))
+        by_group = self._keyword_sets.get(key)
+        if by_group is None:
+            by_group = {}
+            for item in self.items:
+                text = '\n'.join(field_text(item, field) for field in key[1])
+                for found in matcher.groups(text):
+                    by_group.setdefault(found, set()).add(item)
+            with self._lock:
+                by_group = self._keyword_sets.setdefault(key, by_group)
+        return by_group.get(group, _EMPTY)
+
+    def facet_counts(self, name):
+        """
+        Счётчики фасета name (listing_facets.FACETS) по видимым объявлениям:
+        {значение: количество}. Считаются один раз на снимок категории.
+        """
+        counts = self._facet_counts.get(name)
+        if counts is None:
+            facet = FACETS[name]
+            values = facet['values']
+            counts = dict.fromkeys(facet['defaults'], 0)
+            for item in self.items:
+                if item.is_hidden:
+                    continue
+                for value in values(item):
+                    counts[value] = counts.get(value, 0) + 1
+            with self._lock:
+                counts = self._facet_counts.setdefault(name, counts)
+        return counts
+
+    def updated(self, items, removed=(), added=()):
+        """
+        Индекс новой версии категории (items) после правки: removed и added -
+        снятые и добавленные объявления. Уже посчитанные счётчики фасетов и
+        число видимых переносятся с поправкой только на эти объявления, без
+        пересчёта категории; остальные индексы строятся лениво заново.
+        """
+        index = CategoryIndex(items)
+        removed = [item for item in removed if not item.is_hidden]
+        added = [item for item in added if not item.is_hidden]
+        for name, counts in list(self._facet_counts.items()):
+            facet = FACETS[name]
+            values, defaults = facet['values'], facet['defaults']
+            counts = dict(counts)
+            for item in removed:
+                for value in values(item):
+                    left = counts.get(value, 0) - 1
+                    if left > 0 or value in defaults:
+                        counts[value] = left
+                    else:
+                        counts.pop(value, None)
+            for item in added:
+                for value in values(item):
+                    counts[value] = counts.get(value, 0) + 1
+            index._facet_counts[name] = counts
+        if self._visible_count is not None:
+            index._visible_count = self._visible_count - len(removed) + len(added)
+        return index
+
+    def ordered(self, order):
+        """Все объявления категории в порядке order (SORT_ORDERS), сортируются один раз на снимок"""
+        result = self._ordered.get(order)
+        if result is None:
+            key, reverse = SORT_ORDERS[order]
+            result = tuple(sorted(self.items, key=key, reverse=reverse))
+            with self._lock:
+                result = self._ordered.setdefault(order, result)
+        return result
+
+    def ordered_rank(self, order):
+        """{объявление: позиция в ordered(order)} - для упорядочивания подмножества без сортировки по ключу"""
+        ranks = self._ranks.get(order)
+        if ranks is None:
+            ranks = {item: i for i, item in enumerate(self.ordered(order))}
+            with self._lock:
+                ranks = self._ranks.setdefault(order, ranks)
+        return ranks
+
+    def value_listings(self, field, value):
+        """Объявления, у которых поле field равно value"""
+        by_value = self._value_sets.get(field)
+        if by_value is None:
+            by_value = {}
+            for item in self.items:
+                try:
+                    by_value.setdefault(item.get(field), set()).add(item)
+                except TypeError:
+                    # Списки и словари не бывают равны параметру запроса
+                    continue
+            with self._lock:
+                by_value = self._value_sets.setdefault(field, by_value)
+        try:
+            return by_value.get(value, _EMPTY)
+        except TypeError:
+            return _EMPTY
+
+    def visible_count(self):
+        count = self._visible_count
+        if count is None:
+            count = self._visible_count = sum(1 for item in self.items if not item.is_hidden)
+        return count
+
+    def search_postings(self):
+        """Обратный индекс полнотекстового поиска {терм: {объявление: вес}} (search_index)"""
+        postings = self._postings
+        if postings is None:
+            postings = build_postings(self.items)
+            with self._lock:
+                if self._postings is None:
+                    self._postings = postings
+                postings = self._postings
+        return postings
+
+    def without_fields(self, fields):
+        """Объявления, у которых все поля fields пустые (город не указан)"""
+        fields = tuple(fields)
+        result = self._missing.get(fields)
+        if result is None:
+            result = {item for item in self.items
+                      if all(str(item.get(field, '')) == '' for field in fields)}
+            with self._lock:
+                result = self._missing.setdefault(fields, result)
+        return result
+
+
+_EMPTY = frozenset()
@@ -0,0 +1,190 @@
+"""
+Компактная модель объявления для кэша.
+
+Объявление в базе - свободный JSON объект с 10-40 ключами. В памяти воркера
+оно хранится как Listing: частые поля лежат в __slots__ (без словаря на
+каждый объект и без копии ключей), редкие поля категорий - в общем словаре
+_extra. Снаружи Listing ведёт себя как словарь только для чтения
+(get, [], in, keys, items), поэтому фильтры работают с ним как с dict.
+
+Каждый Listing хранит свой JSON (фрагмент из mmap снимка или закодированный
+при первом ответе), поэтому ответ со списком собирается склейкой байтов.
+Объявление не меняется, новая версия - новый Listing без кэша JSON.
+"""
+import json
+import sys
+from collections.abc import Mapping
+
+from listing_cities import extract_city_ids
+from listing_prices import parse_price
+from search_index import listing_terms
+
+# Поля, которые есть у большинства объявлений (парсеры, формы подачи)
+LISTING_FIELDS = (
+    'id', 'category', 'title', 'description', 'date', 'added_at',
+    'city', 'city_ru', 'location', 'price', 'contact_name', 'whatsapp', 'telegram',
+    'image_url', 'image_url_2', 'image_url_3', 'image_url_4', 'all_images', 'photos',
+    'telegram_file_id', 'telegram_photo', 'telegram_link',
+    'source_channel', 'message_id', 'image_hash', 'has_media', 'hidden',
+    'listing_type', 'marketplace_category', 'medicine_type', 'kids_type', 'transport_type',
+)
+
+_FIELD_SET = frozenset(LISTING_FIELDS)
+
+
+class _Missing:
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<missing>'
+
+
+_MISSING = _Missing()
+
+
+class FrozenDict(dict):
+    """Вложенный словарь объявления: только для чтения"""
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('объявление из кэша только для чтения, используйте listings_store.update_listing')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+def freeze(value):
+    """Неизменяемая копия вложенного значения: dict -> FrozenDict, list -> tuple"""
+    if isinstance(value, (FrozenDict, Listing)):
+        return value
+    if isinstance(value, Mapping):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Обычная изменяемая копия (dict/list) замороженного значения"""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+class Listing(Mapping):
+    """
+    Объявление только для чтения. Изменённая версия создаётся через
+    replace() и публикуется через listings_store.
+    """
+    __slots__ = LISTING_FIELDS + ('_extra', '_json', '_terms', 'sort_date', 'is_hidden', 'city_ids',
+                                  'price_value', 'price_currency')
+
+    def __init__(self, data, encoded=None):
+        setter = object.__setattr__
+        setter(self, '_json', encoded)
+        setter(self, '_terms', None)
+        for field in LISTING_FIELDS:
+            setter(self, field, freeze(data.get(field, _MISSING)))
+        extra = {sys.intern(key): freeze(value) for key, value in data.items() if key not in _FIELD_SET}
+        setter(self, '_extra', extra or None)
+        # Ключ сортировки "новые сверху" и признак скрытия считаются один раз при загрузке
+        date = data.get('date', data.get('added_at', '1970-01-01'))
+        setter(self, 'sort_date', date or '1970-01-01')
+        setter(self, 'is_hidden', bool(data.get('hidden', False)))
+        # Канонические города для счётчиков /api/city-counts (listing_cities.extract_city_ids)
+        setter(self, 'city_ids', extract_city_ids(data))
+        # Цена числом (0 - не указана) и валюта для фильтров и сортировки по цене
+        price_value, price_currency = parse_price(data)
+        setter(self, 'price_value', price_value)
+        setter(self, 'price_currency', price_currency)
+
+    def __setattr__(self, name, value):
+        raise TypeError('объявление из кэша только для чтения, используйте listings_store.update_listing')
+
+    __delattr__ = __setattr__
+
+    # Объявления кладутся в множества индексов: хеш по identity, как у object
+    __hash__ = object.__hash__
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        extra = self._extra
+        return extra.get(key, default) if extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        for field in LISTING_FIELDS:
+            if getattr(self, field) is not _MISSING:
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Listing({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return (Listing, (self.to_dict(),))
+
+    def to_dict(self):
+        """Обычный dict (вложенные значения остаются замороженными)"""
+        return {key: self.get(key) for key in self}
+
+    def copy(self):
+        return self.to_dict()
+
+    def encoded(self):
+        """JSON объявления (bytes или memoryview на mmap снимка), кодируется один раз"""
+        value = self._json
+        if value is None:
+            value = json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'),
+                               sort_keys=True).encode('utf-8')
+            object.__setattr__(self, '_json', value)
+        return value
+
+    def search_terms(self):
+        """Термы полнотекстового поиска {терм: вес} (search_index), считаются один раз"""
+        value = self._terms
+        if value is None:
+            value = listing_terms(self)
+            object.__setattr__(self, '_terms', value)
+        return value
+
+    def replace(self, fields=None, **kwargs):
+        """Новое объявление с изменёнными полями"""
+        data = self.to_dict()
+        if fields:
+            data.update(fields)
+        data.update(kwargs)
+        return Listing(data)
+
+
+def json_default(obj):
+    """default= для json.dumps: Listing сериализуется как обычный объект"""
+    if isinstance(obj, Listing):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
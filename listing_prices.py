@@ -0,0 +1,89 @@
+"""
+Цена объявления как число.
+
+Раньше get_listings разбирал цену (поле price или описание) регулярками
+на каждом сравнении сортировки. Теперь parse_price вызывается один раз при
+создании Listing (загрузка, парсер, правка) и результат лежит в
+Listing.price_value / Listing.price_currency.
+"""
+import re
+
+# Паттерны цены в описании: "7,5 миллион", "Цена: 7 500 000", "7 500 000 VND"
+_MILLIONS_PATTERN = re.compile(r'(\d+[,.]?\d*)\s*(?:миллион|млн|mln)')
+_DESCRIPTION_PATTERNS = (
+    _MILLIONS_PATTERN,
+    re.compile(r'цена[:\s]*(\d[\d\s]*)\s*(?:vnd|донг|₫)?'),
+    re.compile(r'(\d[\d\s]{2,})\s*(?:vnd|донг|₫)'),
+)
+_MILLIONS_WORDS = ('млн', 'mln', 'миллион')
+
+# Признаки валюты в тексте цены (проверяются по порядку)
+_CURRENCIES = (
+    ('VND', ('vnd', 'донг', '₫', 'млн', 'mln', 'миллион')),
+    ('USD', ('$', 'usd', 'долл')),
+    ('THB', ('฿', 'thb', 'бат')),
+    ('IDR', ('idr', 'рупи')),
+    ('RUB', ('₽', 'rub', 'руб')),
+)
+
+
+def _currency(text):
+    for currency, marks in _CURRENCIES:
+        if any(mark in text for mark in marks):
+            return currency
+    return None
+
+
+def _parse_price_field(price):
+    """Число из поля price (число или строка вида "7,5 млн") или 0"""
+    if isinstance(price, (int, float)) and price > 0:
+        return int(price)
+    try:
+        price_str = str(price).lower()
+        multiplier = 1
+        if any(word in price_str for word in _MILLIONS_WORDS):
+            multiplier = 1000000
+        price_str = price_str.replace(',', '.')
+        cleaned = re.sub(r'[^\d.]', '', price_str)
+        parts = cleaned.split('.')
+        if len(parts) > 2:
+            cleaned = parts[0] + '.' + ''.join(parts[1:])
+        if cleaned:
+            return max(int(float(cleaned) * multiplier), 0)
+    except (ValueError, OverflowError):
+        pass
+    return 0
+
+
+def _parse_price_description(desc):
+    """Число из описания (первый подошедший паттерн) или 0"""
+    for pattern in _DESCRIPTION_PATTERNS:
+        match = pattern.search(desc)
+        if match:
+            price_str = match.group(1).replace(' ', '').replace(',', '.')
+            try:
+                val = float(price_str)
+            except ValueError:
+                continue
+            # "7,5 млн" - всегда миллионы; маленькое число без единиц - тоже миллионы донгов
+            if pattern is _MILLIONS_PATTERN or val < 100:
+                val = val * 1000000
+            return int(val)
+    return 0
+
+
+def parse_price(data):
+    """
+    (цена, валюта) объявления: сначала поле price, если там нет положительного
+    числа - описание. Цена 0 - не указана; валюта None - не определена.
+    """
+    price = data.get('price')
+    if price is not None:
+        value = _parse_price_field(price)
+        if value > 0:
+            # Число без единиц - валюта неизвестна (формы подачи пишут в разных валютах)
+            currency = None if isinstance(price, (int, float)) else _currency(str(price).lower())
+            return value, currency
+    desc = str(data.get('description') or '').lower()
+    value = _parse_price_description(desc)
+    return value, (_currency(desc) if value else None)
@@ -0,0 +1,921 @@
+"""
+Хранилище объявлений на встроенной SQLite.
+
+Одна строка на объявление, индексы по (country, category, position) и
+(country, listing_id), журнал в режиме WAL. При первом обращении к стране
+существующие listings_{country}.json / listings_data.json импортируются
+в базу (однократная миграция, отметка в таблице meta).
+
+У каждой страны есть версия (meta version:{country}), которая увеличивается
+в той же транзакции, что и запись. Загруженные страны держатся в памяти и
+перечитываются, только если версия в базе изменилась (её сверяют не чаще
+раза в секунду), поэтому записи парсеров видны почти сразу, а обычный
+запрос не читает базу и не разбирает JSON.
+
+Кэш отдаёт неизменяемые снимки: категории - кортежи Listing (компактная
+запись только для чтения, listing_model.py). Правка одного объявления (update_listing, move_listing,
+delete_listing) - это поиск по карте id -> позиция, одна строка в WAL журнале
+и публикация нового снимка (copy-on-write: меняются только затронутые
+категории). Читатели всегда видят снимок целиком - старый или новый.
+WAL журнал сжимается (checkpoint) фоновым потоком, а не во время запроса.
+
+Общий listings_data.json больше не пишется при каждой правке: это снимок
+всех стран, который собирается из базы фоновым потоком через EXPORT_DELAY
+секунд после последней записи (несколько правок подряд дают одну выгрузку).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from collections.abc import Mapping
+
+import snapshot_blobs
+from listing_indexes import CategoryIndex
+from listing_model import Listing, json_default, thaw
+
+DB_FILE = os.environ.get('LISTINGS_DB', 'listings.db')
+# mmap снимки стран, общие для воркеров gunicorn (snapshot_blobs.py)
+SNAPSHOT_DIR = os.environ.get('LISTINGS_SNAPSHOT_DIR', 'listings_snapshots')
+LEGACY_DATA_FILE = 'listings_data.json'
+
+COUNTRIES = ['vietnam', 'thailand', 'india', 'indonesia']
+
+CATEGORIES = [
+    'restaurants', 'tours', 'transport', 'real_estate', 'money_exchange',
+    'entertainment', 'marketplace', 'visas', 'news', 'medicine', 'kids', 'chat'
+]
+
+# Старые файлы-списки хранят категорию внутри объявления
+LEGACY_CATEGORY_MAP = {
+    'bikes': 'transport',
+    'real_estate': 'real_estate',
+    'exchange': 'money_exchange',
+    'money_exchange': 'money_exchange',
+    'food': 'restaurants',
+    'restaurants': 'restaurants'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    country TEXT NOT NULL,
+    category TEXT NOT NULL,
+    listing_id TEXT,
+    position REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_listings_category ON listings(country, category, position);
+CREATE INDEX IF NOT EXISTS idx_listings_id ON listings(country, listing_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('instance', lower(hex(randomblob(8))));
+"""
+
+CHANGE_CHECK_INTERVAL = 1  # Как часто сверять версию страны с базой (записи парсеров)
+CHECKPOINT_INTERVAL = 60  # Сжатие WAL журнала в фоне
+EXPORT_DELAY = 10  # Выгрузка listings_data.json после серии правок
+
+_local = threading.local()
+_write_lock = threading.RLock()
+_migrate_lock = threading.Lock()
+_migrated = set()
+
+# country -> снимок {'data': только чтение {категория: (Listing, ...)},
+#                    'categories': тот же dict, 'index': {категория: {id: позиция}},
+#                    'version': версия из meta, 'checked': время последней сверки}
+_cache = {}
+
+# Перечитывает страну один поток, остальные пока отдают старые данные
+_load_locks = {country: threading.Lock() for country in COUNTRIES}
+_load_locks_guard = threading.Lock()
+
+# country -> {'rebuilds': перечитываний из базы, 'stale_served': ответов старыми данными,
+#             'categories_reused': категорий, взятых из прошлого снимка без разбора}
+_stats = {}
+
+_checkpoint_thread = None
+_checkpoint_lock = threading.Lock()
+
+_export_thread = None
+_export_pending = threading.Event()
+
+
+def create_empty_data():
+    return {category: [] for category in CATEGORIES}
+
+
+def get_connection():
+    """Соединение с базой для текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # Checkpoint делает фоновый поток, а не запись в обработчике запроса
+        conn.execute('PRAGMA wal_autocheckpoint=0')
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+        _start_checkpointer()
+    return conn
+
+
+@contextmanager
+def _transaction(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _checkpoint_loop():
+    while True:
+        time.sleep(CHECKPOINT_INTERVAL)
+        try:
+            checkpoint()
+        except Exception as e:
+            print(f"STORE: ошибка checkpoint: {e}")
+
+
+def _start_checkpointer():
+    global _checkpoint_thread
+    if _checkpoint_thread is None:
+        with _checkpoint_lock:
+            if _checkpoint_thread is None:
+                _checkpoint_thread = threading.Thread(target=_checkpoint_loop, daemon=True)
+                _checkpoint_thread.start()
+
+
+def checkpoint():
+    """Перенести WAL журнал в базу и обрезать его"""
+    get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def _export_loop():
+    while True:
+        _export_pending.wait()
+        # Ждём, пока серия правок закончится
+        time.sleep(EXPORT_DELAY)
+        _export_pending.clear()
+        try:
+            export_snapshot()
+        except Exception as e:
+            print(f"STORE: ошибка выгрузки {LEGACY_DATA_FILE}: {e}")
+
+
+def _changed():
+    """Отметить запись: запланировать выгрузку общего снимка"""
+    global _export_thread
+    if _export_thread is None:
+        with _checkpoint_lock:
+            if _export_thread is None:
+                _export_thread = threading.Thread(target=_export_loop, daemon=True)
+                _export_thread.start()
+    _export_pending.set()
+
+
+def export_snapshot(path=LEGACY_DATA_FILE):
+    """
+    Записать снимок всех стран в один JSON (через временный файл). Имя
+    временного файла своё у каждого процесса и потока: воркеры gunicorn
+    выгружают снимок независимо.
+    """
+    snapshot = {country: load_country(country) for country in COUNTRIES}
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _dumps(item):
+    # sort_keys: текст строки не зависит от порядка полей (Listing хранит их в своём порядке),
+    # поэтому save_country видит неизменённые объявления как совпадающие
+    return json.dumps(item, ensure_ascii=False, separators=(',', ':'), sort_keys=True, default=json_default)
+
+
+def _listing_id(item):
+    listing_id = item.get('id')
+    return listing_id if isinstance(listing_id, (str, int)) else None
+
+
+def _read_legacy_country(country):
+    """Прочитать объявления страны из старых JSON файлов"""
+    result = create_empty_data()
+    country_file = f"listings_{country}.json"
+
+    if os.path.exists(country_file):
+        with open(country_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            for category, items in data.items():
+                if isinstance(items, list):
+                    result[category] = items
+        else:
+            # Если данные в файле - список, распределяем по категориям
+            for item in data:
+                if not isinstance(item, dict):
+                    continue
+                category = item.get('category', 'chat')
+                mapped = LEGACY_CATEGORY_MAP.get(category, category)
+                if mapped in result:
+                    result[mapped].append(item)
+
+    elif os.path.exists(LEGACY_DATA_FILE):
+        with open(LEGACY_DATA_FILE, 'r', encoding='utf-8') as f:
+            all_data = json.load(f)
+        country_data = all_data.get(country)
+        if isinstance(country_data, dict):
+            for category, items in country_data.items():
+                if isinstance(items, list):
+                    result[category] = items
+
+    return result
+
+
+def _insert_category(conn, country, category, items, start=0.0):
+    conn.executemany(
+        "INSERT INTO listings (country, category, listing_id, position, data) VALUES (?, ?, ?, ?, ?)",
+        [(country, category, _listing_id(item), start + i, _dumps(item))
+         for i, item in enumerate(items) if isinstance(item, Mapping)]
+    )
+
+
+def ensure_migrated(country):
+    """Однократный импорт JSON файлов страны в базу"""
+    if country in _migrated:
+        return
+    with _migrate_lock:
+        if country in _migrated:
+            return
+        conn = get_connection()
+        key = f"migrated:{country}"
+        try:
+            with _transaction(conn):
+                if conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone() is None:
+                    data = _read_legacy_country(country)
+                    for category, items in data.items():
+                        _insert_category(conn, country, category, items)
+                    conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                 (key, datetime.now().isoformat()))
+                    total = sum(len(items) for items in data.values())
+                    print(f"STORE: {country}: импортировано {total} объявлений из JSON")
+        except Exception as e:
+            print(f"STORE: ошибка миграции {country}: {e}")
+            return
+        _migrated.add(country)
+
+
+def load_country(country):
+    """Все объявления страны в виде {категория: [объявления]}"""
+    ensure_migrated(country)
+    result = create_empty_data()
+    rows = get_connection().execute(
+        "SELECT category, data FROM listings WHERE country = ? ORDER BY category, position, rowid",
+        (country,)
+    )
+    for category, text in rows:
+        result.setdefault(category, []).append(json.loads(text))
+    return result
+
+
+def get_listing_ids(country):
+    """Множество id объявлений страны (для дедупликации в парсерах)"""
+    ensure_migrated(country)
+    rows = get_connection().execute(
+        "SELECT listing_id FROM listings WHERE country = ? AND listing_id IS NOT NULL",
+        (country,)
+    )
+    return {row[0] for row in rows}
+
+
+def _read_version(conn, country):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (f"version:{country}",)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def _bump_version(conn, country):
+    """Увеличить версию страны (внутри транзакции записи). Возвращает (старая, новая)"""
+    before = _read_version(conn, country)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                 (f"version:{country}", str(before + 1)))
+    return before, before + 1
+
+
+def _category_index(items):
+    """id -> индекс в категории; при дублях берётся первое вхождение"""
+    index = {}
+    for i, item in enumerate(items):
+        listing_id = _listing_id(item)
+        if listing_id is not None and listing_id not in index:
+            index[listing_id] = i
+    return index
+
+
+def _to_listing(item):
+    return item if isinstance(item, Listing) else Listing(item)
+
+
+class SnapshotCategories(Mapping):
+    """
+    Категории снимка страны (только чтение). Категории из mmap файла
+    разбираются в кортежи Listing при первом обращении, поэтому новый
+    воркер готов сразу, а не после разбора всей страны. Разобранные
+    Listing - в памяти этого воркера (общий у воркеров только mmap файл);
+    после чужой записи неизменённые категории берутся из прошлого снимка
+    (reuse).
+    """
+
+    def __init__(self, names, loaded, blob=None, indexes=None, digests=None):
+        self._names = list(names)
+        self._loaded = loaded
+        self._blob = blob
+        self._indexes = indexes if indexes is not None else {}
+        # Категории, совпадающие с blob: {категория: хеш из заголовка снимка}
+        self._digests = digests if digests is not None else {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, category):
+        items = self._loaded.get(category)
+        if items is not None:
+            return items
+        if category not in self._names:
+            raise KeyError(category)
+        with self._lock:
+            items = self._loaded.get(category)
+            if items is None:
+                blob = self._blob
+                # Фрагмент из mmap - готовый JSON объявления для ответов (см. Listing.encoded)
+                items = tuple(
+                    Listing(json.loads(bytes(view)), encoded=view)
+                    for view in (blob.fragment_view(category, i) for i in range(blob.count(category)))
+                )
+                self._loaded[category] = items
+        return items
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, category):
+        return category in self._loaded or category in self._names
+
+    def index(self, category):
+        """Индексы категории (listing_indexes.CategoryIndex), строятся при первом обращении"""
+        index = self._indexes.get(category)
+        if index is None:
+            index = CategoryIndex(self[category] if category in self else ())
+            with self._lock:
+                index = self._indexes.setdefault(category, index)
+        return index
+
+    def with_changes(self, changes, deltas=None):
+        """
+        Новый набор категорий: изменённые заменены, остальные (и их индексы)
+        общие с этим. deltas - {категория: (снятые, добавленные объявления)}:
+        счётчики фасетов изменённой категории обновляются на них, а не
+        пересчитываются (CategoryIndex.updated)
+        """
+        names = self._names + [category for category in changes if category not in self._names]
+        indexes = {category: index for category, index in self._indexes.items() if category not in changes}
+        for category, (removed, added) in (deltas or {}).items():
+            index = self._indexes.get(category)
+            if index is not None and category in changes:
+                indexes[category] = index.updated(changes[category], removed, added)
+        digests = {category: digest for category, digest in self._digests.items() if category not in changes}
+        return SnapshotCategories(names, dict(self._loaded, **changes), self._blob, indexes, digests)
+
+    def reuse(self, previous):
+        """
+        Взять из предыдущего снимка уже разобранные категории (и их индексы),
+        содержимое которых не изменилось (тот же хеш в снимке); возвращает их число
+        """
+        reused = 0
+        for category, digest in self._digests.items():
+            if category in self._loaded or previous._digests.get(category) != digest:
+                continue
+            items = previous._loaded.get(category)
+            if items is None:
+                continue
+            self._loaded[category] = items
+            index = previous._indexes.get(category)
+            if index is not None:
+                self._indexes[category] = index
+            reused += 1
+        return reused
+
+
+def category_index(data, category):
+    """Индексы категории для data из get_country (или обычного dict)"""
+    if isinstance(data, SnapshotCategories):
+        return data.index(category)
+    return CategoryIndex(data.get(category, ()))
+
+
+def _snapshot(data, version):
+    """
+    Неизменяемый снимок страны: категории - кортежи Listing (data - dict
+    списков или открытый snapshot_blobs.Snapshot), индекс - {категория: {id: позиция}},
+    строится лениво.
+    """
+    if isinstance(data, snapshot_blobs.Snapshot):
+        names = list(create_empty_data())
+        names += [category for category in data.categories if category not in names]
+        digests = {category: data.digest(category) for category in data.categories}
+        categories = SnapshotCategories(names, {}, data, digests=digests)
+    else:
+        loaded = {category: tuple(_to_listing(item) for item in items if isinstance(item, Mapping))
+                  for category, items in data.items() if isinstance(items, (list, tuple))}
+        categories = SnapshotCategories(loaded, loaded)
+    return {
+        'data': categories,
+        'categories': categories,
+        'index': {},
+        'version': version,
+        'checked': time.time(),
+    }
+
+
+def _publish(country, entry, changes, versions, deltas=None):
+    """
+    Опубликовать новый снимок, заменив изменённые категории (copy-on-write:
+    неизменённые кортежи и их индексы переходят в новый снимок как есть).
+
+    Если до записи снимок был устаревшим (страну менял другой процесс),
+    новый снимок помечается неактуальным и перечитывается при следующем
+    обращении.
+    """
+    before, after = versions
+    categories = entry['categories'].with_changes(changes, deltas)
+    index = {category: ids for category, ids in entry['index'].items() if category not in changes}
+    _cache[country] = {
+        'data': categories,
+        'categories': categories,
+        'index': index,
+        'version': after if entry['version'] == before else None,
+        'checked': time.time() if entry['version'] == before else 0,
+    }
+    _changed()
+
+
+def _snapshot_path(country):
+    return os.path.join(SNAPSHOT_DIR, f"{country}.bin")
+
+
+def _snapshot_tag(conn, country):
+    """
+    Метка данных для файла снимка: id базы + версия страны
+    (после пересоздания базы версии начинаются заново)
+    """
+    row = conn.execute("SELECT value FROM meta WHERE key = 'instance'").fetchone()
+    return f"{row[0] if row else ''}:{_read_version(conn, country)}"
+
+
+def _load_versioned(country):
+    """
+    Данные страны и их версия из одного снимка базы.
+
+    Если файл снимка этой версии уже собран (другим воркером) - он
+    открывается через mmap без чтения базы; иначе файл собирается из строк
+    базы (JSON объявлений не разбирается и не кодируется заново).
+    """
+    ensure_migrated(country)
+    conn = get_connection()
+    conn.execute('BEGIN')
+    try:
+        version = _read_version(conn, country)
+        tag = _snapshot_tag(conn, country)
+        path = _snapshot_path(country)
+        blob = snapshot_blobs.open_snapshot(path)
+        if blob is not None and blob.version == tag:
+            return blob, version
+        texts = {category: [] for category in CATEGORIES}
+        for category, text in conn.execute(
+            "SELECT category, data FROM listings WHERE country = ? ORDER BY category, position, rowid",
+            (country,)
+        ):
+            texts.setdefault(category, []).append(text)
+        try:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            snapshot_blobs.write_snapshot(path, tag, texts)
+            blob = snapshot_blobs.open_snapshot(path)
+        except OSError as e:
+            print(f"STORE: не удалось записать снимок {path}: {e}")
+            blob = None
+        if blob is not None and blob.version == tag:
+            return blob, version
+        # Без файла снимка - разбираем строки в памяти
+        return {category: [json.loads(text) for text in items] for category, items in texts.items()}, version
+    finally:
+        conn.execute('COMMIT')
+
+
+def _is_current(entry, country):
+    """Сверить версию кэша с базой (не чаще CHANGE_CHECK_INTERVAL)"""
+    now = time.time()
+    if now - entry['checked'] < CHANGE_CHECK_INTERVAL:
+        return True
+    if entry['version'] is not None and _read_version(get_connection(), country) == entry['version']:
+        entry['checked'] = now
+        return True
+    return False
+
+
+def _load_lock(country):
+    lock = _load_locks.get(country)
+    if lock is None:
+        with _load_locks_guard:
+            lock = _load_locks.setdefault(country, threading.Lock())
+    return lock
+
+
+def _count(country, key, n=1):
+    counters = _stats.setdefault(country, {'rebuilds': 0, 'stale_served': 0, 'categories_reused': 0})
+    counters[key] += n
+
+
+def _get_entry(country):
+    """
+    Актуальный снимок страны. Перечитывается из базы только когда
+    изменилась версия страны (например, парсер добавил объявления).
+
+    Перечитывает один поток; остальные в это время получают предыдущий
+    снимок и ждут только при самой первой загрузке страны.
+    """
+    entry = _cache.get(country)
+    if entry is not None and _is_current(entry, country):
+        return entry
+
+    lock = _load_lock(country)
+    if entry is not None and not lock.acquire(blocking=False):
+        _count(country, 'stale_served')
+        return entry
+    if entry is None:
+        lock.acquire()
+    try:
+        current = _cache.get(country)
+        if current is not None and (current is not entry or _is_current(current, country)):
+            return current
+        data, version = _load_versioned(country)
+        current = _snapshot(data, version)
+        if entry is not None:
+            # После чужой записи разбираются заново только изменённые категории
+            _count(country, 'categories_reused', current['categories'].reuse(entry['categories']))
+        _cache[country] = current
+        _count(country, 'rebuilds')
+        # Изменение из другого процесса выгрузит тот процесс, который его записал
+        return current
+    finally:
+        lock.release()
+
+
+def get_country(country):
+    """
+    Снимок объявлений страны: {категория: (Listing, ...)} только для
+    чтения. Снимок не меняется - правки публикуют новый.
+    """
+    return _get_entry(country)['data']
+
+
+def get_version_tag(country):
+    """
+    Метка версии отдаваемого снимка страны "id базы:версия" (для ETag):
+    одинакова во всех воркерах и меняется при каждой записи в страну
+    """
+    entry = _get_entry(country)
+    conn = get_connection()
+    row = conn.execute("SELECT value FROM meta WHERE key = 'instance'").fetchone()
+    # version None - снимок записан поверх чужих изменений и будет перечитан
+    version = entry['version'] if entry['version'] is not None else _read_version(conn, country)
+    return f"{row[0] if row else ''}:{version}"
+
+
+def get_country_copy(country):
+    """Изменяемая копия страны для массовых правок с последующим save_country"""
+    return {category: [thaw(item) for item in items]
+            for category, items in get_country(country).items()}
+
+
+def get_stats():
+    """Счётчики кэша по странам (для /api/cache-stats)"""
+    return {
+        country: dict(counters, version=_cache[country]['version'] if country in _cache else None)
+        for country, counters in _stats.items()
+    }
+
+
+def _category_start(conn, country, category, count, front):
+    """Позиция первой из count новых строк в начале или конце категории"""
+    low, high = conn.execute(
+        "SELECT MIN(position), MAX(position) FROM listings WHERE country = ? AND category = ?",
+        (country, category)
+    ).fetchone()
+    if low is None:
+        return 0.0
+    if front:
+        return low - count
+    return high + 1
+
+
+def insert_listings(country, items, front=True):
+    """Добавить объявления в начало (или конец) своих категорий"""
+    ensure_migrated(country)
+    by_category = {}
+    for item in items:
+        by_category.setdefault(item.get('category') or 'chat', []).append(item)
+
+    with _write_lock:
+        conn = get_connection()
+        with _transaction(conn):
+            for category, category_items in by_category.items():
+                start = _category_start(conn, country, category, len(category_items), front)
+                _insert_category(conn, country, category, category_items, start)
+            versions = _bump_version(conn, country)
+
+        entry = _cache.get(country)
+        if entry is None:
+            _changed()
+            return
+        changes = {}
+        deltas = {}
+        for category, category_items in by_category.items():
+            added = tuple(_to_listing(item) for item in category_items)
+            current = entry['categories'].get(category, ())
+            changes[category] = added + current if front else current + added
+            deltas[category] = ((), added)
+        _publish(country, entry, changes, versions, deltas)
+
+
+def _find(entry, category, listing_id):
+    """Позиция объявления в категории или None (индекс категории строится при первом поиске)"""
+    ids = entry['index'].get(category)
+    if ids is None:
+        if category not in entry['categories']:
+            return None
+        ids = _category_index(entry['categories'][category])
+        entry['index'][category] = ids
+    return ids.get(listing_id)
+
+
+def _row_for(conn, country, category, listing_id):
+    """
+    rowid строки объявления из карты id (первое вхождение id в категории,
+    как в _category_index): в категории бывают объявления с одинаковым id,
+    и правка по listing_id задела бы их все
+    """
+    row = conn.execute(
+        "SELECT rowid FROM listings WHERE country = ? AND category = ? AND listing_id = ?"
+        " ORDER BY position, rowid LIMIT 1",
+        (country, category, listing_id)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def get_listing(country, category, listing_id):
+    """Одно объявление по id (без перебора категории)"""
+    entry = _get_entry(country)
+    i = _find(entry, category, listing_id)
+    return entry['categories'][category][i] if i is not None else None
+
+
+def update_listing(country, category, listing_id, fields):
+    """
+    Изменить поля одного объявления: одна строка UPDATE вместо
+    перезаписи страны. Возвращает новое объявление или None.
+    """
+    _get_entry(country)
+    with _write_lock:
+        entry = _cache[country]
+        i = _find(entry, category, listing_id)
+        if i is None:
+            return None
+        items = entry['categories'][category]
+        item = items[i].replace(fields)
+        conn = get_connection()
+        with _transaction(conn):
+            rowid = _row_for(conn, country, category, _listing_id(items[i]))
+            conn.execute("UPDATE listings SET data = ? WHERE rowid = ?", (_dumps(item), rowid))
+            versions = _bump_version(conn, country)
+        _publish(country, entry, {category: items[:i] + (item,) + items[i + 1:]}, versions,
+                 {category: ((items[i],), (item,))})
+        return item
+
+
+def add_listing(country, category, listing, front=True):
+    """Добавить одно объявление в начало (или конец) категории"""
+    _get_entry(country)
+    with _write_lock:
+        item = _to_listing(listing)
+        conn = get_connection()
+        with _transaction(conn):
+            start = _category_start(conn, country, category, 1, front)
+            _insert_category(conn, country, category, [item], start)
+            versions = _bump_version(conn, country)
+        entry = _cache[country]
+        items = entry['categories'].get(category, ())
+        _publish(country, entry, {category: (item,) + items if front else items + (item,)}, versions,
+                 {category: ((), (item,))})
+        return item
+
+
+def delete_listing(country, category, listing_id):
+    """
+    Удалить объявление (первое с этим id в категории, как в карте id - другие
+    объявления с тем же id остаются). Возвращает удалённое или None
+    """
+    _get_entry(country)
+    with _write_lock:
+        entry = _cache[country]
+        i = _find(entry, category, listing_id)
+        if i is None:
+            return None
+        items = entry['categories'][category]
+        removed = items[i]
+        conn = get_connection()
+        with _transaction(conn):
+            rowid = _row_for(conn, country, category, _listing_id(removed))
+            conn.execute("DELETE FROM listings WHERE rowid = ?", (rowid,))
+            versions = _bump_version(conn, country)
+        _publish(country, entry, {category: items[:i] + items[i + 1:]}, versions,
+                 {category: ((removed,), ())})
+        return removed
+
+
+def move_listing(country, listing_id, from_category, to_category):
+    """Перенести объявление в начало другой категории. Возвращает его или None"""
+    _get_entry(country)
+    with _write_lock:
+        entry = _cache[country]
+        i = _find(entry, from_category, listing_id)
+        if i is None:
+            return None
+        source = entry['categories'][from_category]
+        item = source[i].replace(category=to_category)
+        conn = get_connection()
+        with _transaction(conn):
+            start = _category_start(conn, country, to_category, 1, True)
+            rowid = _row_for(conn, country, from_category, _listing_id(item))
+            conn.execute("DELETE FROM listings WHERE rowid = ?", (rowid,))
+            _insert_category(conn, country, to_category, [item], start)
+            versions = _bump_version(conn, country)
+        _publish(country, entry, {
+            from_category: source[:i] + source[i + 1:],
+            to_category: (item,) + entry['categories'].get(to_category, ()),
+        }, versions, {from_category: ((source[i],), ()), to_category: ((), (item,))})
+        return item
+
+
+def _assign_positions(entries):
+    """
+    Позиции для нового порядка категории.
+
+    entries - список (row, ...) где row - старая строка или None.
+    Строки, порядок которых не изменился, сохраняют позицию; остальные
+    получают позиции между соседями, поэтому вставка в начало или удаление
+    не переписывают всю категорию.
+    """
+    kept = [False] * len(entries)
+    prev = None
+    for i, (row, _, _) in enumerate(entries):
+        if row is not None and (prev is None or row['position'] > prev):
+            kept[i] = True
+            prev = row['position']
+
+    positions = [None] * len(entries)
+    i = 0
+    while i < len(entries):
+        if kept[i]:
+            positions[i] = entries[i][0]['position']
+            i += 1
+            continue
+        j = i
+        while j < len(entries) and not kept[j]:
+            j += 1
+        low = positions[i - 1] if i > 0 else None
+        high = entries[j][0]['position'] if j < len(entries) else None
+        count = j - i
+        for k in range(count):
+            if low is None and high is None:
+                positions[i + k] = float(k)
+            elif low is None:
+                positions[i + k] = high - count + k
+            elif high is None:
+                positions[i + k] = low + k + 1
+            else:
+                positions[i + k] = low + (high - low) * (k + 1) / (count + 1)
+        i = j
+    return positions
+
+
+def save_country(country, data):
+    """
+    Сохранить все объявления страны.
+
+    Сравнивает с текущими строками и пишет только изменившиеся:
+    одно скрытое объявление = один UPDATE, а не перезапись страны.
+    """
+    ensure_migrated(country)
+    with _write_lock:
+        conn = get_connection()
+        with _transaction(conn):
+            old_rows = {}
+            id_counts = {}
+            for rowid, category, listing_id, position, text in conn.execute(
+                "SELECT rowid, category, listing_id, position, data FROM listings WHERE country = ?",
+                (country,)
+            ):
+                old_rows[rowid] = {'rowid': rowid, 'category': category, 'listing_id': listing_id,
+                                   'position': position, 'data': text}
+                if listing_id is not None:
+                    id_counts[listing_id] = id_counts.get(listing_id, 0) + 1
+
+            by_id = {row['listing_id']: row for row in old_rows.values()
+                     if row['listing_id'] is not None and id_counts[row['listing_id']] == 1}
+            by_text = {}
+            for row in old_rows.values():
+                by_text.setdefault(row['data'], []).append(row)
+
+            new_ids = {}
+            for items in data.values():
+                if isinstance(items, (list, tuple)):
+                    for item in items:
+                        if isinstance(item, Mapping) and _listing_id(item) is not None:
+                            listing_id = _listing_id(item)
+                            new_ids[listing_id] = new_ids.get(listing_id, 0) + 1
+
+            used = set()
+            inserts, updates = [], []
+            for category, items in data.items():
+                if not isinstance(items, (list, tuple)):
+                    continue
+                entries = []
+                for item in items:
+                    if not isinstance(item, Mapping):
+                        continue
+                    text = _dumps(item)
+                    listing_id = _listing_id(item)
+                    row = None
+                    if listing_id is not None and new_ids[listing_id] == 1:
+                        candidate = by_id.get(listing_id)
+                        if candidate is not None and candidate['rowid'] not in used:
+                            row = candidate
+                    if row is None:
+                        for candidate in by_text.get(text, []):
+                            if candidate['rowid'] not in used:
+                                row = candidate
+                                break
+                    if row is not None:
+                        used.add(row['rowid'])
+                        if row['category'] != category:
+                            row = dict(row, position=None)
+                    entries.append((row, text, listing_id))
+
+                positions = _assign_positions(
+                    [(row if row is not None and row['position'] is not None else None, text, listing_id)
+                     for row, text, listing_id in entries]
+                )
+                for (row, text, listing_id), position in zip(entries, positions):
+                    if row is None:
+                        inserts.append((country, category, listing_id, position, text))
+                    elif (row['category'], row['listing_id'], row['position'], row['data']) != \
+                            (category, listing_id, position, text):
+                        updates.append((category, listing_id, position, text, row['rowid']))
+
+            deletes = [(rowid,) for rowid in old_rows if rowid not in used]
+            if deletes:
+                conn.executemany("DELETE FROM listings WHERE rowid = ?", deletes)
+            if updates:
+                conn.executemany(
+                    "UPDATE listings SET category = ?, listing_id = ?, position = ?, data = ? WHERE rowid = ?",
+                    updates
+                )
+            if inserts:
+                conn.executemany(
+                    "INSERT INTO listings (country, category, listing_id, position, data) VALUES (?, ?, ?, ?, ?)",
+                    inserts
+                )
+            _, after = _bump_version(conn, country)
+        # После записи база совпадает с data - публикуем её как новый снимок
+        _cache[country] = _snapshot(data, after)
+        _changed()
+
+
+if __name__ == '__main__':
+    for country in COUNTRIES:
+        ensure_migrated(country)
+        total = sum(len(items) for items in load_country(country).values())
+        print(f"{country}: {total} объявлений в {DB_FILE}")
+    export_snapshot()
+    print(f"Снимок всех стран записан в {LEGACY_DATA_FILE}")
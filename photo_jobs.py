@@ -0,0 +1,244 @@
+"""
+Очередь загрузки фото объявлений в Telegram канал.
+
+Модерация, правка объявления в админке и ручной парсинг раньше вызывали
+send_photo_to_channel прямо в обработчике запроса (таймаут 30 секунд на
+фото), и одобрение с четырьмя фото держало воркер минутами. Теперь
+обработчик кладёт задание в очередь (таблица SQLite, переживает
+перезапуск) и сразу отвечает: у объявления появляется поле photos_pending
+со списком полей, для которых фото ещё загружаются. Фоновые потоки
+загружают фото и вызывают on_done - он вписывает file_id в объявление.
+Неудачная попытка повторяется с экспоненциальной задержкой.
+
+Задания одного объявления выполняются по одному (во всех воркерах), чтобы
+правки объявления не затирали друг друга.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+DB_FILE = os.environ.get('PHOTO_JOBS_DB', 'photo_jobs.db')
+
+WORKERS = 2
+POLL_INTERVAL = 2
+# Задание "в работе" дольше этого - воркер умер, задание можно взять снова
+LEASE = 300
+MAX_ATTEMPTS = 6
+RETRY_BASE = 30
+RETRY_MAX = 3600
+SOURCE_TIMEOUT = 30
+# Выполненные и проваленные задания хранятся для /api/cache-stats и разбора
+KEEP_FINISHED = 7 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photo_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    country TEXT NOT NULL,
+    category TEXT NOT NULL,
+    listing_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    caption TEXT,
+    image BLOB,
+    source_url TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    lease_until REAL,
+    error TEXT,
+    file_id TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS photo_jobs_ready ON photo_jobs (status, run_at);
+CREATE INDEX IF NOT EXISTS photo_jobs_listing ON photo_jobs (country, listing_id, status);
+"""
+
+
+class RetryLater(Exception):
+    """Задание нельзя выполнить сейчас (например, объявление ещё не сохранено)"""
+
+
+class PhotoJobError(Exception):
+    """Задание не выполнить никогда - без повторов"""
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+
+
+class PhotoJobQueue:
+    """
+    Очередь заданий в SQLite и пул фоновых потоков.
+    upload(image_data, caption) -> file_id или None;
+    on_done(job, file_id) - вписать file_id в объявление;
+    on_failed(job) - задание провалено окончательно.
+    """
+
+    def __init__(self, path, upload, on_done, on_failed, workers=WORKERS):
+        self.path = path
+        self.upload = upload
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.workers = workers
+        self._local = threading.local()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def start(self):
+        """Запустить фоновые потоки (один раз на процесс)"""
+        if self._threads:
+            return
+        with self._start_lock:
+            if not self._threads:
+                try:
+                    self.cleanup()
+                except Exception as e:
+                    print(f"PHOTO JOBS: ошибка очистки: {e}")
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self._worker, daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def enqueue(self, country, category, listing_id, field, caption='', image=None, source_url=None):
+        """Поставить загрузку фото: image - байты или source_url - откуда их скачать"""
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO photo_jobs (country, category, listing_id, field, caption, image, source_url,"
+            " run_at, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (country, category, str(listing_id), field, caption,
+             sqlite3.Binary(image) if image is not None else None, source_url, now, now, now)
+        )
+        self.start()
+        self._wakeup.set()
+
+    def _claim(self):
+        """Взять готовое задание; задания объявления, которое уже в работе, пропускаются"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM photo_jobs AS job"
+                " WHERE ((status = 'pending' AND run_at <= ?) OR (status = 'running' AND lease_until < ?))"
+                " AND NOT EXISTS (SELECT 1 FROM photo_jobs AS other WHERE other.status = 'running'"
+                "   AND other.lease_until >= ? AND other.country = job.country"
+                "   AND other.listing_id = job.listing_id)"
+                " ORDER BY id LIMIT 1",
+                (now, now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE photo_jobs SET status = 'running', lease_until = ?, attempts = attempts + 1,"
+                " updated = ? WHERE id = ?",
+                (now + LEASE, now, row['id'])
+            )
+        job = dict(row)
+        job['attempts'] += 1
+        return job
+
+    def _finish(self, job, status, error=None, file_id=None, run_at=None):
+        now = time.time()
+        if status == 'pending':
+            self._connection().execute(
+                "UPDATE photo_jobs SET status = ?, run_at = ?, lease_until = NULL, error = ?, updated = ?"
+                " WHERE id = ?",
+                (status, run_at, error, now, job['id'])
+            )
+        else:
+            # Байты больше не нужны - в базе остаётся только запись о задании
+            self._connection().execute(
+                "UPDATE photo_jobs SET status = ?, lease_until = NULL, error = ?, file_id = ?, image = NULL,"
+                " updated = ? WHERE id = ?",
+                (status, error, file_id, now, job['id'])
+            )
+
+    def _image_data(self, job):
+        if job['image'] is not None:
+            return bytes(job['image'])
+        if job['source_url']:
+            response = requests.get(job['source_url'], timeout=SOURCE_TIMEOUT)
+            if response.status_code == 200 and response.content:
+                return response.content
+            raise RetryLater(f"source_url HTTP {response.status_code}")
+        return None
+
+    def _run(self, job):
+        try:
+            file_id = job['file_id']
+            if not file_id:
+                image_data = self._image_data(job)
+                if not image_data:
+                    raise PhotoJobError('нет данных фото')
+                file_id = self.upload(image_data, job['caption'] or '')
+                if not file_id:
+                    raise RetryLater('Telegram не вернул file_id')
+                # file_id сохраняем сразу: если объявление ещё не готово, повтор не загрузит фото второй раз
+                job['file_id'] = file_id
+                self._connection().execute("UPDATE photo_jobs SET file_id = ? WHERE id = ?", (file_id, job['id']))
+            self.on_done(job, file_id)
+            self._finish(job, 'done', file_id=file_id)
+            print(f"PHOTO JOBS: {job['country']}/{job['listing_id']} {job['field']} загружено")
+        except Exception as e:
+            if isinstance(e, PhotoJobError) or job['attempts'] >= MAX_ATTEMPTS:
+                print(f"PHOTO JOBS: {job['country']}/{job['listing_id']} {job['field']} - отказ после "
+                      f"{job['attempts']} попыток: {e}")
+                self._finish(job, 'failed', error=str(e), file_id=job['file_id'])
+                try:
+                    self.on_failed(job)
+                except Exception as failed_error:
+                    print(f"PHOTO JOBS: ошибка on_failed: {failed_error}")
+                return
+            delay = retry_delay(job['attempts'])
+            print(f"PHOTO JOBS: {job['country']}/{job['listing_id']} {job['field']} - попытка "
+                  f"{job['attempts']}: {e}, повтор через {delay} с")
+            self._finish(job, 'pending', error=str(e), run_at=time.time() + delay)
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"PHOTO JOBS: ошибка очереди: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def cleanup(self):
+        """Удалить старые выполненные и проваленные задания"""
+        self._connection().execute(
+            "DELETE FROM photo_jobs WHERE status IN ('done', 'failed') AND updated < ?",
+            (time.time() - KEEP_FINISHED,)
+        )
+
+    def stats(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM photo_jobs GROUP BY status")
+        return {status: count for status, count in rows}
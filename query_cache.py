@@ -0,0 +1,74 @@
+"""
+LRU кэш результатов запросов к объявлениям.
+
+Ключ - (страна, запрос), значение действительно только для снимка страны,
+на котором оно посчитано (listings_store.get_country). Любая запись в
+страну (парсер, модерация, правка в админке) публикует новый снимок, и при
+первом обращении с ним все записи этой страны выбрасываются.
+"""
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """Ограниченный по размеру LRU кэш со счётчиками попаданий"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_snapshot(self, country, data):
+        """Снимок страны сменился - выбросить её записи (вызывается под _lock)"""
+        current = self._snapshots.get(country)
+        if current is data:
+            return
+        if current is not None:
+            stale = [key for key in self._entries if key[0] == country]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+        self._snapshots[country] = data
+
+    def get(self, country, data, query):
+        """Результат запроса query по снимку data или None"""
+        key = (country, query)
+        with self._lock:
+            self._check_snapshot(country, data)
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, country, data, query, value):
+        if self.maxsize <= 0:
+            return
+        key = (country, query)
+        with self._lock:
+            # Пока считали, страну могли изменить - результат по старому снимку не сохраняем
+            if self._snapshots.get(country) is not data:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
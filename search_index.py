@@ -0,0 +1,120 @@
+"""
+Полнотекстовый поиск по объявлениям (/api/search).
+
+Текст нормализуется (нижний регистр, ё -> е, снятие диакритики, чтобы
+"Đà Nẵng" и "da nang" совпадали), русские слова обрезаются лёгким стеммером
+по окончаниям. Термы объявления считаются один раз на Listing
+(Listing.search_terms), обратный индекс {терм: {объявление: вес}} - один раз
+на снимок категории (listing_indexes.CategoryIndex.search_postings). Новые
+объявления парсеров и модерации попадают в новый снимок категории, и при
+следующем поиске индекс этой категории собирается из уже посчитанных термов;
+остальные категории не пересчитываются.
+"""
+import math
+import re
+import unicodedata
+
+# Вес терма из заголовка и из описания
+TITLE_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+
+_WORD = re.compile(r'\w+')
+_CYRILLIC = re.compile(r'[а-я]')
+
+# Русские окончания, от длинных к коротким
+_RU_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ия', 'ию', 'ии',
+    'ться', 'тся', 'ать', 'ять', 'ить', 'еть', 'ешь', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+_MIN_STEM = 3
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е, без диакритики (вьетнамские и латинские буквы)"""
+    text = str(text).lower().replace('ё', 'е').replace('đ', 'd')
+    # Диакритику снимаем только у латиницы: й и ё в NFD тоже раскладываются
+    decomposed = unicodedata.normalize('NFD', text)
+    result = []
+    for char in decomposed:
+        if unicodedata.combining(char) and result and result[-1] < 'Ѐ':
+            continue
+        result.append(char)
+    return unicodedata.normalize('NFC', ''.join(result))
+
+
+def stem(word):
+    """Лёгкий стемминг: русские окончания, английское множественное число"""
+    if _CYRILLIC.search(word):
+        for ending in _RU_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+                return word[:-len(ending)]
+        return word
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Термы текста в порядке появления (с повторами)"""
+    return [stem(word) for word in _WORD.findall(normalize(text)) if len(word) > 1 or word.isdigit()]
+
+
+def listing_terms(item):
+    """{терм: вес} объявления по заголовку и описанию"""
+    terms = {}
+    for term in tokenize(item.get('description') or ''):
+        terms[term] = terms.get(term, 0.0) + DESCRIPTION_WEIGHT
+    for term in tokenize(item.get('title') or ''):
+        terms[term] = terms.get(term, 0.0) + TITLE_WEIGHT
+    return terms
+
+
+def build_postings(items):
+    """Обратный индекс {терм: {объявление: вес}} по видимым объявлениям"""
+    postings = {}
+    for item in items:
+        if item.is_hidden:
+            continue
+        for term, weight in item.search_terms().items():
+            postings.setdefault(term, {})[item] = weight
+    return postings
+
+
+def search(indexes, query):
+    """
+    Ранжированный поиск по нескольким категориям: indexes - [(категория,
+    CategoryIndex)], в результате все термы запроса. Возвращает
+    [(вес, категория, объявление)] от лучших к худшим (при равном весе -
+    новые сверху).
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    all_postings = [(category, index.search_postings()) for category, index in indexes]
+
+    # idf по всем категориям страны
+    total = sum(index.visible_count() for _, index in indexes) or 1
+    idf = {}
+    for term in terms:
+        df = sum(len(postings.get(term, ())) for _, postings in all_postings)
+        if not df:
+            return []
+        idf[term] = math.log(1 + total / df)
+
+    hits = []
+    for category, postings in all_postings:
+        term_postings = [postings.get(term) for term in terms]
+        if not all(term_postings):
+            continue
+        # Пересечение начинаем с самого короткого списка
+        term_postings.sort(key=len)
+        first, rest = term_postings[0], term_postings[1:]
+        for item in first:
+            if all(item in other for other in rest):
+                score = sum(postings[term][item] * idf[term] for term in terms)
+                hits.append((score, category, item))
+    hits.sort(key=lambda hit: (hit[0], hit[2].sort_date), reverse=True)
+    return hits
@@ -0,0 +1,150 @@
+"""
+Бинарные снимки объявлений страны для mmap.
+
+Файл собирается из строк базы (JSON каждого объявления уже готов, повторно
+ничего не кодируется) и только читается, поэтому воркеры gunicorn открывают
+его через mmap и делят страницы в page cache ОС: общий только сырой JSON
+объявлений (его отдают ответы, см. Listing.encoded). Разобранные объекты
+Listing и индексы категорий каждый воркер строит сам, в своей памяти; по
+хешу категории в заголовке воркер после чужой записи переиспользует уже
+разобранные неизменённые категории и разбирает только изменённые.
+
+Формат:
+    MAGIC
+    u64 длина заголовка
+    заголовок JSON {"version": ..., "categories": {категория: [первый, количество]},
+                    "digests": {категория: sha1 фрагментов категории}}
+    таблица смещений: пары u64 (смещение, длина) для каждого объявления
+    JSON фрагменты объявлений подряд (смещения - от начала области фрагментов)
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'GASNAP2\n'
+_U64 = struct.Struct('<Q')
+
+
+def write_snapshot(path, version, categories):
+    """
+    Записать снимок: categories - {категория: [JSON текст объявления, ...]}
+    в нужном порядке. Файл заменяется атомарно.
+    """
+    offsets = array('Q')
+    chunks = []
+    ranges = {}
+    digests = {}
+    position = 0
+    for category, texts in categories.items():
+        ranges[category] = [len(offsets) // 2, len(texts)]
+        digest = hashlib.sha1()
+        for text in texts:
+            chunk = text.encode('utf-8') if isinstance(text, str) else bytes(text)
+            offsets.append(position)
+            offsets.append(len(chunk))
+            chunks.append(chunk)
+            position += len(chunk)
+            # Длина перед фрагментом: границы объявлений тоже входят в хеш
+            digest.update(_U64.pack(len(chunk)))
+            digest.update(chunk)
+        digests[category] = digest.hexdigest()
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+
+    header = json.dumps({'version': version, 'categories': ranges, 'digests': digests},
+                        separators=(',', ':')).encode('utf-8')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_U64.pack(len(header)))
+        f.write(header)
+        # Выравнивание таблицы смещений по 8 байт для memoryview.cast
+        f.write(b'\0' * (-(len(MAGIC) + _U64.size + len(header)) % 8))
+        f.write(offsets.tobytes())
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """Открытый (mmap) снимок страны"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if mm[:len(MAGIC)] != MAGIC:
+            mm.close()
+            raise ValueError(f"{path}: не снимок объявлений")
+        header_start = len(MAGIC) + _U64.size
+        (header_len,) = _U64.unpack_from(mm, len(MAGIC))
+        header = json.loads(mm[header_start:header_start + header_len])
+        self.version = header['version']
+        self._ranges = header['categories']
+        self._digests = header['digests']
+
+        table_start = header_start + header_len
+        table_start += -table_start % 8
+        total = sum(count for _, count in self._ranges.values())
+        if sys.byteorder == 'little':
+            # Таблица читается прямо из mmap, без копии в память процесса
+            self._offsets = memoryview(mm)[table_start:table_start + total * 16].cast('Q')
+        else:
+            self._offsets = array('Q', mm[table_start:table_start + total * 16])
+            self._offsets.byteswap()
+        self._data_start = table_start + total * 16
+
+    @property
+    def categories(self):
+        return list(self._ranges)
+
+    def digest(self, category):
+        """Хеш содержимого категории: совпадает - категория не менялась"""
+        return self._digests.get(category)
+
+    def count(self, category):
+        return self._ranges[category][1] if category in self._ranges else 0
+
+    def fragment(self, category, i):
+        """JSON фрагмент i-го объявления категории (bytes)"""
+        first, count = self._ranges[category]
+        if not 0 <= i < count:
+            raise IndexError(i)
+        offset = self._offsets[(first + i) * 2]
+        length = self._offsets[(first + i) * 2 + 1]
+        start = self._data_start + offset
+        return self._mm[start:start + length]
+
+    def fragment_view(self, category, i):
+        """То же, что fragment, но memoryview на mmap без копирования"""
+        first, count = self._ranges[category]
+        if not 0 <= i < count:
+            raise IndexError(i)
+        offset = self._offsets[(first + i) * 2]
+        length = self._offsets[(first + i) * 2 + 1]
+        start = self._data_start + offset
+        return memoryview(self._mm)[start:start + length]
+
+    def fragments(self, category):
+        for i in range(self.count(category)):
+            yield self.fragment(category, i)
+
+    def close(self):
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        self._mm.close()
+
+
+def open_snapshot(path):
+    """Открыть снимок или None, если файла нет или он повреждён"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"SNAPSHOT: не удалось открыть {path}: {e}")
+        return None
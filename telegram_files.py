@@ -0,0 +1,269 @@
+"""
+Фото из Telegram через собственный адрес /img/tg/<file_id>.
+
+Ссылка https://api.telegram.org/file/bot<token>/<file_path> действует около
+часа и содержит токен бота, поэтому в объявлениях хранится только file_id,
+а браузер получает постоянный адрес photo_url(file_id). Эндпоинт сам
+узнаёт file_path (getFile) и скачивает фото: file_path хранится в LRU кэше
+TelegramFileCache с TTL меньше часа (ошибки - ненадолго), байты фото - в
+LRU кэше на диске PhotoDiskCache. Содержимое file_id не меняется, поэтому
+браузер и CDN кэшируют ответ надолго.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка очистки только внутри процесса
+    fcntl = None
+
+# Ссылка Telegram живёт около часа - берём с запасом
+FILE_PATH_TTL = 50 * 60
+# Telegram ответил ошибкой (неверный или удалённый file_id)
+NEGATIVE_TTL = 10 * 60
+# Сеть/таймаут - повторим скоро
+ERROR_TTL = 60
+
+GET_FILE_TIMEOUT = 10
+DOWNLOAD_TIMEOUT = 30
+
+# Каталог кэша фото общий у воркеров: размер пересчитывается с диска, когда
+# этот процесс записал такую долю лимита (записи других процессов он не видит)
+DISK_RESCAN_FRACTION = 0.05
+
+PHOTO_URL_PREFIX = '/img/tg/'
+FILE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{10,256}$')
+
+# Сигнатуры форматов: первые байты -> Content-Type
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+def _bot_token():
+    return os.environ.get('TELEGRAM_BOT_TOKEN')
+
+
+def photo_url(file_id):
+    """Постоянный адрес фото для объявления (без токена бота)"""
+    return f"{PHOTO_URL_PREFIX}{file_id}"
+
+
+def is_file_id(value):
+    return bool(value) and bool(FILE_ID_PATTERN.match(value))
+
+
+def content_type(data):
+    for signature, mimetype in _SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+def fetch_file_path(file_id):
+    """getFile в Bot API: (file_path или None, сколько секунд хранить ответ)"""
+    try:
+        response = requests.get(f"https://api.telegram.org/bot{_bot_token()}/getFile",
+                                params={'file_id': file_id}, timeout=GET_FILE_TIMEOUT).json()
+    except Exception as e:
+        print(f"TELEGRAM: getFile error: {e}")
+        return None, ERROR_TTL
+    if response.get('ok'):
+        file_path = response['result'].get('file_path')
+        if file_path:
+            return file_path, FILE_PATH_TTL
+    return None, NEGATIVE_TTL
+
+
+class TelegramFileCache:
+    """Ограниченный LRU кэш file_id -> file_path с TTL и кэшированием ошибок"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        # file_id -> (file_path или None, истекает)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative = 0
+        self.fetches = 0
+        self.evictions = 0
+
+    def _store(self, file_id, file_path, ttl):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[file_id] = (file_path, time.time() + ttl)
+            self._entries.move_to_end(file_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def file_path(self, file_id):
+        """file_path фото (None - Telegram не отдал); при промахе ждёт getFile"""
+        if not file_id or not _bot_token():
+            return None
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(file_id)
+                if entry[0] is None:
+                    self.negative += 1
+                else:
+                    self.hits += 1
+                return entry[0]
+            self.misses += 1
+            self.fetches += 1
+        file_path, ttl = fetch_file_path(file_id)
+        self._store(file_id, file_path, ttl)
+        return file_path
+
+    def forget(self, file_id):
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+    def download(self, file_id):
+        """Байты фото по file_id или None"""
+        for _ in range(2):
+            file_path = self.file_path(file_id)
+            if not file_path:
+                return None
+            try:
+                response = requests.get(f"https://api.telegram.org/file/bot{_bot_token()}/{file_path}",
+                                        timeout=DOWNLOAD_TIMEOUT)
+            except Exception as e:
+                print(f"TELEGRAM: ошибка загрузки фото {file_id[:20]}: {e}")
+                return None
+            if response.status_code == 200:
+                return response.content
+            # Ссылка истекла раньше TTL - один раз запрашиваем file_path заново
+            self.forget(file_id)
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'negative': self.negative,
+                'fetches': self.fetches,
+                'evictions': self.evictions,
+            }
+
+
+class PhotoDiskCache:
+    """
+    Кэш байтов фото на диске, ограниченный суммарным размером. Давность
+    использования - mtime файла (обновляется при чтении), при переполнении
+    удаляются самые старые файлы. Каталог общий для всех воркеров, поэтому
+    размер периодически пересчитывается с диска, а очистка идёт под
+    блокировкой файла (одновременно чистит один процесс).
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._written = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                # Блокировка и недописанные файлы других процессов
+                if name.startswith('.') or name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"TELEGRAM: не удалось сохранить фото в кэш: {e}")
+            return
+        with self._lock:
+            self._written += len(data)
+            if self._size is not None:
+                self._size += len(data)
+            if (self._size is None or self._size > self.max_bytes or
+                    self._written >= self.max_bytes * DISK_RESCAN_FRACTION):
+                self._rescan()
+
+    def _rescan(self):
+        """
+        Размер кэша с диска (с записями всех процессов) и удаление самых
+        старых файлов до 90% лимита при переполнении. Вызывается под _lock.
+        """
+        self._written = 0
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            files = sorted(self._files())
+            total = sum(size for _, size, _ in files)
+            if total > self.max_bytes:
+                target = self.max_bytes * 0.9
+                for _, size, path in files:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+                    self.evictions += 1
+        self._size = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
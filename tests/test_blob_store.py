@@ -0,0 +1,24 @@
+"""Переиспользование файлов BlobStore (blob_store.py)"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blob_store import BlobStore
+
+
+def test_put_of_existing_blob_protects_it_from_cleanup(tmp_path):
+    blobs = BlobStore(str(tmp_path))
+    digest = blobs.put(b'photo')
+    path = blobs.path(digest)
+    # Файл брошенной давно подачи
+    os.utime(path, (0, 0))
+
+    # Новая подача с тем же фото, её запись ещё не сохранена
+    assert blobs.put(b'photo') == digest
+    blobs.delete(digest, min_age=600)
+    assert blobs.collect(set(), min_age=3600) == 0
+    assert os.path.exists(path)
+
+    blobs.delete(digest)
+    assert not os.path.exists(path)
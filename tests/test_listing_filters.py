@@ -0,0 +1,156 @@
+"""
+Фильтры по городу и счётчики городов совпадают со старыми фильтрами
+get_listings и /api/city-counts (эталон ниже - их код до индексов).
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from listing_cities import CITY_NAMES
+from listing_filters import filter_listings
+from listing_indexes import CategoryIndex
+from listing_model import Listing
+
+FULL_MAP = {
+    'Нячанг': ['нячанг', 'nha trang', 'nhatrang', 'nha_trang'],
+    'Хошимин': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh', 'hochiminh'],
+    'Дананг': ['дананг', 'da nang', 'danang', 'da_nang'],
+    'Ханой': ['ханой', 'hanoi', 'ha_noi'],
+    'Фукуок': ['фукуок', 'phu quoc', 'phuquoc', 'phu_quoc'],
+    'Фантьет': ['фантьет', 'phan thiet', 'phanthiet', 'phan_thiet'],
+    'Муйне': ['муйне', 'mui ne', 'muine', 'mui_ne'],
+    'Камрань': ['камрань', 'cam ranh', 'camranh', 'cam_ranh'],
+    'Далат': ['далат', 'da lat', 'dalat', 'da_lat'],
+    'Хойан': ['хойан', 'hoi an', 'hoian', 'hoi_an'],
+}
+COUNT_MAP = dict(FULL_MAP, **{'Хошимин': ['хошимин', 'сайгон', 'saigon', 'ho chi minh', 'hcm', 'ho_chi_minh']})
+EXCHANGE_MAP = {name: COUNT_MAP[name] for name in ('Нячанг', 'Хошимин', 'Дананг', 'Фукуок')}
+KIDS_MAP = {
+    'nha trang': ['nha trang', 'nhatrang', 'нячанг'],
+    'da nang': ['da nang', 'danang', 'дананг'],
+    'phu quoc': ['phu quoc', 'phuquoc', 'фукуок'],
+    'ho chi minh': ['ho chi minh', 'hochiminh', 'hcm', 'хошимин', 'сайгон'],
+}
+REAL_ESTATE_MAP = {
+    'nhatrang': ['nhatrang', 'nha trang', 'нячанг'],
+    'danang': ['danang', 'da nang', 'дананг'],
+    'hochiminh': ['hochiminh', 'ho chi minh', 'hcm', 'хошимин', 'сайгон'],
+    'hanoi': ['hanoi', 'ha noi', 'ханой'],
+    'phuquoc': ['phuquoc', 'phu quoc', 'фукуок'],
+    'dalat': ['dalat', 'da lat', 'далат'],
+}
+
+
+def old_city_filter(category, items, value):
+    """Фильтр по городу из старого get_listings"""
+    if category in ('restaurants', 'tours', 'entertainment', 'marketplace', 'visas'):
+        targets = FULL_MAP.get(value, [value.lower()])
+
+        def matches(x):
+            item_city = str(x.get('city', '')).lower()
+            item_location = str(x.get('location', '')).lower()
+            search_text = f"{x.get('title', '')} {x.get('description', '')}".lower()
+            if not item_city and not item_location:
+                return True
+            return any(t in item_city or t in item_location or t in search_text for t in targets)
+        return [x for x in items if matches(x)]
+    if category == 'kids':
+        targets = KIDS_MAP.get(value.lower(), [value.lower()])
+        return [x for x in items if any(t in str(x.get('city', '')).lower() for t in targets)]
+    if category in ('news', 'medicine'):
+        needle = value.lower()
+        return [x for x in items if needle in str(x.get('city', '')).lower() or
+                needle in str(x.get('title', '')).lower() or needle in str(x.get('description', '')).lower()]
+    if category == 'money_exchange':
+        targets = EXCHANGE_MAP.get(value, [value.lower()])
+        return [x for x in items if any(t in f"{x.get('city', '')} {x.get('title', '')} {x.get('description', '')} "
+                                              f"{x.get('address', '')}".lower() for t in targets)]
+    if category == 'transport':
+        targets = FULL_MAP.get(value, [value.lower()])
+
+        def matches(x):
+            item_city = str(x.get('city', '')).lower()
+            item_location = str(x.get('location', '')).lower()
+            search_text = f"{x.get('title', '')} {x.get('description', '')}".lower()
+            return any(t in item_city or t in item_location or t in search_text for t in targets)
+        return [x for x in items if matches(x)]
+    if category == 'real_estate':
+        targets = REAL_ESTATE_MAP.get(value.lower(), [value.lower()])
+        return [x for x in items if any(t in str(x.get('city', '')).lower() or
+                                        t in str(x.get('city_ru', '')).lower() for t in targets)]
+    raise AssertionError(category)
+
+
+def old_city_counts(items):
+    """Счётчики из старого /api/city-counts"""
+    counts = {name: 0 for name in CITY_NAMES.values()}
+    for x in items:
+        item_city = str(x.get('city', '') or x.get('location', '')).lower()
+        search_text = f"{x.get('title', '')} {x.get('description', '')} {item_city}".lower()
+        for name, keywords in COUNT_MAP.items():
+            if any(kw in search_text or kw in item_city for kw in keywords):
+                counts[name] += 1
+    return counts
+
+
+SPELLINGS = ['Nha Trang', 'Нячанг', 'Saigon', 'Ho Chi Minh', 'HoChiMinh', 'ho_chi_minh', 'HCM', 'Ha Noi',
+             'Hanoi', 'ha_noi', 'Da Nang', 'Phu Quoc', 'Mui Ne', 'Dalat', 'Hoi An', 'Cam Ranh', 'Phan Thiet',
+             'Bangkok', 'nha', 'Trang']
+CITY_VALUES = ['', None, 'Nha Trang', 'nhatrang', 'Ha Noi', 'Hanoi', 'Saigon', 'hochiminh', 'Da Nang',
+               'Phu Quoc', 'Dalat', 'Москва']
+
+
+def make_items(seed=7, count=600):
+    rnd = random.Random(seed)
+    items = []
+    for i in range(count):
+        item = {'id': str(i), 'date': f"2024-01-{i % 28 + 1:02d}", 'hidden': rnd.random() < 0.1,
+                'title': ' '.join(rnd.sample(SPELLINGS, 2)) + ' объявление',
+                'description': f"текст {rnd.choice(SPELLINGS)} " + rnd.choice(['', 'nha', 'до ']),
+                'city': rnd.choice(CITY_VALUES)}
+        for field in ('location', 'city_ru', 'address'):
+            if rnd.random() < 0.4:
+                item[field] = rnd.choice(CITY_VALUES + SPELLINGS)
+        # Город без ключа (не пустая строка и не None) - для правила "город не указан"
+        if rnd.random() < 0.1:
+            del item['city']
+        items.append(item)
+    return items
+
+
+QUERY_VALUES = (list(FULL_MAP) + list(KIDS_MAP) + list(REAL_ESTATE_MAP) +
+                ['хошимин', 'ha noi', 'Ha Noi', 'nha', 'Saigon', 'Москва', 'trang текст'])
+
+CATEGORIES = ['restaurants', 'tours', 'entertainment', 'marketplace', 'visas', 'kids', 'news',
+              'money_exchange', 'medicine', 'transport', 'real_estate']
+
+
+@pytest.fixture(scope='module')
+def data():
+    raw = make_items()
+    return raw, CategoryIndex(tuple(Listing(item) for item in raw))
+
+
+@pytest.mark.parametrize('category', CATEGORIES)
+def test_city_filter_matches_old_filter(data, category):
+    raw, index = data
+    param = 'realestate_city' if category == 'real_estate' else 'city'
+    for value in QUERY_VALUES:
+        result, _ = filter_listings(index, category, {param: value})
+        if category == 'real_estate' and value == 'nhatrang':
+            visible = raw
+        else:
+            visible = [x for x in raw if not x['hidden']]
+        expected = {x['id'] for x in old_city_filter(category, visible, value)}
+        assert {item['id'] for item in result} == expected, (category, value)
+
+
+def test_city_counts_match_old_counts(data):
+    raw, index = data
+    histogram = index.facet_counts('city')
+    counts = {name: histogram.get(city_id, 0) for city_id, name in CITY_NAMES.items()}
+    assert counts == old_city_counts([x for x in raw if not x['hidden']])
@@ -0,0 +1,99 @@
+"""Правка объявлений в категории с одинаковыми id (listings_store.py)"""
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import listings_store
+from listing_indexes import CategoryIndex
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(listings_store, 'DB_FILE', str(tmp_path / 'listings.db'))
+    monkeypatch.setattr(listings_store, 'SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(listings_store, '_local', threading.local())
+    monkeypatch.setattr(listings_store, '_cache', {})
+    monkeypatch.setattr(listings_store, '_migrated', set())
+    # Выгрузка listings_data.json в фоне тесту не нужна
+    monkeypatch.setattr(listings_store, '_changed', lambda: None)
+    data = listings_store.create_empty_data()
+    data['tours'] = [{'id': '1', 'title': 'A'}, {'id': '1', 'title': 'B'}, {'id': '2', 'title': 'C'}]
+    listings_store.save_country('vietnam', data)
+    return listings_store
+
+
+def titles(data, category):
+    return [item['title'] for item in data[category]]
+
+
+def test_update_duplicate_id_changes_one_row(store):
+    store.update_listing('vietnam', 'tours', '1', {'title': 'A2'})
+    assert titles(store.get_country('vietnam'), 'tours') == ['A2', 'B', 'C']
+    assert titles(store.load_country('vietnam'), 'tours') == ['A2', 'B', 'C']
+
+
+def test_move_duplicate_id_moves_one_row(store):
+    store.move_listing('vietnam', '1', 'tours', 'visas')
+    for data in (store.get_country('vietnam'), store.load_country('vietnam')):
+        assert titles(data, 'tours') == ['B', 'C']
+        assert titles(data, 'visas') == ['A']
+
+
+def test_delete_duplicate_id_removes_one_row(store):
+    store.delete_listing('vietnam', 'tours', '1')
+    for data in (store.get_country('vietnam'), store.load_country('vietnam')):
+        assert titles(data, 'tours') == ['B', 'C']
+
+
+def test_reload_after_other_process_write_reuses_unchanged_categories(store, tmp_path):
+    data = store.create_empty_data()
+    data['tours'] = [{'id': '1', 'title': 'A'}]
+    data['visas'] = [{'id': '2', 'title': 'V'}]
+    store.save_country('vietnam', data)
+    # Снимок как у воркера, открывшего mmap файл
+    store._cache.clear()
+    before = store.get_country('vietnam')
+    tours, visas = before['tours'], before['visas']
+
+    # Запись из другого процесса
+    env = dict(os.environ, LISTINGS_DB=store.DB_FILE, LISTINGS_SNAPSHOT_DIR=store.SNAPSHOT_DIR)
+    subprocess.run([sys.executable, '-c', "import listings_store; "
+                    "listings_store.update_listing('vietnam', 'visas', '2', {'title': 'V2'})"],
+                   cwd=str(tmp_path), env=dict(env, PYTHONPATH=ROOT), check=True, capture_output=True)
+
+    store._cache['vietnam']['checked'] = 0
+    after = store.get_country('vietnam')
+    assert after is not before
+    assert after['tours'] is tours
+    assert after['visas'] is not visas and titles(after, 'visas') == ['V2']
+
+
+def test_facet_counts_follow_single_listing_writes(store):
+    data = store.create_empty_data()
+    data['tours'] = [{'id': str(i), 'title': f'Тур {i}', 'city': city}
+                     for i, city in enumerate(['Nha Trang', 'Saigon', 'Da Nang', 'Nha Trang'])]
+    data['visas'] = [{'id': 'v', 'title': 'Визаран Nha Trang'}]
+    store.save_country('vietnam', data)
+    for category in ('tours', 'visas'):
+        store.category_index(store.get_country('vietnam'), category).facet_counts('city')
+
+    store.insert_listings('vietnam', [{'id': 'n', 'title': 'Новый', 'city': 'Hoi An', 'category': 'tours'}])
+    store.update_listing('vietnam', 'tours', '1', {'hidden': True})
+    store.move_listing('vietnam', '2', 'tours', 'visas')
+    store.delete_listing('vietnam', 'tours', '0')
+
+    snapshot = store.get_country('vietnam')
+    for category in ('tours', 'visas'):
+        index = store.category_index(snapshot, category)
+        # Счётчики перенесены правками, а не посчитаны заново
+        assert 'city' in index._facet_counts
+        fresh = CategoryIndex(snapshot[category])
+        assert index.facet_counts('city') == fresh.facet_counts('city')
+        assert index.visible_count() == fresh.visible_count()